@@ -1,5 +1,9 @@
 import mysql.connector as mysql
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()  # take environment variables from .env
@@ -9,6 +13,11 @@ db_name = os.getenv("DATABASE_NAME")
 db_user = os.getenv("DATABASE_USER")
 db_password = os.getenv("DATABASE_PASSWORD")
 
+# Client errors of a connection the server has dropped: 2006 server has gone away, 2013 lost connection
+RECONNECT_ERRNOS = (2006, 2013)
+# Statements that leave nothing to lose when the connection drops before a commit
+READ_STATEMENTS = ("SELECT", "WITH", "SHOW", "SET", "DESCRIBE", "EXPLAIN")
+
 class DbConnector:
     """
     Connects to the MySQL server on the Ubuntu virtual machine.
@@ -20,33 +29,236 @@ class DbConnector:
     DATABASE = "testdb" // Database name, if you just want to connect to MySQL server, leave it empty
     USER = "testuser" // This is the user you created and added privileges for
     PASSWORD = "test123" // The password you set for said user
+
+    banner=False skips the query for the database name and the messages on connect and close.
+    The cursor reconnects when the server has dropped the connection (see ReconnectingCursor).
+    Session variables set with set_session are set again when ensure_connected reconnects; a
+    plain SET SESSION statement is lost with the connection.
+    A connector checked out of a ConnectionPool goes back to the pool on close_connection.
+    It can also be used as a context manager that closes it on exit.
     """
 
     def __init__(self,
                  HOST=db_host,
                  DATABASE=db_name,
                  USER=db_user,
-                 PASSWORD=db_password):
+                 PASSWORD=db_password,
+                 banner=True,
+                 pool=None):
+        self.banner = banner
+        self.pool = pool
+        self.session = {}  # variables of set_session, restored on reconnect
         # Connect to the database
         try:
             self.db_connection = mysql.connect(host=HOST, database=DATABASE, user=USER, password=PASSWORD, port=3306, allow_local_infile=True)
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
+            raise
+
+        # Get the db cursor, which keeps working across reconnects
+        self.cursor = ReconnectingCursor(self)
+
+        if banner:
+            print("Connected to:", self.db_connection.get_server_info())
+            # get database information
+            self.cursor.execute("select database();")
+            database_name = self.cursor.fetchone()
+            print("You are connected to the database:", database_name)
+            print("-----------------------------------------------\n")
+
+    def __enter__(self):
+        return self
 
-        # Get the db cursor
-        self.cursor = self.db_connection.cursor()
+    def __exit__(self, *exc):
+        self.close_connection()
 
-        print("Connected to:", self.db_connection.get_server_info())
-        # get database information
-        self.cursor.execute("select database();")
-        database_name = self.cursor.fetchone()
-        print("You are connected to the database:", database_name)
-        print("-----------------------------------------------\n")
+    def ensure_connected(self, attempts=3, delay=1):
+        """
+        Reconnects if the server has dropped the connection, e.g. after wait_timeout, and then
+        opens a new cursor behind self.cursor. Returns True if it had to reconnect.
+        """
+        if self.db_connection.is_connected():
+            return False
+        self.db_connection.reconnect(attempts=attempts, delay=delay)
+        self.cursor.cursor = self.db_connection.cursor()
+        for name, value in self.session.items():
+            self.cursor.cursor.execute(f"SET SESSION {name} = {value}")
+        return True
+
+    def set_session(self, name, value):
+        """
+        Sets a session variable, e.g. foreign_key_checks, and remembers it for ensure_connected.
+        """
+        self.cursor.execute(f"SET SESSION {name} = {value}")
+        self.session[name] = value
 
     def close_connection(self):
+        if self.pool is not None:
+            self.pool.checkin(self)
+            return
+        self.disconnect()
+
+    def disconnect(self):
         # close the cursor
         self.cursor.close()
         # close the DB connection
         self.db_connection.close()
-        print("\n-----------------------------------------------")
-        print("Connection to %s is closed" % self.db_connection.get_server_info())
+        if self.banner:
+            print("\n-----------------------------------------------")
+            print("Connection to %s is closed" % self.db_connection.get_server_info())
+
+
+class ReconnectingCursor:
+    """
+    The cursor of a DbConnector. A statement that fails because the server has dropped the
+    connection reconnects with ensure_connected and runs once more, unless a write since the
+    last commit would be lost with the connection; then the error is raised. Rows that were being
+    fetched when the connection dropped are not read again.
+    """
+
+    def __init__(self, connector):
+        self.connector = connector
+        self.cursor = connector.db_connection.cursor()
+        self.writes = False  # a write was executed in the open transaction
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def _run(self, method, operation, params):
+        if not self.connector.db_connection.in_transaction:
+            self.writes = False
+        write = (operation.split(None, 1) or [""])[0].upper() not in READ_STATEMENTS
+        try:
+            result = getattr(self.cursor, method)(operation, params)
+        except mysql.Error as e:
+            if e.errno not in RECONNECT_ERRNOS or self.writes:
+                raise
+            self.connector.ensure_connected()
+            result = getattr(self.cursor, method)(operation, params)
+        self.writes = self.writes or write
+        return result
+
+    def execute(self, operation, params=None):
+        return self._run("execute", operation, params)
+
+    def executemany(self, operation, seq_params):
+        return self._run("executemany", operation, seq_params)
+
+
+class ConnectionPool:
+    """
+    Up to size DbConnectors shared by the threads of one process. Connections are opened when
+    they are first needed and health checked on checkout: a connection the server has closed is
+    reconnected transparently. On checkin, an open transaction is rolled back, so the next user
+    gets a fresh snapshot. Remaining keyword arguments go to DbConnector.
+
+    Example:
+    pool = ConnectionPool(size=4)
+    with pool.connection() as connector:
+        connector.cursor.execute(...)
+    """
+
+    def __init__(self, size=4, **kwargs):
+        if size < 1:
+            raise ValueError("A connection pool needs at least one connection")
+        self.size = size
+        self.kwargs = kwargs
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def checkout(self, timeout=None):
+        """
+        A connected DbConnector, waiting up to timeout seconds (forever with None) when all size
+        connections are in use. Give it back with close_connection or checkin.
+        """
+        if self.closed:
+            raise RuntimeError("The connection pool is closed")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                connector = self.idle.get_nowait()
+                break
+            except queue.Empty:
+                pass
+            with self.lock:
+                create = self.created < self.size
+                self.created += create
+            if create:
+                try:
+                    return DbConnector(banner=False, pool=self, **self.kwargs)
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            # Wait in short steps, a discarded connection frees a slot without anything in idle
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if wait <= 0:
+                raise TimeoutError(f"All {self.size} pooled connections are in use")
+            try:
+                connector = self.idle.get(timeout=wait)
+                break
+            except queue.Empty:
+                continue
+        try:
+            connector.ensure_connected()
+        except Exception:
+            self.discard(connector)
+            raise
+        return connector
+
+    def checkin(self, connector):
+        if self.closed:
+            self.discard(connector)
+            return
+        try:
+            connector.db_connection.rollback()
+        except Exception:
+            self.discard(connector)
+            return
+        self.idle.put(connector)
+
+    def discard(self, connector):
+        with self.lock:
+            self.created -= 1
+        try:
+            connector.disconnect()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connector = self.checkout(timeout)
+        try:
+            yield connector
+        finally:
+            self.checkin(connector)
+
+    @contextmanager
+    def connections(self, count, timeout=None):
+        """
+        count connectors at once, as a list.
+        """
+        if count > self.size:
+            raise ValueError(f"Cannot check out {count} connections from a pool of {self.size}")
+        connectors = []
+        try:
+            for _ in range(count):
+                connectors.append(self.checkout(timeout))
+            yield connectors
+        finally:
+            for connector in connectors:
+                self.checkin(connector)
+
+    def close(self):
+        """
+        Closes the idle connections; connections that are checked out are closed on checkin.
+        """
+        self.closed = True
+        while True:
+            try:
+                connector = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connector)
@@ -1,20 +1,293 @@
 from unittest import result
 from DbConnector import DbConnector
 from tabulate import tabulate
-from datetime import timedelta
 import pandas as pd
-from scipy.spatial import cKDTree
-import numpy as np
 import os
-import warnings
+import time
+from utils import (OUTPUT_MESSAGE, PLAIN_OUTPUT_MESSAGE, column_exists, detect_coordinates, results_path,
+                   write_results)
+from polyline import COORDINATE_SCALE
+from trajectory import BYTES_PER_POINT
+from proximity import (PROXIMITY_METERS, PROXIMITY_SECONDS, close_taxi_pairs, database_trips, longest_trip_seconds,
+                       parallel_taxi_pairs, store_extent, store_trips)
+from trajectorystore import TrajectoryStore
+from tripsummary import summary_is_complete
+from spatialgrid import GRID_COLUMN, bounding_box, covering_ranges
+from pointtree import PointTree
+from querycache import CachedCursor
+from queryprofile import PROFILE_SUFFIX
+from streamtable import stream_table
 
-warnings.filterwarnings("ignore", category=UserWarning) #Added this to ignore pandas warnings during task 8
 
 class Queries:
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, output_dir="results", layout=None, point_tree=None, cache=None, pool=None, profiler=None):
+        """
+        layout selects where the trip-level tasks (4b, 5, 7, 9, 10, 11) read the trajectories from:
+        "path" joins the path and point tables, "trajectory" reads the packed blobs of trip_trajectory,
+        which insert_data(trajectories=True) fills, and "summary" reads the precomputed trip_summary.
+        By default trip_summary is used when it is marked complete (see tripsummary.mark_summary), so
+        a summary that a load without summaries or an interrupted rebuild left behind is not used.
+
+        point_tree is the directory of a pointtree.PointTree of the point table; trips_within then
+        finds the points in process instead of in SQL.
+
+        cache is a querycache.QueryCache; the SELECT statements of the tasks are then answered from it
+        as long as the tables they read have not changed. Only createtables.py bumps the table
+        versions, so the cache is opt-in: other writers, such as oldcode/insert_old_data.py or
+        manual SQL, would leave stale results in it.
+
+        pool is an optional DbConnector.ConnectionPool; the connection is then checked out of it and
+        close_connection gives it back.
+
+        profiler is a queryprofile.QueryProfiler; the SELECT statements of every task are then
+        profiled into taskNProfile.json next to taskNOutput.txt. Profiles are of queries that run,
+        so it cannot be combined with cache.
+        """
+        if layout not in (None, "path", "trajectory", "summary"):
+            raise ValueError(f"Unknown layout {layout!r}, expected 'path', 'trajectory' or 'summary'")
+        if cache is not None and profiler is not None:
+            raise ValueError("Profiling needs the queries to run, use cache=None with a profiler")
+        self.pool = pool
+        self.connection = pool.checkout() if pool is not None else DbConnector()
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+        self.output_dir = output_dir
+        if layout is None:
+            layout = "summary" if summary_is_complete(self.cursor) else "path"
+        self.layout = layout
+        self.coordinates = detect_coordinates(self.cursor)
+        self.grid = column_exists(self.cursor, "point", GRID_COLUMN)
+        self.point_tree = None
+        if point_tree is not None:
+            self.point_tree = PointTree(point_tree)
+            if not self.point_tree.is_current(self.cursor):
+                raise ValueError(f"The point tree in {point_tree} does not match the point table, "
+                                 f"rebuild it with: python pointtree.py build {point_tree}")
+        self.cache = cache
+        if cache is not None:
+            self.cursor = CachedCursor(self.connection.cursor, cache)
+        self.profiler = profiler
+        if profiler is not None:
+            self.cursor = profiler.wrap(self.connection.cursor)
+
+    def write_output(self, filename, output, message=OUTPUT_MESSAGE):
+        write_results(self.output_dir, filename, output, message)
+        self.write_profile(filename)
+
+    def write_profile(self, filename):
+        """
+        With a profiler, writes the profiles of the statements since the last output file next to
+        filename, e.g. task5Profile.json for task5Output.txt.
+        """
+        if self.profiler is None:
+            return
+        self.cursor.finish()
+        name = filename[:-len("Output.txt")] if filename.endswith("Output.txt") else os.path.splitext(filename)[0]
+        path = os.path.join(self.output_dir, name + PROFILE_SUFFIX)
+        scans = self.profiler.write(path, name)
+        print(f"Query profile written to {path}" + (f", with full scans of {', '.join(scans)}" if scans else ""))
+
+    def stream_output(self, filename, query, headers):
+        """
+        Runs query on an unbuffered cursor of its own and writes its rows to filename as they
+        arrive (see streamtable.PrettyTableWriter), so memory stays flat however many rows it
+        returns. Such results are read past the query cache, which would only hold a copy of them.
+        """
+        path = results_path(self.output_dir, filename)
+        start = time.perf_counter()
+        self.connection.ensure_connected()
+        cursor = self.db_connection.cursor(buffered=False)
+        if self.profiler is not None:
+            cursor = self.profiler.wrap(cursor)
+        try:
+            cursor.execute(query)
+            rows, firstRow, seconds = stream_table(cursor, path, headers, start=start)
+        finally:
+            cursor.close()
+        firstRow = f"{firstRow:.2f}s" if firstRow is not None else "-"
+        print(f"{OUTPUT_MESSAGE} {path} ({rows} rows, first row after {firstRow}, {seconds:.2f}s in total)")
+        self.write_profile(filename)
+
+    def coord(self, column):
+        """
+        SQL expression for a point coordinate column in degrees, whichever way the point table stores it.
+        """
+        return f"({column} / 1e6)" if self.coordinates == "fixed" else column
+
+    def coord_value(self, degrees):
+        """
+        A coordinate literal in the storage unit of the point table, for comparisons that can use its index.
+        """
+        return str(int(round(degrees * COORDINATE_SCALE))) if self.coordinates == "fixed" else f"{degrees:.7f}"
+
+    def trips_within(self, lat, lon, radius_m, limit=None):
+        """
+        Sorted originalTripIds of the trips with a point within radius_m meters of lat, lon, only
+        the first limit of them if limit is given.
+
+        With a point tree the points are looked up in it and only their trips come from SQL, see
+        trips_with_points. Otherwise the candidate points come from an index range scan per grid
+        row over point.gridCell when the table has it (CreateTables.add_point_grid), or else from a
+        latitude/longitude box, of which only the latitude bound can use the (latitude, longitude) index.
+        """
+        if self.point_tree is not None:
+            return self.trips_with_points(self.point_tree.within(lat, lon, radius_m))[:limit]
+        if self.grid:
+            where = " OR ".join(f"pt.{GRID_COLUMN} BETWEEN {first} AND {last}"
+                                for first, last in covering_ranges(lat, lon, radius_m))
+        else:
+            minLat, maxLat, minLon, maxLon = bounding_box(lat, lon, radius_m)
+            where = (f"pt.latitude BETWEEN {self.coord_value(minLat)} AND {self.coord_value(maxLat)} "
+                     f"AND pt.longitude BETWEEN {self.coord_value(minLon)} AND {self.coord_value(maxLon)}")
+        query = f"""
+            WITH NearbyPoints AS (
+                SELECT pt.pointId
+                FROM point AS pt
+                WHERE ({where})
+                  AND 2 * 6371000 * ASIN(
+                        SQRT(
+                            POWER(SIN(RADIANS(({self.coord('pt.latitude')} - {lat!r}) / 2)), 2) +
+                            COS(RADIANS({lat!r})) * COS(RADIANS({self.coord('pt.latitude')})) *
+                            POWER(SIN(RADIANS(({self.coord('pt.longitude')} - ({lon!r})) / 2)), 2)
+                        )
+                    ) <= {radius_m!r}
+            )
+            SELECT DISTINCT t.originalTripId
+            FROM NearbyPoints np
+            JOIN path p ON p.pointId = np.pointId
+            JOIN trip t ON t.tripId = p.tripId
+            ORDER BY t.originalTripId
+            {f"LIMIT {int(limit)}" if limit is not None else ""};
+        """
+        self.cursor.execute(query)
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def trips_with_points(self, pointIds, batch=10000):
+        """
+        Sorted originalTripIds of the trips that pass any of the given pointIds, through the
+        path.pointId index, batch pointIds per query.
+        """
+        pointIds = [int(pointId) for pointId in pointIds]
+        tripIds = set()
+        for first in range(0, len(pointIds), batch):
+            ids = pointIds[first:first + batch]
+            self.cursor.execute(f"""
+                SELECT DISTINCT t.originalTripId
+                FROM path p
+                JOIN trip t ON t.tripId = p.tripId
+                WHERE p.pointId IN ({', '.join(['%s'] * len(ids))})
+            """, ids)
+            tripIds.update(row[0] for row in self.cursor.fetchall())
+        return sorted(tripIds)
+
+    @staticmethod
+    def blob_coord(position):
+        """
+        SQL expression for the coordinate in degrees stored at the 1-based byte position of
+        trip_trajectory.points, a little-endian int32 of micro-degrees (see trajectory.py).
+        """
+        unsigned = f"CAST(CONV(HEX(REVERSE(SUBSTRING(points, {position}, 4))), 16, 10) AS SIGNED)"
+        return f"((({unsigned} + 2147483648) % 4294967296 - 2147483648) / 1e6)"
+
+    def trip_endpoints(self):
+        """
+        CTEs ending in tripEndpoints(tripId, startLat, startLon, endLat, endLon, DurationSeconds, DistanceMeters),
+        one row per trip with points, read from the layout of this Queries object.
+        DistanceMeters is the straight line between the first and the last point.
+        """
+        if self.layout == "summary":
+            return """
+            tripEndpoints AS (
+                SELECT
+                    tripId,
+                    startLat,
+                    startLon,
+                    endLat,
+                    endLon,
+                    durationSeconds AS DurationSeconds,
+                    distanceMeters AS DistanceMeters
+                FROM trip_summary
+            )"""
+        if self.layout == "trajectory":
+            last = f"(pointCount - 1) * {BYTES_PER_POINT}"
+            ends = f"""
+            tripEnds AS (
+                SELECT
+                    tripId,
+                    {self.blob_coord(1)} AS startLat,
+                    {self.blob_coord(5)} AS startLon,
+                    {self.blob_coord(last + ' + 1')} AS endLat,
+                    {self.blob_coord(last + ' + 5')} AS endLon,
+                    (pointCount - 1) * 15 AS DurationSeconds
+                FROM trip_trajectory
+                WHERE pointCount > 0
+            )"""
+        else:
+            ends = f"""
+            tripBoundaries AS (
+                SELECT
+                    tripId,
+                    MIN(idx) AS firstID,
+                    MAX(idx) AS lastID
+                FROM path
+                GROUP BY tripId
+            ),
+            tripEnds AS (
+                SELECT
+                    tb.tripId,
+                    {self.coord('pStart.latitude')}  AS startLat,
+                    {self.coord('pStart.longitude')} AS startLon,
+                    {self.coord('pEnd.latitude')}    AS endLat,
+                    {self.coord('pEnd.longitude')}   AS endLon,
+                    (tb.lastID - tb.firstID) * 15 AS DurationSeconds
+                FROM tripBoundaries tb
+                JOIN path ps ON ps.tripId = tb.tripId AND ps.idx = tb.firstID
+                JOIN point pStart ON pStart.pointId = ps.pointId
+                JOIN path pe ON pe.tripId = tb.tripId AND pe.idx = tb.lastID
+                JOIN point pEnd ON pEnd.pointId = pe.pointId
+            )"""
+        return ends + """,
+            tripEndpoints AS (
+                SELECT
+                    tripId,
+                    startLat,
+                    startLon,
+                    endLat,
+                    endLon,
+                    DurationSeconds,
+                    2 * 6371000 * ASIN(
+                        SQRT(
+                            POWER(SIN(RADIANS((endLat - startLat)/2)), 2) +
+                            COS(RADIANS(startLat)) * COS(RADIANS(endLat)) *
+                            POWER(SIN(RADIANS((endLon - startLon)/2)), 2)
+                        )
+                    ) AS DistanceMeters
+                FROM tripEnds
+            )"""
+
+    def trip_point_counts(self):
+        """
+        CTE tripPointCounts(tripId, pointCount), one row per trip with points.
+        """
+        if self.layout == "summary":
+            return """
+            tripPointCounts AS (
+                SELECT tripId, pointCount
+                FROM trip_summary
+            )"""
+        if self.layout == "trajectory":
+            return """
+            tripPointCounts AS (
+                SELECT tripId, pointCount
+                FROM trip_trajectory
+                WHERE pointCount > 0
+            )"""
+        return """
+            tripPointCounts AS (
+                SELECT tripId, COUNT(*) AS pointCount
+                FROM path
+                GROUP BY tripId
+            )"""
 
 
     # How many taxis, trips, and total GPS points are there?
@@ -39,10 +312,7 @@ class Queries:
             f"Total points:   {points_data[0]:,}\n"
         )
 
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task1Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task1Output.txt")
+        self.write_output("task1Output.txt", output)
 
         self.db_connection.commit()
     
@@ -59,10 +329,7 @@ class Queries:
         result = self.cursor.fetchone()
 
         output = f"Average trips per taxi: {result[0]}\n"
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task2Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to results/task2Output.txt")
+        self.write_output("task2Output.txt", output, message=PLAIN_OUTPUT_MESSAGE)
 
         self.db_connection.commit()
 
@@ -74,17 +341,14 @@ class Queries:
                 COUNT(*) AS Trips
             FROM trip
             GROUP BY taxiId
-            ORDER BY Trips DESC
+            ORDER BY Trips DESC, taxiId
             LIMIT 20;
         """
         self.cursor.execute(query)
         results = self.cursor.fetchall()
 
         output = tabulate(results, headers=["Taxi ID", "Trips"], tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task3Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to results/task3Output.txt")
+        self.write_output("task3Output.txt", output, message=PLAIN_OUTPUT_MESSAGE)
 
         self.db_connection.commit()
 
@@ -110,23 +374,21 @@ class Queries:
                     taxiId,
                     callType,
                     COUNT(*) AS callCount,
-                    ROW_NUMBER() OVER (PARTITION BY taxiId ORDER BY COUNT(*) DESC) AS rn
+                    ROW_NUMBER() OVER (PARTITION BY taxiId ORDER BY COUNT(*) DESC, callType) AS rn
                 FROM TripCallTypes
                 GROUP BY taxiId, callType
             )
             SELECT taxiId, callType, callCount
             FROM Counts
             WHERE rn = 1
+            ORDER BY taxiId
             """
 
         self.cursor.execute(query)
         results = self.cursor.fetchall()
 
         output = tabulate(results, headers=[desc[0] for desc in self.cursor.description], tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task4aOutput.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to results/task4aOutput.txt")
+        self.write_output("task4aOutput.txt", output, message=PLAIN_OUTPUT_MESSAGE)
 
         self.db_connection.commit()
 
@@ -134,43 +396,8 @@ class Queries:
     # #report the share of trips starting in four time bands: 00–06, 06–12, 12–18, and
     # 18–24.
     def task4b(self):
-        query = """
-         
-            WITH tripBoundaries AS (
-                SELECT
-                    p.tripId,
-                    MIN(p.idx) AS firstID,
-                    MAX(p.idx) AS lastID
-                FROM path AS p
-                GROUP BY p.tripId
-            ),
-            tripPoints AS (
-                SELECT
-                    tb.tripId,
-                    pf.latitude  AS startLat,
-                    pf.longitude AS startLon,
-                    pl.latitude  AS endLat,
-                    pl.longitude AS endLon,
-                    (tb.lastID - tb.firstID) * 15 AS Duration
-                FROM tripBoundaries AS tb
-                JOIN path AS pf_path ON pf_path.tripId = tb.tripId AND pf_path.idx = tb.firstID
-                JOIN point AS pf ON pf.pointId = pf_path.pointId
-                JOIN path AS pl_path ON pl_path.tripId = tb.tripId AND pl_path.idx = tb.lastID
-                JOIN point AS pl ON pl.pointId = pl_path.pointId
-            ),
-            tripDistance AS (
-                SELECT
-                    tripId,
-                    Duration,
-                    2 * 6371000 * ASIN(
-                        SQRT(
-                            POWER(SIN(RADIANS((endLat - startLat)/2)), 2) +
-                            COS(RADIANS(startLat)) * COS(RADIANS(endLat)) *
-                            POWER(SIN(RADIANS((endLon - startLon)/2)), 2)
-                        )
-                    ) AS Distance
-                FROM tripPoints
-            ),
+        query = f"""
+            WITH {self.trip_endpoints()},
             tripInfo AS (
                 SELECT
                     t.tripId,
@@ -180,12 +407,12 @@ class Queries:
                         ELSE 'Street'
                     END AS callType,
                     t.startTime,
-                    d.Duration / 60 AS DurationMinutes,
-                    d.Distance / 1000 AS DistanceKilometers
+                    d.DurationSeconds / 60 AS DurationMinutes,
+                    d.DistanceMeters / 1000 AS DistanceKilometers
                 FROM trip AS t
                 LEFT JOIN origin_call  AS oc ON oc.tripId = t.tripId
                 LEFT JOIN origin_stand AS os ON os.tripId = t.tripId
-                JOIN tripDistance AS d ON d.tripId = t.tripId
+                JOIN tripEndpoints AS d ON d.tripId = t.tripId
             )
             SELECT
                 callType,
@@ -205,59 +432,22 @@ class Queries:
 
         headers = [desc[0] for desc in self.cursor.description]
         output = tabulate(results, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task4bOutput.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to results/task4bOutput.txt")
+        self.write_output("task4bOutput.txt", output, message=PLAIN_OUTPUT_MESSAGE)
 
         self.db_connection.commit()
 
     #Find the taxis with the most total hours driven as well as total distance driven.
     #List them in order of total hours.
     def task5(self):
-        query = """
-            WITH tripBoundaries AS (
-                SELECT 
-                    tripId,
-                    MIN(idx) AS firstID,
-                    MAX(idx) AS lastID
-                FROM path
-                GROUP BY tripId
-            ),
-            tripMetrics AS (
-                SELECT
-                    tb.tripId,
-                    (tb.lastID - tb.firstID) * 15 AS DurationSeconds,
-                    pStart.latitude  AS startLat,
-                    pStart.longitude AS startLon,
-                    pEnd.latitude    AS endLat,
-                    pEnd.longitude   AS endLon
-                FROM tripBoundaries tb
-                JOIN path ps ON ps.tripId = tb.tripId AND ps.idx = tb.firstID
-                JOIN point pStart ON pStart.pointId = ps.pointId
-                JOIN path pe ON pe.tripId = tb.tripId AND pe.idx = tb.lastID
-                JOIN point pEnd ON pEnd.pointId = pe.pointId
-            ),
-            trip_distance AS (
-                SELECT
-                    tripId,
-                    DurationSeconds,
-                    2 * 6371000 * ASIN(
-                        SQRT(
-                            POWER(SIN(RADIANS((endLat - startLat)/2)), 2) +
-                            COS(RADIANS(startLat)) * COS(RADIANS(endLat)) *
-                            POWER(SIN(RADIANS((endLon - startLon)/2)), 2)
-                        )
-                    ) AS DistanceMeters
-                FROM tripMetrics
-            ),
+        query = f"""
+            WITH {self.trip_endpoints()},
             taxi_totals AS (
                 SELECT 
                     t.taxiId,
                     SUM(d.DurationSeconds) / 3600.0 AS TotalHours,
                     SUM(d.DistanceMeters) / 1000.0  AS TotalDistanceKm
                 FROM trip t
-                JOIN trip_distance d ON d.tripId = t.tripId
+                JOIN tripEndpoints d ON d.tripId = t.tripId
                 GROUP BY t.taxiId
             )
             SELECT 
@@ -265,73 +455,33 @@ class Queries:
                 ROUND(TotalHours, 2) AS TotalHours,
                 ROUND(TotalDistanceKm, 2) AS TotalDistanceKm
             FROM taxi_totals
-            ORDER BY TotalHours DESC
+            ORDER BY TotalHours DESC, taxiId
         """
-        self.cursor.execute(query)
-        results = self.cursor.fetchall()
-
         headers = ["Taxi ID", "Total Hours", "Total Kilometers"]
-        output = tabulate(results, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task5Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task5Output.txt")
+        self.stream_output("task5Output.txt", query, headers)
 
         self.db_connection.commit()
 
     # Find the trips that passed within 100 m of Porto City Hall.
     #(longitude, latitude) = (-8.62911, 41.15794)
-    def task6(self): 
-        query = """
-            WITH NearbyPoints AS (
-                SELECT 
-                    p.TripID,
-                    2 * 6371000 * ASIN(
-                        SQRT(
-                            POWER(SIN(RADIANS((pt.latitude - 41.15794) / 2)), 2) +
-                            COS(RADIANS(41.15794)) * COS(RADIANS(pt.latitude)) *
-                            POWER(SIN(RADIANS((pt.longitude - (-8.62911)) / 2)), 2)
-                        )
-                    ) AS DistanceToCityHall
-                FROM path AS p
-                JOIN point AS pt ON pt.PointID = p.PointID
-                WHERE 
-                    pt.latitude  BETWEEN 41.15794 - 0.0010 AND 41.15794 + 0.0010
-                    AND pt.longitude BETWEEN -8.62911 - 0.0015 AND -8.62911 + 0.0015
-            )
-            SELECT DISTINCT t.originalTripID
-            FROM NearbyPoints np
-            JOIN trip t ON np.TripID = t.TripID
-            WHERE np.DistanceToCityHall <= 100
-            ORDER BY t.originalTripID;
-        """
-        self.cursor.execute(query)
-        results = self.cursor.fetchall()
+    def task6(self):
+        results = [(tripId,) for tripId in self.trips_within(41.15794, -8.62911, 100, limit=20)]
 
-        output = tabulate(results[:20], headers=["tripId"], tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task6Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task6Output.txt")
+        output = tabulate(results, headers=["tripId"], tablefmt="pretty")
+        self.write_output("task6Output.txt", output)
 
         self.db_connection.commit()
     
     #Identify the number of invalid trips. An invalid trip is defined as a trip with fewer
     #than 3 GPS points
     def task7(self):
-        query = """
-            WITH PerTrip AS (
-                SELECT
-                  p.tripId,
-                  COUNT(*) AS TotalPoints
-                FROM path p
-                GROUP BY p.tripId
-            )
+        query = f"""
+            WITH {self.trip_point_counts()}
             SELECT
                 COUNT(*) AS InvalidTrips
             FROM trip t
-            LEFT JOIN PerTrip pt ON pt.tripId = t.tripId
-            WHERE COALESCE(pt.TotalPoints, 0) < 3;
+            LEFT JOIN tripPointCounts pt ON pt.tripId = t.tripId
+            WHERE COALESCE(pt.pointCount, 0) < 3;
         """
         self.cursor.execute(query)
         result = self.cursor.fetchone()
@@ -339,87 +489,74 @@ class Queries:
 
         headers = [desc[0] for desc in self.cursor.description]
         output = tabulate(result, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task7Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task7Output.txt")
+        self.write_output("task7Output.txt", output)
 
         self.db_connection.commit()
 
     #Find pairs of different taxis that were within 5m and within 5 seconds of each
     #other at least once.
-    def task8(self):
-        
-        self.cursor.execute("SELECT MIN(startTime), MAX(startTime) FROM trip;")
-        startDate, endDate = self.cursor.fetchone()
-        startDate = pd.to_datetime(startDate)
-        endDate = pd.to_datetime(endDate)
-        dateRanges = pd.date_range(start=startDate, end=endDate, freq="6D")
-        threshold = 5 / 111000
-        pairs = set()
-
-        for i, periodStart in enumerate(dateRanges):
-            periodEnd = periodStart + timedelta(days=6)
-
-            query = f"""
-                SELECT
-                    t.taxiId,
-                    t.startTime AS Time,
-                    pt.longitude,
-                    pt.latitude
-                FROM trip t
-                JOIN path p ON p.tripId = t.tripId
-                JOIN point pt ON pt.PointID = p.PointID
-                WHERE t.startTime >= '{periodStart.strftime('%Y-%m-%d')}'
-                  AND t.startTime < '{periodEnd.strftime('%Y-%m-%d')}';
-            """
-
-            df = pd.read_sql(query, self.db_connection)
-
-            if df.empty:
-                print("No data this week")
-                continue
-
-            df["Time"] = pd.to_datetime(df["Time"])
-            df.sort_values("Time", inplace=True)
-            df["timeBucket"] = (df["Time"].astype("int64") // 15000000000)
-
-            for bucket, window in df.groupby("timeBucket"):
-                if len(window) < 2:
-                    continue
-
-                coords = window[["longitude", "latitude"]].to_numpy()
-                taxis = window["taxiId"].to_numpy()
-
-                tree = cKDTree(coords)
-                closePairs = tree.query_pairs(r=threshold)
-
-                for a, b in closePairs:
-                    if taxis[a] != taxis[b]:
-                        pairs.add(tuple(sorted((int(taxis[a]), int(taxis[b])))))
-
-            print(f"Period {i+1}/{len(dateRanges)} done")
-
-        result = pd.DataFrame(list(pairs), columns=["TaxiA", "TaxiB"])
+    def task8(self, workers=None, store=None):
+        """
+        Pairs of different taxis that were within 5 m and 5 s of each other, with the time of every
+        point (startTime + idx * 15 s). The points are streamed in time order through a
+        proximity.ProximityJoin, so memory does not grow with the period that is scanned.
+
+        Partitions of 6 days run in parallel in workers processes (all cores by default), each
+        with its own connection; workers=1 streams everything over this connection instead. With
+        store, the trajectories are read from the TrajectoryStore in that directory.
+
+        A pool cannot be shared with other processes, so with a pool the partitions open their own
+        connections, at most as many at a time as the pool holds. With a profiler, workers defaults
+        to 1, so that every statement runs on the profiled connection. The points bypass the cache,
+        which would only hold a copy of the tables.
+        """
+        if workers is None and self.profiler is not None:
+            workers = 1
+        elif workers is None and self.pool is not None:
+            workers = self.pool.size
+        layout = "trajectory" if self.layout == "trajectory" else "path"
+        if store is not None:
+            start, end, lookback = store_extent(store)
+        else:
+            self.cursor.execute("SELECT MIN(startTime), MAX(startTime) FROM trip;")
+            startDate, endDate = self.cursor.fetchone()
+            start = end = 0
+            if startDate is not None:
+                start = pd.Timestamp(startDate).value // 10**9
+                end = pd.Timestamp(endDate).value // 10**9 + 1
+
+        if end <= start:
+            pairs = []
+        elif workers == 1:
+            if store is not None:
+                trips = store_trips(TrajectoryStore(store), start, end)
+            else:
+                cursor = self.connection.cursor if self.cache is not None else self.cursor
+                trips = database_trips(cursor, start, end, layout=layout, coordinates=self.coordinates)
+            pairs = close_taxi_pairs(trips, PROXIMITY_METERS, PROXIMITY_SECONDS)
+        else:
+            if store is None:
+                lookback = longest_trip_seconds(self.cursor, self.layout)
+            pairs = parallel_taxi_pairs(store if store is not None else "database", start, end, lookback,
+                                        layout=layout, coordinates=self.coordinates, workers=workers)
+
+        result = pd.DataFrame(pairs, columns=["TaxiA", "TaxiB"])
         output = result.to_string(index=False)
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task8Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task8Output.txt")
+        self.write_output("task8Output.txt", output)
 
         self.db_connection.commit()
 
     #Find the trips that started on one calendar day and ended on the next (midnightcrossers).
     def task9(self):
-        query = """
-            WITH PerTrip AS (
+        query = f"""
+            WITH {self.trip_point_counts()},
+            PerTrip AS (
                 SELECT
                     t.TripID,
                     t.startTime AS StartTime,
-                    (GREATEST(COUNT(*) - 1, 0) * 15) AS Duration
+                    (GREATEST(pc.pointCount - 1, 0) * 15) AS Duration
                 FROM trip t
-                JOIN path p ON p.TripID = t.TripID
-                GROUP BY t.TripID, t.startTime
+                JOIN tripPointCounts pc ON pc.tripId = t.TripID
             ),
             EndCompute AS (
                 SELECT
@@ -434,90 +571,48 @@ class Queries:
             WHERE DATE(ec.StartTime) <> DATE(ec.EndTime)
             ORDER BY t.originalTripID;
         """
-        self.cursor.execute(query)
-        results = self.cursor.fetchall()
-
         headers = ["Trip ID"]
-        output = tabulate(results, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task9Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task9Output.txt")
+        self.stream_output("task9Output.txt", query, headers)
 
         self.db_connection.commit()
     
     #Find the trips whose start and end points are within 50 m of each other (circular
     #trips).
     def task10(self):
-        query = """
-            WITH tripBoundaries AS (
-                SELECT 
-                    TripID,
-                    MIN(idx) AS firstID,
-                    MAX(idx) AS lastID
-                FROM path
-                GROUP BY TripID
-            ),
-            tripPoints AS (
-                SELECT
-                    tb.TripID,
-                    pStart.latitude  AS startLat,
-                    pStart.longitude AS startLon,
-                    pEnd.latitude    AS endLat,
-                    pEnd.longitude   AS endLon
-                FROM tripBoundaries tb
-                JOIN path ps ON ps.TripID = tb.TripID AND ps.idx = tb.firstID
-                JOIN point pStart ON pStart.PointID = ps.PointID
-                JOIN path pe ON pe.TripID = tb.TripID AND pe.idx = tb.lastID
-                JOIN point pEnd ON pEnd.PointID = pe.PointID
-            )
+        query = f"""
+            WITH {self.trip_endpoints()}
             SELECT 
                 t.originalTripID
-            FROM tripPoints tp
-            JOIN trip t ON tp.TripID = t.TripID
-            WHERE 2 * 6371000 * ASIN(
-                    SQRT(
-                        POWER(SIN(RADIANS((endLat - startLat)/2)), 2) +
-                        COS(RADIANS(startLat)) * COS(RADIANS(endLat)) *
-                        POWER(SIN(RADIANS((endLon - startLon)/2)), 2)
-                    )
-                ) < 50
+            FROM tripEndpoints tp
+            JOIN trip t ON tp.tripId = t.TripID
+            WHERE tp.DistanceMeters < 50
             ORDER BY t.originalTripID;
 
         """
-        self.cursor.execute(query)
-        results = self.cursor.fetchall()
-
         headers = ["Trip ID"]
-        output = tabulate(results, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task10Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task10Output.txt")
+        self.stream_output("task10Output.txt", query, headers)
 
         self.db_connection.commit()
 
     #For each taxi, compute the average idle time between consecutive trips. List the
     #top 20 taxis with the highest average idle time.
     def task11(self):
-        query = """
-        WITH trip_times AS (
+        query = f"""
+        WITH {self.trip_point_counts()},
+        trip_times AS (
             SELECT 
-                tripId,
+                trip.tripId,
                 taxiId,
                 startTime,
-                startTime + INTERVAL ((
-                    SELECT MAX(idx) 
-                    FROM path 
-                    WHERE path.tripId = trip.tripId
-                ) * 15) SECOND AS endTime
+                startTime + INTERVAL ((pc.pointCount - 1) * 15) SECOND AS endTime
             FROM trip
+            LEFT JOIN tripPointCounts pc ON pc.tripId = trip.tripId
         ),
         idle_times AS (
             SELECT
                 taxiId,
                 endTime,
-                LEAD(startTime) OVER (PARTITION BY taxiId ORDER BY startTime) AS nextStartTime
+                LEAD(startTime) OVER (PARTITION BY taxiId ORDER BY startTime, tripId) AS nextStartTime
             FROM trip_times
         )
         SELECT
@@ -527,7 +622,7 @@ class Queries:
         FROM idle_times
         WHERE nextStartTime IS NOT NULL
         GROUP BY taxiId
-        ORDER BY avgIdleMinutes DESC
+        ORDER BY avgIdleMinutes DESC, taxiId
         LIMIT 20;
         """
         self.cursor.execute(query)
@@ -535,10 +630,7 @@ class Queries:
 
         headers = [desc[0] for desc in self.cursor.description]
         output = tabulate(results, headers=headers, tablefmt="pretty")
-        os.makedirs("results", exist_ok=True)
-        with open(os.path.join("results", "task11Output.txt"), "w", encoding="utf-8") as f:
-            f.write(output)
-        print("Full output written to file in results/task11Output.txt")
+        self.write_output("task11Output.txt", output)
 
         self.db_connection.commit()
 
@@ -0,0 +1,44 @@
+import argparse
+import time
+
+from createtables import CreateTables, parse_chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the same porto.csv chunk with every ingestion backend and compare rows/sec. "
+                    "DROPS AND RECREATES ALL TABLES before each backend, so only run it against a scratch database."
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--trips", type=int, default=10000)
+    parser.add_argument("--modes", nargs="+", default=["executemany", "infile", "executemany:client", "infile:client"],
+                        help="backend[:point_ids] combinations, see CreateTables.insert_data")
+    parser.add_argument("--reset", action="store_true", help="Confirm that the tables may be dropped")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("refusing to drop tables without --reset")
+
+    program = CreateTables()
+    try:
+        df = program.read_porto_csv(args.csv, end_row=args.trips)
+        for mode in args.modes:
+            backend, _, point_ids = mode.partition(":")
+            point_ids = point_ids or "staging"
+            chunk = parse_chunk(df, 1, path_rows=(backend == "executemany" and point_ids == "staging"))
+            rows = chunk.size + len(chunk.origin_calls) + len(chunk.origin_stands) + chunk.points
+            program.clean_database()
+            program.create_all_tables()
+            program.set_writer_options(backend, point_ids)
+            program.point_dictionary = None
+
+            start = time.perf_counter()
+            program.write_chunk(chunk)
+            seconds = time.perf_counter() - start
+            program.close_infile_loader()
+            print(f"{mode:>20}: {rows:,} rows in {seconds:.2f}s -> {rows / seconds:,.0f} rows/sec")
+    finally:
+        program.connection.close_connection()
+
+
+if __name__ == "__main__":
+    main()
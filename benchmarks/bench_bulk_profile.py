@@ -0,0 +1,65 @@
+import argparse
+import re
+import time
+
+from createtables import CreateTables
+
+
+def schema_snapshot(program):
+    """
+    SHOW CREATE TABLE of the five tables, without the AUTO_INCREMENT counter.
+    """
+    snapshot = {}
+    for table in ("trip", "point", "path", "origin_call", "origin_stand"):
+        program.cursor.execute(f"SHOW CREATE TABLE {table}")
+        snapshot[table] = re.sub(r" AUTO_INCREMENT=\d+", "", program.cursor.fetchone()[1])
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time a load of the first --trips rows with the standard and the bulk table profile, "
+                    "and check that both end with the same schema. DROPS ALL TABLES, only use a scratch database."
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--trips", type=int, default=100000)
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--point-ids", default="client", choices=["staging", "client"])
+    parser.add_argument("--backend", default="executemany", choices=["executemany", "infile"])
+    parser.add_argument("--reset", action="store_true", help="Confirm that the tables may be dropped")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("refusing to drop tables without --reset")
+
+    program = CreateTables()
+    load = dict(filepath=args.csv, end_row=args.trips, chunksize=args.chunksize,
+                backend=args.backend, point_ids=args.point_ids)
+    try:
+        program.clean_database()
+        program.point_dictionary = None
+        start = time.perf_counter()
+        program.create_all_tables()
+        program.insert_data(**load)
+        standard = time.perf_counter() - start
+        standardSchema = schema_snapshot(program)
+
+        program.clean_database()
+        program.point_dictionary = None
+        start = time.perf_counter()
+        program.bulk_load(**load)
+        bulk = time.perf_counter() - start
+        bulkSchema = schema_snapshot(program)
+
+        print(f"standard profile: {standard:.1f}s")
+        print(f"    bulk profile: {bulk:.1f}s ({standard / bulk:.2f}x)")
+        for table in standardSchema:
+            if standardSchema[table] != bulkSchema[table]:
+                print(f"Schema of {table} differs:\n{standardSchema[table]}\n{bulkSchema[table]}")
+        if standardSchema == bulkSchema:
+            print("Both profiles end with the same schema.")
+    finally:
+        program.connection.close_connection()
+
+
+if __name__ == "__main__":
+    main()
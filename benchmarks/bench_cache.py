@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from tabulate import tabulate
+
+from metrics import peak_memory_mb
+from portodata import build_cache, cache_is_fresh, polylines, read_porto
+
+
+def timed(read):
+    start = time.perf_counter()
+    df = read()
+    lat, _, _ = polylines(df)
+    return time.perf_counter() - start, len(df), len(lat)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time reading porto.csv and decoding all polylines from the csv text and from the columnar cache"
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    args = parser.parse_args()
+
+    if not cache_is_fresh(args.csv):
+        start = time.perf_counter()
+        build_cache(args.csv)
+        print(f"Built the cache in {time.perf_counter() - start:.1f}s")
+
+    rows = []
+    for name, read in (("csv", lambda: read_porto(args.csv, use_cache=False)), ("cache", lambda: read_porto(args.csv))):
+        seconds, trips, points = timed(read)
+        rows.append((name, f"{seconds:.2f}", f"{trips:,}", f"{points:,}"))
+    print(tabulate(rows, headers=["Source", "Seconds", "Trips", "Points"], tablefmt="pretty"))
+    print(f"Peak memory: {peak_memory_mb()} MB")
+
+
+if __name__ == "__main__":
+    main()
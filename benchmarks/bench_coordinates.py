@@ -0,0 +1,80 @@
+import argparse
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from createtables import CreateTables
+from Queries import Queries
+
+
+def table_sizes(cursor, tables=("point", "path")):
+    """
+    (table, data MB, index MB) from information_schema, after refreshing the statistics.
+    """
+    sizes = []
+    for table in tables:
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+            """,
+            (table,)
+        )
+        data, index = cursor.fetchone()
+        sizes.append((table, data / 2**20, index / 2**20))
+    return sizes
+
+
+def time_task(queries, task, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        getattr(queries, task)()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the same rows with DOUBLE and with fixed-point coordinates, then compare table and "
+                    "index sizes and task6/task10 runtimes. DROPS ALL TABLES, only use a scratch database."
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--trips", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reset", action="store_true", help="Confirm that the tables may be dropped")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("refusing to drop tables without --reset")
+
+    rows = []
+    outputDir = tempfile.mkdtemp(prefix="bench_coordinates_")
+    for layout in ("double", "fixed"):
+        program = CreateTables()
+        try:
+            program.clean_database()
+            program.create_all_tables(coordinates=layout)
+            program.insert_data(filepath=args.csv, end_row=args.trips, point_ids="client")
+            sizes = table_sizes(program.cursor)
+        finally:
+            program.connection.close_connection()
+
+        queries = Queries(output_dir=outputDir)
+        try:
+            task6 = time_task(queries, "task6", args.repeat)
+            task10 = time_task(queries, "task10", args.repeat)
+        finally:
+            queries.connection.close_connection()
+
+        for table, data, index in sizes:
+            rows.append((layout, table, f"{data:.1f}", f"{index:.1f}", "", ""))
+        rows.append((layout, "", "", "", f"{task6:.2f}", f"{task10:.2f}"))
+
+    print(tabulate(rows, headers=["Layout", "Table", "Data MB", "Index MB", "task6 s", "task10 s"], tablefmt="pretty"))
+
+
+if __name__ == "__main__":
+    main()
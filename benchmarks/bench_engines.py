@@ -0,0 +1,63 @@
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from numpyqueries import NumpyQueries
+from Queries import Queries
+from benchmarks.bench_tasks import TASKS
+
+
+def timed(queries, task, **kwargs):
+    start = time.perf_counter()
+    getattr(queries, task)(**kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run tasks on MySQL with Queries and in process with NumpyQueries, and compare their "
+                    "times and whether their results files are byte for byte the same. The store has to "
+                    "hold the trips of the configured database, e.g. from trajectorystore.py"
+    )
+    parser.add_argument("--tasks", nargs="+", default=TASKS)
+    parser.add_argument("--store", default="trajectories")
+    parser.add_argument("--layout", choices=["path", "trajectory", "summary"])
+    parser.add_argument("--keep", help="Copy both results folders here, as sql/ and numpy/")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_engines_")
+    sqlDir, numpyDir = os.path.join(directory, "sql"), os.path.join(directory, "numpy")
+    queries = Queries(output_dir=sqlDir, layout=args.layout)
+    rows = []
+    try:
+        start = time.perf_counter()
+        engine = NumpyQueries(args.store, numpyDir)
+        loadSeconds = time.perf_counter() - start
+        for task in args.tasks:
+            # task8 on MySQL reads the points from the database, not from the store, so that both
+            # time scales are compared; see NumpyQueries.task8 for where they can differ
+            sqlSeconds = timed(queries, task)
+            numpySeconds = timed(engine, task)
+            filename = f"{task}Output.txt"
+            same = filecmp.cmp(os.path.join(sqlDir, filename), os.path.join(numpyDir, filename), shallow=False)
+            rows.append((task, f"{sqlSeconds:.3f}", f"{numpySeconds:.3f}",
+                         f"{sqlSeconds / numpySeconds:.1f}x" if numpySeconds else "-", "" if same else "DIFFERENT"))
+        if args.keep:
+            shutil.copytree(directory, args.keep, dirs_exist_ok=True)
+    finally:
+        queries.connection.close_connection()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(tabulate(rows, headers=["Task", "MySQL (s)", "NumPy (s)", "Speedup", ""], tablefmt="pretty"))
+    print(f"NumpyQueries opened the store in {loadSeconds:.3f}s")
+    if any(row[-1] for row in rows):
+        print("Some results differ, compare them with --keep")
+
+
+if __name__ == "__main__":
+    main()
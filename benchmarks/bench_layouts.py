@@ -0,0 +1,112 @@
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from tabulate import tabulate
+
+from benchmarks.bench_coordinates import table_sizes, time_task
+from createtables import CreateTables
+from polyline import COORDINATE_SCALE, from_fixed
+from Queries import Queries
+from trajectory import BYTES_PER_POINT, decode_trajectories, decode_trajectory
+
+
+TRIP_TASKS = ["task4b", "task5", "task7", "task9", "task10", "task11"]
+LAYOUTS = ["path", "trajectory", "summary"]
+DECODE_BATCH = 10000
+
+
+def time_decode(cursor, repeat):
+    """
+    Best times to turn the trip_trajectory blobs into degrees, in batches like fetch_trajectories:
+    through the one copy of decode_trajectories, and from per-blob decode_trajectory views
+    written straight into the float arrays of the batch.
+    """
+    cursor.execute("SELECT points FROM trip_trajectory ORDER BY tripId")
+    blobs = [row[0] for row in cursor.fetchall()]
+    batches = [blobs[i:i + DECODE_BATCH] for i in range(0, len(blobs), DECODE_BATCH)]
+
+    def joined():
+        for batch in batches:
+            lat, lon, _ = decode_trajectories(batch)
+            from_fixed(lat), from_fixed(lon)
+
+    def views():
+        for batch in batches:
+            counts = np.fromiter((len(blob) // BYTES_PER_POINT for blob in batch), dtype=np.int64, count=len(batch))
+            offsets = np.r_[0, np.cumsum(counts)]
+            lat, lon = np.empty(offsets[-1]), np.empty(offsets[-1])
+            for blob, start, end in zip(batch, offsets[:-1].tolist(), offsets[1:].tolist()):
+                blobLat, blobLon = decode_trajectory(blob)
+                np.divide(blobLat, COORDINATE_SCALE, out=lat[start:end])
+                np.divide(blobLon, COORDINATE_SCALE, out=lon[start:end])
+
+    best = {}
+    for name, decode in (("one copy per batch", joined), ("per-blob views", views)):
+        best[name] = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decode()
+            best[name] = min(best[name], time.perf_counter() - start)
+    return len(blobs), best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load rows with trip_trajectory blobs and trip_summary, then time the trip-level tasks on "
+                    "every layout and check that they write the same output as the path layout. Also times "
+                    "decoding the trajectory blobs. "
+                    "DROPS ALL TABLES, only use a scratch database."
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--trips", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tasks", nargs="+", default=TRIP_TASKS)
+    parser.add_argument("--reset", action="store_true", help="Confirm that the tables may be dropped")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("refusing to drop tables without --reset")
+
+    program = CreateTables()
+    try:
+        program.clean_database()
+        program.create_all_tables(trajectories=True)
+        program.insert_data(filepath=args.csv, end_row=args.trips, point_ids="client", trajectories=True)
+        sizes = table_sizes(program.cursor, tables=("point", "path", "trip_trajectory", "trip_summary"))
+        blobCount, decodeTimes = time_decode(program.cursor, args.repeat)
+    finally:
+        program.connection.close_connection()
+
+    timings = {}
+    outputDirs = {}
+    for layout in LAYOUTS:
+        outputDirs[layout] = tempfile.mkdtemp(prefix=f"bench_layouts_{layout}_")
+        queries = Queries(output_dir=outputDirs[layout], layout=layout)
+        try:
+            timings[layout] = {task: time_task(queries, task, args.repeat) for task in args.tasks}
+        finally:
+            queries.connection.close_connection()
+
+    rows = []
+    for task in args.tasks:
+        filename = f"{task}Output.txt"
+        row = [task]
+        for layout in LAYOUTS:
+            same = filecmp.cmp(os.path.join(outputDirs["path"], filename),
+                               os.path.join(outputDirs[layout], filename), shallow=False)
+            row.append(f"{timings[layout][task]:.2f}" + ("" if same else " (differs)"))
+        rows.append(row)
+
+    print(tabulate([(table, f"{data:.1f}", f"{index:.1f}") for table, data, index in sizes],
+                   headers=["Table", "Data MB", "Index MB"], tablefmt="pretty"))
+    print(tabulate(rows, headers=["Task"] + [f"{layout} s" for layout in LAYOUTS], tablefmt="pretty"))
+    print(f"Decoding {blobCount} trajectory blobs to degrees: "
+          + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in decodeTimes.items()))
+
+
+if __name__ == "__main__":
+    main()
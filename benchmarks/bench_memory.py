@@ -0,0 +1,87 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import pandas as pd
+from tabulate import tabulate
+
+from createtables import parse_chunk
+from metrics import peak_memory_mb
+from portodata import polylines, read_porto
+
+
+def run_eda(csv, typed):
+    """
+    The data preparation of eda.py without the plots: the full frame, the derived time columns
+    and the holiday flag, computed the way eda.py did before the typed reader (typed=False) or now.
+    """
+    df = read_porto(csv, use_cache=False, typed=typed)
+    df['start_time'] = pd.to_datetime(df['TIMESTAMP'], unit='s')
+    holidays = {(12, 31), (1, 1), (4, 25), (5, 1), (6, 10), (8, 15), (10, 5), (11, 1), (12, 1), (12, 8), (12, 24), (12, 25)}
+    if typed:
+        df['start_month'] = df['start_time'].dt.month.astype('int8')
+        df['start_day'] = df['start_time'].dt.day.astype('int8')
+        keys = [month * 100 + day for month, day in holidays]
+        df['is_holiday'] = (df['start_month'].astype('int16') * 100 + df['start_day']).isin(keys)
+    else:
+        df['start_month'], df['start_day'] = df['start_time'].dt.month, df['start_time'].dt.day
+        df['is_holiday'] = df.apply(lambda row: (row.start_month, row.start_day) in holidays, axis=1)
+    polylines(df)
+    return len(df), int(df.memory_usage(deep=True).sum())
+
+
+def run_ingest(csv, typed, chunksize=10000):
+    """
+    The read and parse side of insert_data, without a database.
+    """
+    trips = 0
+    largest = 0
+    for df in read_porto(csv, chunksize=chunksize, use_cache=False, typed=typed):
+        largest = max(largest, int(df.memory_usage(deep=True).sum()))
+        trips += parse_chunk(df, trips + 1, path_rows=False).size
+    return trips, largest
+
+
+def measure(workload, csv, typed):
+    """
+    Runs one workload in a fresh interpreter, since the peak RSS of a process only grows.
+    """
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_memory", "--child", workload, "--csv", csv]
+        + ([] if typed else ["--untyped"]),
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Peak memory of the EDA data preparation and of the ingestion read/parse loop, "
+                    "with pandas' default dtypes and with the typed reader of portodata"
+    )
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--child", choices=["eda", "ingest"], help=argparse.SUPPRESS)
+    parser.add_argument("--untyped", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        start = time.perf_counter()
+        rows, frameBytes = (run_eda if args.child == "eda" else run_ingest)(args.csv, not args.untyped)
+        print(json.dumps({"rows": rows, "frameMb": round(frameBytes / 2**20, 1), "peakMb": peak_memory_mb(),
+                          "seconds": round(time.perf_counter() - start, 2)}))
+        return
+
+    rows = []
+    for workload in ("eda", "ingest"):
+        for typed in (False, True):
+            result = measure(workload, args.csv, typed)
+            rows.append((workload, "typed" if typed else "default", f"{result['rows']:,}", result["frameMb"],
+                         result["peakMb"], result["seconds"]))
+    print(tabulate(rows, headers=["Workload", "dtypes", "Rows", "Frame MB", "Peak RSS MB", "Seconds"],
+                   tablefmt="pretty"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import ast
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from polyline import decode_polylines
+
+
+def synthetic_polylines(trips, mean_points=48, seed=0):
+    """
+    Builds POLYLINE strings in the porto.csv format, with random walks around Porto.
+    """
+    rng = np.random.default_rng(seed)
+    polylines = []
+    for n in rng.poisson(mean_points, size=trips):
+        lon = -8.61 + np.cumsum(rng.normal(0, 0.0005, n))
+        lat = 41.15 + np.cumsum(rng.normal(0, 0.0005, n))
+        polylines.append("[" + ",".join(f"[{x:.6f},{y:.6f}]" for x, y in zip(lon, lat)) + "]")
+    return polylines
+
+
+def parse_literal_eval(polylines):
+    # The old per-row approach used in insert_data
+    points = []
+    for poly in polylines:
+        for lon, lat in ast.literal_eval(poly or '[]'):
+            points.append((float(lat), float(lon)))
+    return len(points)
+
+
+def parse_vectorized(polylines):
+    lat, _, _ = decode_polylines(polylines)
+    return len(lat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare POLYLINE parsing throughput")
+    parser.add_argument("--csv", default="porto.csv", help="Use the first --trips rows of this file if it exists")
+    parser.add_argument("--trips", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if os.path.exists(args.csv):
+        polylines = pd.read_csv(args.csv, usecols=["POLYLINE"], nrows=args.trips)["POLYLINE"].tolist()
+    else:
+        polylines = synthetic_polylines(args.trips)
+
+    for name, parse in (("ast.literal_eval", parse_literal_eval), ("decode_polylines", parse_vectorized)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            points = parse(polylines)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>18}: {points:,} points in {best:.3f}s -> {points / best:,.0f} points/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from Queries import Queries
+from querycache import QueryCache
+
+
+TASKS = ["task1", "task2", "task3", "task4a", "task4b", "task5", "task6", "task7", "task9", "task10", "task11"]
+
+
+def run_task(queries, task):
+    start = time.perf_counter()
+    getattr(queries, task)()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the tasks without a cache, then twice on an empty query cache (cold and warm), "
+                    "and check that all three runs write the same output"
+    )
+    parser.add_argument("--tasks", nargs="+", default=TASKS)
+    parser.add_argument("--max-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_query_cache_")
+    cache = QueryCache(os.path.join(directory, "cache"), max_bytes=args.max_mb * 2**20)
+    runs = {"uncached": None, "cold": cache, "warm": cache}
+    timings = {}
+    for name, runCache in runs.items():
+        queries = Queries(output_dir=os.path.join(directory, name), cache=runCache)
+        try:
+            timings[name] = {task: run_task(queries, task) for task in args.tasks}
+        finally:
+            queries.connection.close_connection()
+
+    rows = []
+    for task in args.tasks:
+        filename = f"{task}Output.txt"
+        same = all(filecmp.cmp(os.path.join(directory, "uncached", filename), os.path.join(directory, name, filename),
+                               shallow=False) for name in ("cold", "warm"))
+        rows.append([task] + [f"{timings[name][task]:.3f}" for name in runs] + ["yes" if same else "NO"])
+    print(tabulate(rows, headers=["Task", "uncached s", "cold s", "warm s", "Same output"], tablefmt="pretty"))
+    print("Cache:", cache.stats())
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
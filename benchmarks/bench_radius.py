@@ -0,0 +1,110 @@
+import argparse
+import time
+
+from tabulate import tabulate
+
+from createtables import CreateTables
+from Queries import Queries
+from pointtree import PointTree
+from spatialgrid import bounding_box
+
+
+CITY_HALL = (41.15794, -8.62911)
+
+
+def task6_query(queries, lat, lon, radius_m):
+    """
+    The original task6 query for any radius: a latitude/longitude box on point joined with path
+    before the haversine filter.
+    """
+    minLat, maxLat, minLon, maxLon = bounding_box(lat, lon, radius_m)
+    query = f"""
+        WITH NearbyPoints AS (
+            SELECT
+                p.TripID,
+                2 * 6371000 * ASIN(
+                    SQRT(
+                        POWER(SIN(RADIANS(({queries.coord('pt.latitude')} - {lat!r}) / 2)), 2) +
+                        COS(RADIANS({lat!r})) * COS(RADIANS({queries.coord('pt.latitude')})) *
+                        POWER(SIN(RADIANS(({queries.coord('pt.longitude')} - ({lon!r})) / 2)), 2)
+                    )
+                ) AS DistanceToCenter
+            FROM path AS p
+            JOIN point AS pt ON pt.PointID = p.PointID
+            WHERE
+                pt.latitude  BETWEEN {queries.coord_value(minLat)} AND {queries.coord_value(maxLat)}
+                AND pt.longitude BETWEEN {queries.coord_value(minLon)} AND {queries.coord_value(maxLon)}
+        )
+        SELECT DISTINCT t.originalTripID
+        FROM NearbyPoints np
+        JOIN trip t ON np.TripID = t.TripID
+        WHERE np.DistanceToCenter <= {radius_m!r}
+        ORDER BY t.originalTripID;
+    """
+    queries.cursor.execute(query)
+    return [row[0] for row in queries.cursor.fetchall()]
+
+
+def best_of(repeat, function, *args):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the trips within a radius of Porto City Hall with the original task6 query, with "
+                    "trips_within on a latitude/longitude box, on the point grid index and, with --point-tree, "
+                    "on a persisted point tree"
+    )
+    parser.add_argument("--radii", type=float, nargs="+", default=[25, 100, 250, 1000, 2500])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--add-grid", action="store_true",
+                        help="Add the grid cell index to the point table first if it does not have it")
+    parser.add_argument("--point-tree", help="Directory of a point tree, see pointtree.py")
+    args = parser.parse_args()
+
+    if args.add_grid:
+        program = CreateTables()
+        try:
+            program.add_point_grid()
+        finally:
+            program.connection.close_connection()
+
+    queries = Queries()
+    tree = None
+    if args.point_tree:
+        start = time.perf_counter()
+        tree = PointTree(args.point_tree)
+        print(f"Loaded the point tree of {len(tree):,} points in {time.perf_counter() - start:.2f}s")
+    try:
+        if not queries.grid:
+            parser.error("the point table has no grid cell column, run with --add-grid")
+        rows = []
+        for radius in args.radii:
+            original, expected = best_of(args.repeat, task6_query, queries, *CITY_HALL, radius)
+            queries.grid = False
+            box, boxTrips = best_of(args.repeat, queries.trips_within, *CITY_HALL, radius)
+            queries.grid = True
+            grid, gridTrips = best_of(args.repeat, queries.trips_within, *CITY_HALL, radius)
+            same = boxTrips == expected and gridTrips == expected
+            row = [f"{radius:g}", len(expected), f"{original:.3f}", f"{box:.3f}", f"{grid:.3f}"]
+            if tree is not None:
+                queries.point_tree = tree
+                treeSeconds, treeTrips = best_of(args.repeat, queries.trips_within, *CITY_HALL, radius)
+                queries.point_tree = None
+                same = same and treeTrips == expected
+                row.append(f"{treeSeconds:.3f}")
+            rows.append(row + ["yes" if same else "NO"])
+    finally:
+        queries.connection.close_connection()
+
+    headers = ["Radius m", "Trips", "task6 s", "box s", "grid s"] + (["tree s"] if tree is not None else [])
+    print(tabulate(rows, headers=headers + ["Same trips"], tablefmt="pretty"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from tabulate import tabulate
+
+from Queries import Queries
+from streamtable import PrettyTableWriter
+
+
+TASKS = ["task5", "task9", "task10"]
+# Tables whose cells tabulate formats in different ways: DOUBLE and DECIMAL results like task5's,
+# NULLs, and bytes in columns of bytes and of text
+FORMAT_TABLES = [
+    (["Taxi ID", "Total Hours", "Total Kilometers"],
+     [(20000001, Decimal("812.25"), 31975.54), (20000002, Decimal("0.05"), 1234567.891), (20000003, None, 1e-07)]),
+    (["callType", "note"], [(b"A", "x"), (None, b"yz"), (b"\xff", "")]),
+    (["Trip ID"], []),
+]
+
+
+class BufferedQueries(Queries):
+    """
+    Queries with the output path of before streamtable: fetchall and one tabulate string.
+    """
+
+    def stream_output(self, filename, query, headers):
+        self.cursor.execute(query)
+        results = self.cursor.fetchall()
+        self.write_output(filename, tabulate(results, headers=headers, tablefmt="pretty"))
+
+
+def measure(queries, task):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        getattr(queries, task)()
+        return time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check_format(directory):
+    """
+    Names of the FORMAT_TABLES for which PrettyTableWriter and tabulate write different files.
+    """
+    path = os.path.join(directory, "format.txt")
+    differ = []
+    for headers, rows in FORMAT_TABLES:
+        with PrettyTableWriter(path, headers) as table:
+            table.write(rows)
+        with open(path, encoding="utf-8") as f:
+            if f.read() != tabulate(rows, headers=headers, tablefmt="pretty"):
+                differ.append(", ".join(headers))
+    return differ
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the peak Python memory and time of the large result tasks when they fetch all "
+                    "rows and tabulate them with streaming them to the results file, and check that both "
+                    "write the same file"
+    )
+    parser.add_argument("--tasks", nargs="+", default=TASKS)
+    parser.add_argument("--format-only", action="store_true",
+                        help="Only check that the writer formats cells like tabulate, without a database")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_streaming_")
+    differ = check_format(directory)
+    print("Cells formatted like tabulate: " + (f"NO, in the tables of {'; '.join(differ)}" if differ else "yes"))
+    if args.format_only:
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+    runs = {"fetchall": BufferedQueries, "streamed": Queries}
+    measured = {}
+    for name, kind in runs.items():
+        queries = kind(output_dir=os.path.join(directory, name))
+        try:
+            measured[name] = {task: measure(queries, task) for task in args.tasks}
+        finally:
+            queries.connection.close_connection()
+
+    rows = []
+    for task in args.tasks:
+        filename = f"{task}Output.txt"
+        with open(os.path.join(directory, "fetchall", filename), "rb") as f:
+            expected = f.read()
+        with open(os.path.join(directory, "streamed", filename), "rb") as f:
+            same = f.read() == expected
+        row = [task]
+        for name in runs:
+            seconds, peak = measured[name][task]
+            row += [f"{seconds:.2f}", f"{peak / 2**20:.1f}"]
+        rows.append(row + ["yes" if same else "NO"])
+    print(tabulate(rows, headers=["Task", "fetchall s", "fetchall MB", "streamed s", "streamed MB", "Same output"],
+                   tablefmt="pretty"))
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+import time
+
+from proximity import close_taxi_pairs, parallel_taxi_pairs, store_extent, store_trips
+from trajectorystore import TrajectoryStore, build_from_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time task 8's proximity join on a trajectory store, as a single stream and in time "
+                    "partitions on growing numbers of worker processes, and check that all runs find the same pairs"
+    )
+    parser.add_argument("--store", default="trajectories", help="Built from --csv if it does not exist")
+    parser.add_argument("--csv", default="porto.csv")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count()])
+    parser.add_argument("--days", type=int, default=6, help="Length of a time partition")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.store, "manifest.json")):
+        build_from_csv(args.csv, args.store)
+    start, end, lookback = store_extent(args.store)
+
+    began = time.perf_counter()
+    expected = close_taxi_pairs(store_trips(TrajectoryStore(args.store), start, end))
+    single = time.perf_counter() - began
+    print(f"single stream: {len(expected):,} pairs in {single:.1f}s")
+
+    mismatches = 0
+    for workers in sorted(set(args.workers)):
+        began = time.perf_counter()
+        pairs = parallel_taxi_pairs(args.store, start, end, lookback, workers=workers, days=args.days)
+        seconds = time.perf_counter() - began
+        same = pairs == expected
+        mismatches += not same
+        print(f"{workers:>3} workers: {len(pairs):,} pairs in {seconds:.1f}s, {single / seconds:.2f}x "
+              f"{'same pairs' if same else 'DIFFERENT PAIRS'}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
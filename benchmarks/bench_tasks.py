@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from tabulate import tabulate
+
+from DbConnector import DbConnector
+from metrics import peak_memory_mb
+from Queries import Queries
+
+
+TASKS = ["task1", "task2", "task3", "task4a", "task4b", "task5", "task6", "task7", "task8", "task9", "task10",
+         "task11"]
+
+
+def output_rows(path):
+    """
+    Data rows of a results file: a pretty table, or the DataFrame.to_string of task8.
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0].startswith("Empty DataFrame"):
+        return 0
+    if lines[0].startswith("+"):
+        return sum(line.startswith("|") for line in lines) - 1
+    return len(lines) - 1
+
+
+def run_child(task, output_dir, layout):
+    queries = Queries(output_dir=output_dir, layout=layout)
+    try:
+        start = time.perf_counter()
+        getattr(queries, task)()
+        seconds = time.perf_counter() - start
+    finally:
+        queries.connection.close_connection()
+    return {"seconds": round(seconds, 3), "rows": output_rows(os.path.join(output_dir, f"{task}Output.txt")),
+            "peakMb": peak_memory_mb()}
+
+
+def measure(task, output_dir, layout):
+    """
+    Runs one task in a fresh interpreter, since the peak RSS of a process only grows.
+    """
+    command = [sys.executable, "-m", "benchmarks.bench_tasks", "run", "--child", task, "--output-dir", output_dir]
+    if layout:
+        command += ["--layout", layout]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = (result.stderr or result.stdout).strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def database_size():
+    with DbConnector(banner=False) as connector:
+        connector.cursor.execute("SELECT DATABASE(), (SELECT COUNT(*) FROM trip), (SELECT COUNT(*) FROM point)")
+        database, trips, points = connector.cursor.fetchall()[0]
+    return {"database": database, "trips": trips, "points": points}
+
+
+def run(tasks, report, layout=None, label=None):
+    directory = tempfile.mkdtemp(prefix="bench_tasks_")
+    started = time.perf_counter()
+    results = {}
+    try:
+        for task in tasks:
+            results[task] = measure(task, directory, layout)
+            result = results[task]
+            print(f"{task}: " + (f"failed: {result['error']}" if "error" in result else
+                                 f"{result['seconds']:.2f}s, {result['rows']:,} rows, peak {result['peakMb']} MB"))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    summary = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "layout": layout,
+        **database_size(),
+        "wallSeconds": round(time.perf_counter() - started, 3),
+        "tasks": results,
+    }
+    os.makedirs(os.path.dirname(report) or ".", exist_ok=True)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1)
+    print(f"Report written to {report}")
+    return summary
+
+
+def compare_reports(before_path, after_path):
+    """
+    Table of the tasks of two reports, with the speedup of the second run and a flag where the
+    row counts differ.
+    """
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+    rows = []
+    for task in list(before["tasks"]) + [task for task in after["tasks"] if task not in before["tasks"]]:
+        a, b = before["tasks"].get(task, {}), after["tasks"].get(task, {})
+        speedup = f"{a['seconds'] / b['seconds']:.2f}x" if a.get("seconds") and b.get("seconds") else "-"
+        rows.append((task, a.get("seconds", "-"), b.get("seconds", "-"), speedup,
+                     a.get("rows", "-"), b.get("rows", "-"), a.get("peakMb", "-"), b.get("peakMb", "-"),
+                     "" if a.get("rows") == b.get("rows") else "ROWS DIFFER"))
+    table = tabulate(rows, headers=["Task", "Before (s)", "After (s)", "Speedup", "Rows before", "Rows after",
+                                    "Peak MB before", "Peak MB after", ""], tablefmt="pretty")
+    sizes = [f"{report['database']}: {report['trips']:,} trips, {report['points']:,} points"
+             for report in (before, after)]
+    return table + "\nBefore: " + sizes[0] + "\nAfter:  " + sizes[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run every task on the configured database, each in a process of its own, and record wall "
+                    "time, rows and peak memory in a JSON report, or compare two reports"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    runner = commands.add_parser("run")
+    runner.add_argument("--tasks", nargs="+", default=TASKS)
+    runner.add_argument("--report", help="Default: logs/tasks-<time>.json")
+    runner.add_argument("--layout", choices=["path", "trajectory", "summary"])
+    runner.add_argument("--label", help="A note stored in the report, e.g. the change that is measured")
+    runner.add_argument("--child", help=argparse.SUPPRESS)
+    runner.add_argument("--output-dir", help=argparse.SUPPRESS)
+    comparer = commands.add_parser("compare")
+    comparer.add_argument("before")
+    comparer.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        print(compare_reports(args.before, args.after))
+    elif args.child:
+        print(json.dumps(run_child(args.child, args.output_dir, args.layout)))
+    else:
+        report = args.report or os.path.join("logs", f"tasks-{datetime.now():%Y%m%d-%H%M%S}.json")
+        run(args.tasks, report, args.layout, args.label)
+
+
+if __name__ == "__main__":
+    main()
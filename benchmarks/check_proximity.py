@@ -0,0 +1,77 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from polyline import point_counts, point_indexes
+from proximity import PROXIMITY_METERS, PROXIMITY_SECONDS, brute_force_pairs, close_taxi_pairs
+from tripsummary import SECONDS_PER_POINT
+
+
+def synthetic_trips(trips, taxis, hours, mean_points=20, spread=0.002, seed=0):
+    """
+    Random walks of trips crowded into a few hundred meters around Porto, so that many points of
+    different taxis come within a few meters and seconds of each other. Returns the trips as one
+    (taxiIds, startSeconds, lat, lon, offsets) batch, ordered by start time.
+    """
+    rng = np.random.default_rng(seed)
+    startSeconds = np.sort(rng.integers(1_372_636_800, 1_372_636_800 + hours * 3600, size=trips))
+    taxiIds = rng.integers(20_000_001, 20_000_001 + taxis, size=trips)
+    counts = rng.poisson(mean_points, size=trips)
+    offsets = np.zeros(trips + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # Steps of a few meters, starting anywhere in a small square
+    lat = np.repeat(41.15 + rng.uniform(0, spread, trips), counts) + rng.normal(0, 0.00002, offsets[-1])
+    lon = np.repeat(-8.61 + rng.uniform(0, spread, trips), counts) + rng.normal(0, 0.00002, offsets[-1])
+    return taxiIds, startSeconds, lat, lon, offsets
+
+
+def batches(trips, size):
+    # The trips in batches of size, like database_trips and store_trips yield them
+    taxiIds, startSeconds, lat, lon, offsets = trips
+    for first in range(0, len(taxiIds), size):
+        last = min(first + size, len(taxiIds))
+        yield (taxiIds[first:last], startSeconds[first:last], lat[offsets[first]:offsets[last]],
+               lon[offsets[first]:offsets[last]], offsets[first:last + 1] - offsets[first])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check proximity.close_taxi_pairs against comparing all pairs of points on synthetic trips"
+    )
+    parser.add_argument("--trips", type=int, default=2000)
+    parser.add_argument("--taxis", type=int, default=300)
+    parser.add_argument("--hours", type=int, default=6)
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = 0
+    for seed in range(args.seeds):
+        trips = synthetic_trips(args.trips, args.taxis, args.hours, seed=seed)
+        taxiIds, startSeconds, lat, lon, offsets = trips
+        counts = point_counts(offsets)
+        seconds = np.repeat(startSeconds, counts) + point_indexes(offsets) * SECONDS_PER_POINT
+
+        start = time.perf_counter()
+        expected = brute_force_pairs(seconds, np.repeat(taxiIds, counts), lat, lon)
+        bruteSeconds = time.perf_counter() - start
+        print(f"seed {seed}: {len(seconds):,} points, {len(expected):,} pairs by brute force in {bruteSeconds:.1f}s")
+
+        # Different batch sizes move the batch edges through the windows of the join
+        for size in (1, 37, 500, args.trips):
+            start = time.perf_counter()
+            pairs = close_taxi_pairs(batches(trips, size), PROXIMITY_METERS, PROXIMITY_SECONDS)
+            same = pairs == expected
+            failures += not same
+            print(f"  batches of {size:>5} trips: {len(pairs):,} pairs in {time.perf_counter() - start:.2f}s"
+                  f" {'ok' if same else 'MISMATCH'}")
+
+    if failures:
+        print(f"{failures} mismatches")
+        sys.exit(1)
+    print("All results match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import time
+
+from benchmarks.synthetic_porto import generate
+from createtables import CreateTables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load a synthetic csv (see benchmarks.synthetic_porto) into an empty database with "
+                    "insert_data. The server comes from DATABASE_HOST, DATABASE_NAME, DATABASE_USER and "
+                    "DATABASE_PASSWORD as always, e.g. from a .env for a local MySQL; all tables of that "
+                    "database are dropped first, so its name has to be given with --database"
+    )
+    parser.add_argument("csv", nargs="?", default="synthetic_porto.csv")
+    parser.add_argument("--database", required=True, help="Name of the database that gets cleaned and loaded")
+    parser.add_argument("--scale", type=float,
+                        help="Generate the csv at this scale first (see benchmarks.synthetic_porto)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bulk", action="store_true", help="Load with bulk_load instead of create_all_tables")
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--backend", choices=["executemany", "infile"], default="executemany")
+    parser.add_argument("--point-ids", choices=["staging", "client"], default="staging")
+    parser.add_argument("--coordinates", choices=["double", "fixed"], default="double")
+    parser.add_argument("--trajectories", action="store_true")
+    parser.add_argument("--spatial", action="store_true")
+    args = parser.parse_args()
+
+    if args.scale is not None:
+        start = time.perf_counter()
+        trips = generate(args.csv, scale=args.scale, seed=args.seed)
+        print(f"Wrote {trips:,} trips to {args.csv} in {time.perf_counter() - start:.1f}s")
+    elif not os.path.exists(args.csv):
+        parser.error(f"{args.csv} does not exist, generate it with --scale")
+
+    program = CreateTables()
+    try:
+        program.cursor.execute("SELECT DATABASE()")
+        (database,) = program.cursor.fetchone()
+        if database != args.database:
+            parser.error(f"connected to database {database!r}, not {args.database!r}")
+
+        start = time.perf_counter()
+        program.clean_database()
+        options = {"chunksize": args.chunksize, "workers": args.workers, "backend": args.backend,
+                   "filepath": args.csv, "resume": False}
+        if args.bulk:
+            program.bulk_load(point_ids=args.point_ids, coordinates=args.coordinates,
+                              trajectories=args.trajectories, spatial=args.spatial, **options)
+        else:
+            program.create_all_tables(point_ids=args.point_ids, coordinates=args.coordinates,
+                                      trajectories=args.trajectories, spatial=args.spatial)
+            program.insert_data(point_ids=args.point_ids, trajectories=args.trajectories, **options)
+        print(f"Loaded {args.csv} into {database} in {time.perf_counter() - start:.1f}s")
+        program.show_tables()
+    finally:
+        program.connection.close_connection()
+
+
+if __name__ == "__main__":
+    main()
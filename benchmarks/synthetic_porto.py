@@ -0,0 +1,179 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+import pandas as pd
+
+from portodata import polyline_text
+from proximity import METERS_PER_DEGREE
+
+
+# Scale 1 is the size of porto.csv: 1,710,670 trips of 442 taxis from July 2013 to June 2014
+FULL_TRIPS = 1710670
+TAXIS = 442
+FIRST_TAXI = 20000001
+START = pd.Timestamp("2013-07-01").value // 10**9
+DAYS = 365
+SAMPLE_SECONDS = 15
+
+# Share of the call types in porto.csv: A dispatched from the central, B at a stand, C on the street
+CALL_TYPES = {"A": 0.2132, "B": 0.4781, "C": 0.3087}
+STANDS = 63
+CALLERS = 57105
+# Points per trip: lognormal with the median (41) and mean (48) of porto.csv, some empty and few very long
+LENGTH_MEDIAN = 41
+LENGTH_SIGMA = 0.55
+MAX_POINTS = 3881
+EMPTY_SHARE = 0.0035
+MISSING_SHARE = 6e-6
+
+# (lat, lon, weight, spread in m) of the places where trips start: the centre, the stations, the
+# airport and the suburbs along the coast
+HOTSPOTS = [
+    (41.1496, -8.6109, 0.30, 900),   # Baixa
+    (41.1456, -8.6108, 0.12, 300),   # Sao Bento
+    (41.1486, -8.5856, 0.14, 300),   # Campanha
+    (41.2370, -8.6700, 0.08, 400),   # Airport
+    (41.1579, -8.6291, 0.10, 600),   # Boavista / City Hall
+    (41.1844, -8.6963, 0.08, 900),   # Matosinhos
+    (41.1239, -8.6118, 0.08, 1200),  # Gaia
+    (41.1780, -8.5980, 0.10, 1500),  # Hospital S. Joao / Paranhos
+]
+# Driving: 15 s steps of on average 110 m, a heading that drifts, and GPS noise
+STEP_SHAPE = 2.0
+STEP_METERS = 55.0
+TURN_SIGMA = 0.35
+NOISE_METERS = 4.0
+
+COLUMNS = ["TRIP_ID", "CALL_TYPE", "ORIGIN_CALL", "ORIGIN_STAND", "TAXI_ID", "TIMESTAMP", "DAY_TYPE",
+           "MISSING_DATA", "POLYLINE"]
+
+
+def segment_cumsum(values, counts):
+    """
+    Cumulative sums of values that restart at every segment, the segments being runs of counts.
+    """
+    sums = np.cumsum(values)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return sums - np.repeat(np.r_[0, sums][starts], counts)
+
+
+def trip_table(scale=1.0, taxis=TAXIS, days=DAYS, seed=0):
+    """
+    The scalar columns of round(scale * FULL_TRIPS) trips, sorted by TIMESTAMP, and their point
+    counts. Every taxi drives its trips one after the other with idle gaps between them, so no two
+    trips of a taxi overlap and TRIP_ID, the start time followed by the taxi, is unique.
+    """
+    rng = np.random.default_rng(seed)
+    trips = max(int(round(scale * FULL_TRIPS)), 1)
+    taxiIds = np.sort(FIRST_TAXI + rng.integers(0, taxis, trips))
+    counts = np.rint(LENGTH_MEDIAN * rng.lognormal(0.0, LENGTH_SIGMA, trips)).astype(np.int64)
+    counts = np.clip(counts, 1, MAX_POINTS)
+    counts[rng.random(trips) < EMPTY_SHARE] = 0
+    durations = np.maximum(counts - 1, 0) * SAMPLE_SECONDS
+
+    # The idle time of a taxi is split at random between the gaps before its trips and the end of
+    # the period, so the trips stay in the period and start at least a second apart
+    firsts = np.flatnonzero(np.r_[True, taxiIds[1:] != taxiIds[:-1]])
+    perTaxi = np.diff(np.r_[firsts, trips])
+    idle = np.maximum(days * 86400 - np.add.reduceat(durations + 1, firsts), 0)
+    shares = rng.exponential(1.0, trips)
+    shares /= np.repeat(np.add.reduceat(shares, firsts) + rng.exponential(1.0, len(firsts)), perTaxi)
+    steps = np.floor(shares * np.repeat(idle, perTaxi)).astype(np.int64)
+    steps[1:] += durations[:-1] + 1
+    steps[firsts] -= np.r_[0, durations[firsts[1:] - 1] + 1]
+    timestamps = START + segment_cumsum(steps, perTaxi)
+
+    callTypes = rng.choice(list(CALL_TYPES), trips, p=list(CALL_TYPES.values()))
+    stands = 1 + rng.choice(STANDS, trips, p=rng.dirichlet(np.ones(STANDS)))
+    # Regular customers have the low numbers and make many of the calls
+    callers = 2001 + np.floor(CALLERS * rng.random(trips) ** 3).astype(np.int64)
+
+    frame = pd.DataFrame({
+        "TRIP_ID": timestamps * 10**9 + 620000000 + (taxiIds - 20000000),
+        "CALL_TYPE": callTypes,
+        "ORIGIN_CALL": pd.array(callers, dtype="Int64"),
+        "ORIGIN_STAND": pd.array(stands, dtype="Int64"),
+        "TAXI_ID": taxiIds,
+        "TIMESTAMP": timestamps,
+        "DAY_TYPE": "A",
+        "MISSING_DATA": rng.random(trips) < MISSING_SHARE,
+        "POINT_COUNT": counts,
+    })
+    frame.loc[callTypes != "A", "ORIGIN_CALL"] = pd.NA
+    frame.loc[callTypes != "B", "ORIGIN_STAND"] = pd.NA
+    return frame.sort_values(["TIMESTAMP", "TAXI_ID"], kind="stable", ignore_index=True)
+
+
+def trajectories(counts, rng):
+    """
+    (lat, lon, offsets) of trips with the given point counts: a start near a hotspot, then steps
+    of varying length on a slowly turning heading, with GPS noise on top.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    total = int(offsets[-1])
+    weights = np.array([weight for _, _, weight, _ in HOTSPOTS])
+    spot = np.array([(lat, lon, spread) for lat, lon, _, spread in HOTSPOTS])[
+        rng.choice(len(HOTSPOTS), len(counts), p=weights / weights.sum())]
+    cosLat = np.cos(np.radians(spot[:, 0]))
+    lat0 = spot[:, 0] + rng.normal(0, 1, len(counts)) * spot[:, 2] / METERS_PER_DEGREE
+    lon0 = spot[:, 1] + rng.normal(0, 1, len(counts)) * spot[:, 2] / (METERS_PER_DEGREE * cosLat)
+
+    # The first point of a trip sets a random heading and does not move
+    starts = offsets[:-1][counts > 0]
+    turns = rng.normal(0, TURN_SIGMA, total)
+    turns[starts] = rng.uniform(0, 2 * np.pi, len(starts))
+    heading = segment_cumsum(turns, counts)
+    step = rng.gamma(STEP_SHAPE, STEP_METERS, total)
+    step[starts] = 0
+    north = segment_cumsum(step * np.cos(heading), counts) + rng.normal(0, NOISE_METERS, total)
+    east = segment_cumsum(step * np.sin(heading), counts) + rng.normal(0, NOISE_METERS, total)
+
+    lat = np.repeat(lat0, counts) + north / METERS_PER_DEGREE
+    lon = np.repeat(lon0, counts) + east / (METERS_PER_DEGREE * np.repeat(cosLat, counts))
+    return lat, lon, offsets
+
+
+def generate(path, scale=1.0, taxis=TAXIS, days=DAYS, seed=0, chunksize=20000):
+    """
+    Writes a csv in the format of porto.csv, every field quoted, and returns the number of trips.
+    The same arguments always give the same file.
+    """
+    table = trip_table(scale, taxis, days, seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(COLUMNS)
+        for chunk, first in enumerate(range(0, len(table), chunksize)):
+            part = table.iloc[first:first + chunksize]
+            rng = np.random.default_rng([seed, chunk])
+            text = polyline_text(*trajectories(part["POINT_COUNT"].to_numpy(), rng))
+            part = part.drop(columns="POINT_COUNT").assign(POLYLINE=text)
+            part = part.astype({"ORIGIN_CALL": "object", "ORIGIN_STAND": "object"})
+            part = part.fillna("").assign(MISSING_DATA=part["MISSING_DATA"].map({True: "True", False: "False"}))
+            writer.writerows(part.itertuples(index=False, name=None))
+    return len(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic csv in the format of porto.csv: the taxi count, call type mix, trip "
+                    "lengths and one year of porto.csv, with trips around the busy places of Porto"
+    )
+    parser.add_argument("output", nargs="?", default="synthetic_porto.csv")
+    parser.add_argument("--scale", type=float, default=0.01, help="Trips as a fraction of porto.csv's 1.7 million")
+    parser.add_argument("--taxis", type=int, default=TAXIS)
+    parser.add_argument("--days", type=int, default=DAYS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    trips = generate(args.output, args.scale, args.taxis, args.days, args.seed)
+    print(f"Wrote {trips:,} trips to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
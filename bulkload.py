@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+
+class InfileLoader:
+    """
+    Loads rows into MySQL with LOAD DATA LOCAL INFILE instead of executemany.
+
+    Every load writes the rows to a tab-separated file in a private temporary directory and
+    lets the server read it back through the client. The connection must be opened with
+    allow_local_infile=True, which DbConnector already does.
+    """
+
+    def __init__(self, cursor, directory=None):
+        self.cursor = cursor
+        self.directory = tempfile.mkdtemp(prefix="porto_infile_", dir=directory)
+
+    def write_file(self, table, frame):
+        """
+        Writes a DataFrame as a headerless TSV file and returns its path.
+        Booleans are written as 0/1 and datetimes as 'YYYY-MM-DD HH:MM:SS', which is what MySQL expects.
+        """
+        frame = frame.copy()
+        for column in frame.columns:
+            if frame[column].dtype == bool:
+                frame[column] = frame[column].astype("int8")
+        filepath = os.path.join(self.directory, f"{table}.tsv")
+        frame.to_csv(filepath, sep="\t", header=False, index=False, lineterminator="\n",
+                     date_format="%Y-%m-%d %H:%M:%S")
+        return filepath
+
+    def load(self, table, frame, ignore=False, binary=()):
+        """
+        Loads the columns of the DataFrame into the columns of the same name in table.
+        Columns listed in binary hold bytes; they travel as hex text and are decoded by the server.
+        Returns the number of rows the server reported as inserted.
+        """
+        if frame.empty:
+            return 0
+        if binary:
+            frame = frame.copy()
+            for column in binary:
+                frame[column] = [value.hex() for value in frame[column]]
+        filepath = self.write_file(table, frame)
+        columns = ", ".join(f"@{column}" if column in binary else column for column in frame.columns)
+        setClause = ("SET " + ", ".join(f"{column} = UNHEX(@{column})" for column in binary)) if binary else ""
+        query = f"""
+            LOAD DATA LOCAL INFILE %s {'IGNORE ' if ignore else ''}INTO TABLE {table}
+            FIELDS TERMINATED BY '\\t'
+            LINES TERMINATED BY '\\n'
+            ({columns})
+            {setClause}
+        """
+        # MySQL wants forward slashes in the file name, also on Windows
+        self.cursor.execute(query, (filepath.replace("\\", "/"),))
+        return self.cursor.rowcount
+
+    def load_rows(self, table, columns, rows, ignore=False):
+        """
+        Loads a list of tuples, e.g. the trip rows of a ParsedChunk.
+        """
+        return self.load(table, pd.DataFrame(rows, columns=columns), ignore=ignore)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,106 @@
+import os
+from datetime import datetime
+
+
+class LoadCheckpoints:
+    """
+    Manifest of the porto.csv chunks that insert_data has committed, kept in the load_checkpoint table.
+
+    Every chunk records its row range in the csv (data rows, counted from 0, end exclusive), its
+    tripId range and its row counts. The checkpoint row is written in the same transaction as the
+    chunk itself, so the manifest never claims rows the database does not have.
+
+    Rows are keyed by the absolute path of the csv, so that files with the same name in different
+    folders never share checkpoints; a file that is moved starts over.
+    """
+
+    TABLE = "load_checkpoint"
+
+    def __init__(self, cursor, sourceFile):
+        self.cursor = cursor
+        self.sourceFile = os.path.realpath(sourceFile)
+        if len(self.sourceFile) > 255:
+            raise ValueError(f"The path of {sourceFile} is too long for the sourceFile column of {self.TABLE}")
+
+    def create_table(self):
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                sourceFile VARCHAR(255) NOT NULL,
+                firstRow BIGINT NOT NULL,
+                lastRow BIGINT NOT NULL,
+                firstTripId INT NOT NULL,
+                lastTripId INT NOT NULL,
+                trips INT NOT NULL,
+                points INT NOT NULL,
+                originCalls INT NOT NULL,
+                originStands INT NOT NULL,
+                committedAt DATETIME NOT NULL,
+                PRIMARY KEY (sourceFile, firstRow)
+            )
+        """)
+
+    def completed_ranges(self):
+        """
+        Committed row ranges of this source file as sorted, merged (firstRow, lastRow) pairs.
+        """
+        self.cursor.execute(
+            f"SELECT firstRow, lastRow FROM {self.TABLE} WHERE sourceFile = %s ORDER BY firstRow",
+            (self.sourceFile,)
+        )
+        merged = []
+        for firstRow, lastRow in self.cursor.fetchall():
+            if merged and firstRow <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], lastRow)
+            else:
+                merged.append([firstRow, lastRow])
+        return [tuple(r) for r in merged]
+
+    def first_trip_id(self):
+        """
+        The lowest tripId recorded for this source file, or None before its first chunk.
+        """
+        self.cursor.execute(f"SELECT MIN(firstTripId) FROM {self.TABLE} WHERE sourceFile = %s", (self.sourceFile,))
+        return self.cursor.fetchone()[0]
+
+    def record(self, chunk):
+        """
+        Adds the checkpoint row of a parsed chunk, replacing an older row for the same range after a reload.
+        Does not commit, the caller commits it together with the chunk.
+        """
+        self.cursor.execute(
+            f"""
+            REPLACE INTO {self.TABLE} (sourceFile, firstRow, lastRow, firstTripId, lastTripId,
+                                      trips, points, originCalls, originStands, committedAt)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (self.sourceFile, chunk.firstRow, chunk.firstRow + chunk.rows, chunk.firstTripId,
+             chunk.firstTripId + chunk.size - 1, chunk.size, chunk.points, len(chunk.origin_calls),
+             len(chunk.origin_stands), datetime.now().replace(microsecond=0))
+        )
+
+
+def first_pending_row(completed, startRow):
+    """
+    The first row at or after startRow that is not in a completed range.
+    """
+    for firstRow, lastRow in completed:
+        if firstRow <= startRow < lastRow:
+            return lastRow
+    return startRow
+
+
+def pending_runs(completed, firstRow, lastRow):
+    """
+    Splits the rows [firstRow, lastRow) into the maximal runs that are not in a completed range.
+    """
+    runs = []
+    start = firstRow
+    for doneFirst, doneLast in completed:
+        if doneLast <= start or doneFirst >= lastRow:
+            continue
+        if doneFirst > start:
+            runs.append((start, doneFirst))
+        start = max(start, doneLast)
+    if start < lastRow:
+        runs.append((start, lastRow))
+    return runs
@@ -1,207 +1,880 @@
-
-import mysql
 from DbConnector import DbConnector
 from tabulate import tabulate
 import pandas as pd
 from datetime import datetime
-import ast
+import numpy as np
+import time
+from polyline import from_fixed, point_counts, point_indexes, to_fixed
+from pipeline import run_pipeline
+from bulkload import InfileLoader
+from pointdict import PointDictionary
+from checkpoint import LoadCheckpoints, first_pending_row, pending_runs
+from metrics import IngestMetrics
+from contextlib import nullcontext
+from utils import column_exists, detect_coordinates, table_exists
+from trajectory import encode_trajectories
+from tripsummary import mark_summary, summarize_trips, summary_is_complete
+from portodata import cache_is_fresh, polylines, read_porto
+from spatialgrid import GRID_COLUMN, grid_cell_sql
+from querycache import CACHED_TABLES, bump_table_versions, create_version_table
+import os
+from functools import partial
+
+
+TRIP_COLUMNS = ('tripId', 'originalTripId', 'taxiId', 'startTime', 'dayType', 'missingData')
+
+# Temp path table to ensure bulk path insertion
+CREATE_TMP_PATHS = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS tmp_paths (
+        tripId   BIGINT NOT NULL,
+        idx      INT NOT NULL,
+        latitude {coordType} NOT NULL,
+        longitude {coordType} NOT NULL,
+        KEY (latitude, longitude),
+        PRIMARY KEY (tripId, idx) -- For fast lookups
+    ) ENGINE=InnoDB
+"""
+
+# Create points by using all unique lat, lon from paths in staged table
+INSERT_POINTS_FROM_TMP = """
+    INSERT IGNORE INTO point (latitude, longitude)
+    SELECT DISTINCT tmpPath.latitude, tmpPath.longitude
+    FROM tmp_paths tmpPath
+"""
+
+# Join staged paths with points to get pointId, then insert all paths into main path table
+INSERT_PATHS_FROM_TMP = """
+    INSERT IGNORE INTO path (tripId, pointId, idx)
+    SELECT path.tripId, currentPoint.pointId, path.idx
+    FROM tmp_paths path
+    JOIN point currentPoint
+    ON currentPoint.latitude = path.latitude AND currentPoint.longitude = path.longitude
+"""
+
+
+# Column type of latitude and longitude for each coordinate layout. "fixed" stores integer
+# micro-degrees (see polyline.COORDINATE_SCALE), which is exact for Porto's 6-decimal data.
+COORDINATE_TYPES = {"double": "DOUBLE", "fixed": "INT"}
+# How long insert_data waits for a second pooled connection before opening one of its own
+POOL_WAIT_SECONDS = 5
+
+# Keys that the "bulk" table profile creates after the load: (table, name, ALTER TABLE clause, orphan check).
+# The names are the ones MySQL generates for the "standard" CREATE TABLE statements, so both profiles end
+# up with the same schema. Tables are listed in the order they must be altered.
+DEFERRED_KEYS = [
+    ('trip', 'originalTripId', "ADD KEY originalTripId (originalTripId)", None),
+    ('trip', 'startTime', "ADD KEY startTime (startTime)", None),
+    ('point', 'latitude', "ADD UNIQUE KEY latitude (latitude, longitude)", None),
+    ('path', 'pointId', "ADD KEY pointId (pointId)", None),
+    ('path', 'path_ibfk_1', "ADD CONSTRAINT path_ibfk_1 FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE",
+     "SELECT COUNT(*) FROM path LEFT JOIN trip ON trip.tripId = path.tripId WHERE trip.tripId IS NULL"),
+    ('path', 'path_ibfk_2', "ADD CONSTRAINT path_ibfk_2 FOREIGN KEY (pointId) REFERENCES point(pointId) ON DELETE CASCADE",
+     "SELECT COUNT(*) FROM path LEFT JOIN point ON point.pointId = path.pointId WHERE point.pointId IS NULL"),
+    ('origin_call', 'origin_call_ibfk_1', "ADD CONSTRAINT origin_call_ibfk_1 FOREIGN KEY (tripId) REFERENCES trip(tripId)",
+     "SELECT COUNT(*) FROM origin_call LEFT JOIN trip ON trip.tripId = origin_call.tripId WHERE trip.tripId IS NULL"),
+    ('origin_stand', 'origin_stand_ibfk_1', "ADD CONSTRAINT origin_stand_ibfk_1 FOREIGN KEY (tripId) REFERENCES trip(tripId)",
+     "SELECT COUNT(*) FROM origin_stand LEFT JOIN trip ON trip.tripId = origin_stand.tripId WHERE trip.tripId IS NULL"),
+    ('trip_trajectory', 'trip_trajectory_ibfk_1',
+     "ADD CONSTRAINT trip_trajectory_ibfk_1 FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE",
+     "SELECT COUNT(*) FROM trip_trajectory LEFT JOIN trip ON trip.tripId = trip_trajectory.tripId WHERE trip.tripId IS NULL"),
+    ('trip_summary', 'trip_summary_ibfk_1',
+     "ADD CONSTRAINT trip_summary_ibfk_1 FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE",
+     "SELECT COUNT(*) FROM trip_summary LEFT JOIN trip ON trip.tripId = trip_summary.tripId WHERE trip.tripId IS NULL"),
+]
+
+# Index of the optional grid cell column of point (see spatialgrid.py), deferred like DEFERRED_KEYS
+# when the point table has the column
+GRID_KEY = ('point', GRID_COLUMN, f"ADD KEY {GRID_COLUMN} ({GRID_COLUMN})", None)
 
 
 class CreateTables:
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, pool=None):
+        """
+        pool is an optional DbConnector.ConnectionPool to check the connections out of.
+        """
+        self.pool = pool
+        self.connection = pool.checkout() if pool is not None else DbConnector()
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+        self.chunk_count = 0
+        self.infile_loader = None
+        self.point_dictionary = None
+        self.checkpoints = None
+        self.metrics = None
+        self.coordinates = "double"
+        self.trajectories = False
+        self.summaries = False
+        self.set_writer_options()
 
-    def create_trip_table(self, table_name):
+    def create_trip_table(self, table_name, index=True):
         query = """CREATE TABLE IF NOT EXISTS %s (
                 tripId INT AUTO_INCREMENT PRIMARY KEY,
                 originalTripId BIGINT NOT NULL,
                 taxiId BIGINT NOT NULL,
                 startTime DATETIME NOT NULL,
                 dayType CHAR(1) NOT NULL,
-                missingData BOOLEAN NOT NULL
+                missingData BOOLEAN NOT NULL%s
                 )
         """
-        self.cursor.execute(query % table_name)
+        # The originalTripId index lets an append find the trips that are already loaded, and the
+        # startTime index lets task8 read the trips of a time window without scanning the table
+        index = ",\n                KEY originalTripId (originalTripId),\n                KEY startTime (startTime)" if index else ""
+        self.cursor.execute(query % (table_name, index))
         self.db_connection.commit()
 
-    def create_point_table(self, table_name):
+    def create_point_table(self, table_name, unique=True, coordinates="double", grid=False, grid_index=True):
+        """
+        grid=True adds the generated gridCell column, the number of the grid cell of every point
+        (see spatialgrid.py), with an index on it unless grid_index=False.
+        """
         query = '''
             CREATE TABLE IF NOT EXISTS %s (
                 pointId INT PRIMARY KEY AUTO_INCREMENT,
-                latitude DOUBLE NOT NULL,
-                longitude DOUBLE NOT NULL,
-                UNIQUE (latitude, longitude)
+                latitude %s NOT NULL,
+                longitude %s NOT NULL%s%s
             )
         '''
-        self.cursor.execute(query % table_name)
+        coordType = COORDINATE_TYPES[coordinates]
+        # Without the unique key the table is only meant for a bulk load, see finish_bulk_load
+        uniqueKey = ",\n                UNIQUE (latitude, longitude)" if unique else ""
+        gridColumn = ""
+        if grid:
+            # A virtual column costs no space in the rows and is filled by every insert on its own
+            gridColumn = f",\n                {GRID_COLUMN} BIGINT AS ({grid_cell_sql(coordinates)}) VIRTUAL"
+            if grid_index:
+                gridColumn += f",\n                KEY {GRID_COLUMN} ({GRID_COLUMN})"
+        self.cursor.execute(query % (table_name, coordType, coordType, uniqueKey, gridColumn))
         self.db_connection.commit()
 
-    def create_path_table(self, table_name):
+    def create_path_table(self, table_name, foreign_keys=True):
         query = '''
             CREATE TABLE IF NOT EXISTS %s(
                 tripId INT NOT NULL,
                 pointId INT NOT NULL,
-                idx INT NOT NULL,
-                FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE,
-                FOREIGN KEY (pointId) REFERENCES point(pointId) ON DELETE CASCADE,
+                idx INT NOT NULL,%s
                 PRIMARY KEY (tripId, idx)
             )
         '''
-        self.cursor.execute(query % table_name)
+        foreignKeys = '''
+                FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE,
+                FOREIGN KEY (pointId) REFERENCES point(pointId) ON DELETE CASCADE,''' if foreign_keys else ""
+        self.cursor.execute(query % (table_name, foreignKeys))
         self.db_connection.commit()
 
-    def create_origin_call_table(self, table_name):
+    def create_origin_call_table(self, table_name, foreign_keys=True):
         query = '''
             CREATE TABLE IF NOT EXISTS %s(
                 tripId INT PRIMARY KEY,
-                callerId INT NOT NULL,
-                FOREIGN KEY (tripId) REFERENCES trip(tripId)
+                callerId INT NOT NULL%s
             )
         '''
-        self.cursor.execute(query % table_name)
+        foreignKeys = ",\n                FOREIGN KEY (tripId) REFERENCES trip(tripId)" if foreign_keys else ""
+        self.cursor.execute(query % (table_name, foreignKeys))
         self.db_connection.commit()
 
-    def create_origin_stand_table(self, table_name):
+    def create_origin_stand_table(self, table_name, foreign_keys=True):
         query = '''
             CREATE TABLE IF NOT EXISTS %s(
                 tripId INT PRIMARY KEY,
-                standId INT NOT NULL,
-                FOREIGN KEY (tripId) REFERENCES trip(tripId)
+                standId INT NOT NULL%s
             )
         '''
-        self.cursor.execute(query % table_name)
+        foreignKeys = ",\n                FOREIGN KEY (tripId) REFERENCES trip(tripId)" if foreign_keys else ""
+        self.cursor.execute(query % (table_name, foreignKeys))
         self.db_connection.commit()
     
+    def create_trip_trajectory_table(self, table_name, foreign_keys=True):
+        """
+        One row per trip with its whole polyline packed into a blob, see trajectory.py.
+        """
+        query = '''
+            CREATE TABLE IF NOT EXISTS %s(
+                tripId INT PRIMARY KEY,
+                pointCount INT NOT NULL,
+                points MEDIUMBLOB NOT NULL%s
+            )
+        '''
+        foreignKeys = ",\n                FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE" if foreign_keys else ""
+        self.cursor.execute(query % (table_name, foreignKeys))
+        self.db_connection.commit()
+
+    def create_trip_summary_table(self, table_name, foreign_keys=True):
+        """
+        Per-trip values that the queries would otherwise compute from path and point, see tripsummary.py.
+        Coordinates are in degrees whatever the point table stores. Trips without points have no row.
+        """
+        query = '''
+            CREATE TABLE IF NOT EXISTS %s(
+                tripId INT PRIMARY KEY,
+                pointCount INT NOT NULL,
+                startLat DOUBLE NOT NULL,
+                startLon DOUBLE NOT NULL,
+                endLat DOUBLE NOT NULL,
+                endLon DOUBLE NOT NULL,
+                durationSeconds INT NOT NULL,
+                endTime DATETIME NOT NULL,
+                distanceMeters DOUBLE NOT NULL,
+                pathMeters DOUBLE NOT NULL,
+                minLat DOUBLE NOT NULL,
+                maxLat DOUBLE NOT NULL,
+                minLon DOUBLE NOT NULL,
+                maxLon DOUBLE NOT NULL%s
+            )
+        '''
+        foreignKeys = ",\n                FOREIGN KEY (tripId) REFERENCES trip(tripId) ON DELETE CASCADE" if foreign_keys else ""
+        self.cursor.execute(query % (table_name, foreignKeys))
+        self.db_connection.commit()
+
     def drop_table(self, table_name):
         print("Dropping table %s..." % table_name)
         query = "DROP TABLE %s"
         self.cursor.execute(query % table_name)
+        if table_name in CACHED_TABLES:
+            create_version_table(self.cursor)
+            bump_table_versions(self.cursor, [table_name])
+            self.db_connection.commit()
 
     def show_tables(self):
         self.cursor.execute("SHOW TABLES")
         rows = self.cursor.fetchall()
         print(tabulate(rows, headers=self.cursor.column_names))
 
+    def create_all_tables(self, profile="standard", point_ids="staging", coordinates="double", trajectories=False,
+                          spatial=False):
+        """
+        Creates the five tables and trip_summary. coordinates="fixed" stores point coordinates as integer micro-degrees
+        instead of DOUBLE; insert_data and Queries detect the layout from the point table.
+        trajectories=True also creates trip_trajectory. spatial=True gives point the indexed gridCell column that
+        Queries.trips_within uses. The "bulk" profile leaves out the foreign keys, the trip
+        originalTripId index and the point UNIQUE index when pointIds are assigned client side, so that a bulk
+        load does not maintain them row by row. finish_bulk_load adds them afterwards, giving the same schema as "standard".
+        """
+        if coordinates not in COORDINATE_TYPES:
+            raise ValueError(f"Unknown coordinate layout {coordinates!r}, expected one of {sorted(COORDINATE_TYPES)}")
+        if profile not in ("standard", "bulk"):
+            raise ValueError(f"Unknown table profile {profile!r}, expected 'standard' or 'bulk'")
+        bulk = profile == "bulk"
+        self.create_trip_table("trip", index=not bulk)
+        # The staging join needs the unique index to deduplicate points and look up their ids
+        self.create_point_table("point", unique=not (bulk and point_ids == "client"), coordinates=coordinates,
+                                grid=spatial, grid_index=not bulk)
+        self.create_path_table("path", foreign_keys=not bulk)
+        self.create_origin_call_table("origin_call", foreign_keys=not bulk)
+        self.create_origin_stand_table("origin_stand", foreign_keys=not bulk)
+        self.create_trip_summary_table("trip_summary", foreign_keys=not bulk)
+        if trajectories:
+            self.create_trip_trajectory_table("trip_trajectory", foreign_keys=not bulk)
+        create_version_table(self.cursor)
+        # An empty summary of no trips is complete; one next to trips that were loaded before is not
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM trip), EXISTS (SELECT 1 FROM trip_summary)")
+        if not any(self.cursor.fetchone()):
+            mark_summary(self.cursor, True)
+
+    def missing_deferred_keys(self):
+        """
+        The DEFERRED_KEYS that the tables in the current database do not have yet.
+        """
+        self.cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()")
+        tables = {row[0] for row in self.cursor.fetchall()}
+        self.cursor.execute("""
+            SELECT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()
+            UNION
+            SELECT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS WHERE TABLE_SCHEMA = DATABASE()
+        """)
+        existing = set(self.cursor.fetchall())
+        keys = DEFERRED_KEYS + ([GRID_KEY] if column_exists(self.cursor, "point", GRID_COLUMN) else [])
+        return [key for key in keys if key[0] in tables and (key[0], key[1]) not in existing]
+
+    def add_point_grid(self):
+        """
+        Adds the indexed gridCell column (see create_point_table) to the point table of a loaded
+        database. Building the index reads every point once.
+        """
+        if column_exists(self.cursor, "point", GRID_COLUMN):
+            print("The point table already has a grid cell column.")
+            return
+        start = time.perf_counter()
+        self.cursor.execute(f"""
+            ALTER TABLE point
+            ADD COLUMN {GRID_COLUMN} BIGINT AS ({grid_cell_sql(detect_coordinates(self.cursor))}) VIRTUAL,
+            ADD KEY {GRID_COLUMN} ({GRID_COLUMN})
+        """)
+        # The new column changes what SELECT * FROM point returns
+        create_version_table(self.cursor)
+        bump_table_versions(self.cursor, ['point'])
+        self.db_connection.commit()
+        print(f"Added the grid cell index to point in {time.perf_counter() - start:.1f}s.")
+
+    def bulk_load(self, point_ids="client", verify=True, coordinates="double", trajectories=False, spatial=False,
+                  **kwargs):
+        """
+        Creates the tables with the "bulk" profile, runs insert_data with the load session settings
+        and builds the deferred indexes and foreign keys in one pass at the end.
+        Remaining keyword arguments go to insert_data.
+        """
+        start = time.perf_counter()
+        self.create_all_tables(profile="bulk", point_ids=point_ids, coordinates=coordinates, trajectories=trajectories,
+                               spatial=spatial)
+        self.connection.set_session("foreign_key_checks", 0)
+        if point_ids == "client":
+            # Only primary keys are left to check, and InnoDB always checks those
+            self.connection.set_session("unique_checks", 0)
+        try:
+            self.insert_data(point_ids=point_ids, trajectories=trajectories, **kwargs)
+        finally:
+            self.connection.set_session("foreign_key_checks", 1)
+            self.connection.set_session("unique_checks", 1)
+        loaded = time.perf_counter()
+        self.finish_bulk_load(verify=verify)
+        print(f"Bulk load took {loaded - start:.1f}s, building keys took {time.perf_counter() - loaded:.1f}s.")
+
+    def finish_bulk_load(self, verify=True):
+        """
+        Adds the indexes and foreign keys left out by the "bulk" profile, one ALTER TABLE per table.
+        The foreign keys are added without re-checking every row, so with verify=True the
+        references are checked first with one anti-join per foreign key.
+        """
+        missing = self.missing_deferred_keys()
+        if verify:
+            for table, name, _, check in missing:
+                if check is None:
+                    continue
+                self.cursor.execute(check)
+                orphans = self.cursor.fetchone()[0]
+                if orphans:
+                    raise ValueError(f"Cannot add {name} to {table}: {orphans:,} rows reference missing rows")
+
+        byTable = {}
+        for table, _, clause, _ in missing:
+            byTable.setdefault(table, []).append(clause)
+        self.connection.set_session("foreign_key_checks", 0)
+        try:
+            for table, clauses in byTable.items():
+                start = time.perf_counter()
+                self.cursor.execute(f"ALTER TABLE {table} {', '.join(clauses)}")
+                print(f"Built {len(clauses)} deferred keys on {table} in {time.perf_counter() - start:.1f}s.")
+        finally:
+            self.connection.set_session("foreign_key_checks", 1)
+
     def read_porto_csv(self, filepath='porto.csv', **kwargs):
         """
-        Reads the porto.csv file and returns a pandas DataFrame.
+        Reads the porto.csv file and returns a pandas DataFrame, from its columnar cache when
+        that is up to date (see portodata.read_porto for the arguments).
         """
-        df = pd.read_csv(filepath, **kwargs)
+        df = read_porto(filepath, **kwargs)
         return df
     
     def clean_database(self):
-        tables = ['path', 'point', 'origin_call', 'origin_stand', 'trip', 'porto_raw']
+        tables = ['path', 'point', 'origin_call', 'origin_stand', 'trip_trajectory', 'trip_summary', 'trip', 'porto_raw', LoadCheckpoints.TABLE]
         for table in tables:
             self.cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        # The staging table lives as long as the connection and must follow the new point table
+        self.cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_paths")
+        # table_version is kept, so cached results of the dropped tables can never match again
+        create_version_table(self.cursor)
+        bump_table_versions(self.cursor, CACHED_TABLES)
         self.db_connection.commit()
         print("All tables have been cleaned.")
 
-    def insert_data(self, chunksize=10000):
-        df_iter = self.read_porto_csv(chunksize=chunksize)  # specify nrows for testing faster
-        index_tripId = 1
-        chunk_count = 0
-        for df in df_iter:
-            trips = [] # tripId, originalTripId, taxiId, startTime, dayType, missingData
-            origin_calls = []
-            origin_stands = []
-            tmp_paths = []  # (tripId, idx, latitude, longitude) - pointId comes later through staging table
-
-            # Create lists used for bulk insertion
-            for row in df.itertuples(index=False):
-                originalTripId = int(getattr(row, 'TRIP_ID'))
-                tripId = index_tripId
-                index_tripId += 1
-                taxiId = int(getattr(row, 'TAXI_ID'))
-                startTime = datetime.fromtimestamp(int(getattr(row, 'TIMESTAMP')))
-                dayType = str(getattr(row, 'DAY_TYPE'))
-                missingData = bool(getattr(row, 'MISSING_DATA'))
-
-                trips.append((tripId, originalTripId,taxiId, startTime, dayType, missingData))
-
-                callerId = getattr(row, 'ORIGIN_CALL')
-                if pd.notnull(callerId):
-                    origin_calls.append((tripId, int(callerId)))
-
-                standId = getattr(row, 'ORIGIN_STAND')
-                if pd.notnull(standId):
-                    origin_stands.append((tripId, int(standId)))
-
-                poly = ast.literal_eval(getattr(row, 'POLYLINE') or '[]')
-                for idx, (lon, lat) in enumerate(poly):
-                    tmp_paths.append((tripId, idx, float(lat), float(lon)))  # store lat, lon in this order for the UNIQUE index
-
-            cursor = self.cursor
-            connection = self.db_connection
+    def insert_data(self, chunksize=10000, workers=0, queue_depth=4, backend="executemany", point_ids="staging",
+                    point_memory=1 << 30, filepath='porto.csv', start_row=0, end_row=None, resume=True,
+                    metrics_log=None, trajectories=False, summaries=True, append=False):
+        """
+        Loads porto.csv into the database, chunksize trips at a time.
+
+        Every committed chunk is recorded in the load_checkpoint table. With resume=True, rows that
+        are already recorded there are skipped, so a failed load continues where it stopped.
+        start_row and end_row (data rows, end exclusive) load only part of the file. A trip always
+        gets tripId = row + 1, the same as in a full serial load, so sub-ranges can be loaded in any order.
+
+        With workers > 0 the chunks are parsed by a pool of worker processes while this process
+        writes the previous chunks to MySQL. At most queue_depth parsed chunks wait for the writer.
+
+        backend is either "executemany" (INSERT statements) or "infile" (LOAD DATA LOCAL INFILE).
+
+        point_ids selects how path rows get their pointId. "staging" inserts the points through the
+        tmp_paths table and joins them back against point. "client" assigns pointIds in Python with
+        a PointDictionary of at most point_memory bytes, warmed from the existing point table.
+
+        trajectories=True also stores every trip's polyline as one blob in trip_trajectory.
+        summaries=True fills trip_summary if the table exists. Databases created without it can be
+        brought up to date with rebuild_trip_summary (python tripsummary.py rebuild).
+
+        append=True adds a new csv, e.g. a later month, to a loaded database. Trips whose originalTripId
+        was loaded before are skipped, looked up per chunk through the originalTripId index, and the
+        others get consecutive tripIds after the current MAX(tripId). trip_trajectory is filled too if
+        it exists. With point_ids="staging" existing points are reused through the unique index, so the
+        cost depends on the size of the new file only; "client" first reads the whole point table.
+
+        Stage timings, throughput, memory and ETA of every chunk go to the JSON-lines file metrics_log
+        (logs/ingest-<time>.jsonl by default). Compare two runs with: python metrics.py OLD NEW
+        """
+        self.set_writer_options(backend, point_ids, point_memory)
+        self.coordinates = detect_coordinates(self.cursor)
+        if append:
+            trajectories = trajectories or table_exists(self.cursor, "trip_trajectory")
+        self.trajectories = trajectories
+        if trajectories:
+            self.create_trip_trajectory_table("trip_trajectory")
+        # Creating the table here would leave it without the trips of earlier loads
+        self.summaries = summaries and table_exists(self.cursor, "trip_summary")
+        if not self.summaries and summary_is_complete(self.cursor):
+            # The trips of this load get no summary rows
+            mark_summary(self.cursor, False)
+        if metrics_log is None:
+            metrics_log = os.path.join("logs", f"ingest-{datetime.now():%Y%m%d-%H%M%S}.jsonl")
+        self.metrics = IngestMetrics(metrics_log, filepath, options={
+            "chunksize": chunksize, "workers": workers, "queue_depth": queue_depth, "backend": backend,
+            "point_ids": point_ids, "start_row": start_row, "end_row": end_row, "resume": resume,
+            "coordinates": self.coordinates, "trajectories": trajectories,
+            "summaries": self.summaries, "append": append,
+        })
+        self.checkpoints = LoadCheckpoints(self.cursor, filepath)
+        self.checkpoints.create_table()
+        create_version_table(self.cursor)
+        self.db_connection.commit()
+        completed = self.checkpoints.completed_ranges() if resume else []
+        if completed:
+            print(f"Resuming: {sum(last - first for first, last in completed):,} rows of {filepath} are already loaded.")
+
+        tripIdBase, existing, lookup = 1, None, None
+        if append:
+            tripIdBase, appendBase = self.append_trip_ids(resume)
+            print(f"Appending {filepath} from tripId {tripIdBase}.")
+            # The reader runs in its own thread when pipelined, so the lookups get their own connection
+            lookup = self.lookup_connection()
+            existing = partial(existing_original_trip_ids, lookup.cursor, beforeTripId=appendBase)
+
+        # The prebuilt tmp_paths tuples hold degrees, so they only fit the DOUBLE layout
+        path_rows = backend == "executemany" and point_ids == "staging" and self.coordinates == "double"
+        parse = partial(parse_chunk, path_rows=path_rows)
+        chunks = self.iter_chunks(filepath, chunksize, start_row, end_row, completed, tripIdBase, existing)
+        try:
+            if workers > 0:
+                stats = run_pipeline(chunks, parse, self.write_chunk, workers=workers, queue_depth=queue_depth)
+                print(stats.summary())
+                return
+
+            for args in chunks:
+                self.write_chunk(parse(*args))
+        finally:
+            self.close_infile_loader()
+            if lookup is not None:
+                lookup.close_connection()
+            self.checkpoints = None
+            self.metrics.close()
+            print(f"Ingestion metrics written to {metrics_log}")
+            self.metrics = None
+
+    def lookup_connection(self):
+        """
+        A second connection, out of the pool if it has one free within POOL_WAIT_SECONDS; this
+        object holds one of its connections already, so a pool of one would never have one.
+        """
+        if self.pool is not None:
             try:
-                # Bulk trip insertion
-                cursor.executemany(
-                    """
-                    INSERT IGNORE INTO trip (tripId, originalTripId, taxiId, startTime, dayType, missingData)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    """,
-                    trips
-                )
-                connection.commit()
-                # Bulk origin_call insertion
-                if origin_calls:
-                    cursor.executemany(
-                        "INSERT INTO origin_call (tripId, callerId) VALUES (%s, %s)",
-                        origin_calls
-                    )
-                    connection.commit()
-                # Bulk origin_stand insertion
-                if origin_stands:
-                    cursor.executemany(
-                        "INSERT INTO origin_stand (tripId, standId) VALUES (%s, %s)",
-                        origin_stands
-                    )
-                    connection.commit()
-
-                # Temp path table to ensure bulk path insertion 
-                cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_paths")
-                cursor.execute("""
-                    CREATE TEMPORARY TABLE tmp_paths (
-                        tripId   BIGINT NOT NULL,
-                        idx      INT NOT NULL,
-                        latitude DOUBLE NOT NULL,
-                        longitude DOUBLE NOT NULL,
-                        KEY (latitude, longitude),
-                        PRIMARY KEY (tripId, idx) -- For fast lookups
-                    ) ENGINE=InnoDB
-                """)
-                connection.commit()
+                return self.pool.checkout(timeout=POOL_WAIT_SECONDS)
+            except TimeoutError:
+                pass
+        return DbConnector(banner=False)
+
+    def append_trip_ids(self, resume=True):
+        """
+        (first free tripId, first tripId of this append) for insert_data(append=True).
+        Trips below the second one were loaded before the append started, also when it is resumed.
+        """
+        missing = [key for key in self.missing_deferred_keys() if key[:2] == ('trip', 'originalTripId')]
+        for table, name, clause, _ in missing:
+            print(f"Adding the {name} index to {table}, only needed once.")
+            self.cursor.execute(f"ALTER TABLE {table} {clause}")
+        self.cursor.execute("SELECT COALESCE(MAX(tripId), 0) + 1 FROM trip")
+        nextTripId = self.cursor.fetchone()[0]
+        appendBase = self.checkpoints.first_trip_id() if resume else None
+        return nextTripId, appendBase if appendBase is not None else nextTripId
+
+    def iter_chunks(self, filepath, chunksize, start_row=0, end_row=None, completed=(), tripIdBase=1, existing=None):
+        """
+        Yields (df, firstTripId, firstRow) for every chunk of the csv in [start_row, end_row)
+        that is not covered by the completed row ranges.
+
+        existing is an optional function that returns which of an array of originalTripIds are already
+        loaded. Those trips are left out of the chunks, and the remaining ones get consecutive tripIds
+        starting at tripIdBase instead of tripIdBase + row.
+        """
+        row = first_pending_row(completed, start_row)
+        if end_row is not None and row >= end_row:
+            return
+
+        # The cache frames estimate the csv position themselves, for the csv the file handle tells it
+        cached = cache_is_fresh(filepath)
+        with nullcontext() if cached else open(filepath, 'rb') as handle:
+            reader = self.read_porto_csv(filepath if cached else handle, chunksize=chunksize,
+                                         start_row=row, end_row=end_row)
+            while True:
+                start = time.perf_counter()
+                df = next(reader, None)
+                if df is None:
+                    break
+                readSeconds = time.perf_counter() - start
+                df = df.reset_index(drop=True)
+                for runFirst, runLast in pending_runs(completed, row, row + len(df)):
+                    part = df.iloc[runFirst - row:runLast - row]
+                    firstTripId = tripIdBase + runFirst
+                    if existing is not None:
+                        originalTripIds = part['TRIP_ID'].to_numpy(dtype=np.int64)
+                        part = part[~np.isin(originalTripIds, existing(originalTripIds))]
+                        firstTripId = tripIdBase
+                        tripIdBase += len(part)
+                    # Travels with the DataFrame to the parser, also in worker processes
+                    part.attrs = {**df.attrs, 'readSeconds': readSeconds, 'rows': runLast - runFirst,
+                                  'bytesRead': df.attrs['sourceBytes'] if cached else handle.tell()}
+                    readSeconds = 0.0
+                    yield part, firstTripId, runFirst
+                row += len(df)
+
+    def set_writer_options(self, backend="executemany", point_ids="staging", point_memory=1 << 30):
+        if backend not in ("executemany", "infile"):
+            raise ValueError(f"Unknown ingestion backend {backend!r}, expected 'executemany' or 'infile'")
+        if point_ids not in ("staging", "client"):
+            raise ValueError(f"Unknown point_ids mode {point_ids!r}, expected 'staging' or 'client'")
+        self.backend = backend
+        self.point_ids = point_ids
+        self.point_memory = point_memory
 
-                # Bulk load staged points
-                if tmp_paths:
-                    cursor.executemany(
-                        "INSERT IGNORE INTO tmp_paths (tripId, idx, latitude, longitude) VALUES (%s, %s, %s, %s)",
-                        tmp_paths
-                    )
-                    connection.commit()
-
-                    # Create points by using all unique lat, lon from paths in staged table
-                    cursor.execute("""
-                        INSERT IGNORE INTO point (latitude, longitude)
-                        SELECT DISTINCT tmpPath.latitude, tmpPath.longitude
-                        FROM tmp_paths tmpPath
-                    """)
-
-                    # Join staged paths with points to get pointId, then insert all paths into main path table
-                    cursor.execute("""
-                        INSERT IGNORE INTO path (tripId, pointId, idx)
-                        SELECT path.tripId, currentPoint.pointId, path.idx
-                        FROM tmp_paths path
-                        JOIN point currentPoint
-                        ON currentPoint.latitude = path.latitude AND currentPoint.longitude = path.longitude
-                    """)
+    def close_infile_loader(self):
+        if self.infile_loader is not None:
+            self.infile_loader.close()
+            self.infile_loader = None
+
+    def get_point_dictionary(self):
+        if self.point_dictionary is None:
+            self.point_dictionary = PointDictionary.from_cursor(
+                self.cursor, max_bytes=self.point_memory, fixed=(self.coordinates == "fixed")
+            )
+            print(f"Point dictionary warmed with {len(self.point_dictionary):,} points.")
+        return self.point_dictionary
+
+    def stage(self, name, rows=0):
+        """
+        Times a stage of write_chunk when insert_data is collecting metrics.
+        """
+        return self.metrics.stage(name, rows) if self.metrics is not None else nullcontext()
+
+    def insert_rows(self, table, columns, rows, ignore=False):
+        """
+        Bulk inserts a list of tuples with the selected backend.
+        """
+        if not rows:
+            return
+        if self.backend == "infile":
+            if self.infile_loader is None:
+                self.infile_loader = InfileLoader(self.cursor)
+            self.infile_loader.load_rows(table, columns, rows, ignore=ignore)
+        else:
+            placeholders = ", ".join(["%s"] * len(columns))
+            self.cursor.executemany(
+                f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows
+            )
+
+    def insert_frame(self, table, frame, ignore=False, binary=()):
+        """
+        Bulk inserts the columns of a DataFrame with the selected backend.
+        binary names the columns that hold bytes.
+        """
+        if self.backend == "infile":
+            if self.infile_loader is None:
+                self.infile_loader = InfileLoader(self.cursor)
+            self.infile_loader.load(table, frame, ignore=ignore, binary=binary)
+        else:
+            # tolist() gives Python numbers, which the connector can convert
+            rows = list(zip(*(frame[column].tolist() for column in frame.columns)))
+            self.insert_rows(table, tuple(frame.columns), rows, ignore=ignore)
+
+    def write_chunk(self, chunk):
+        """
+        Writes one parsed chunk (see parse_chunk) to the trip, origin_call, origin_stand, point and path tables.
+        The whole chunk, including its checkpoint row, is committed as one transaction.
+        """
+        connection = self.db_connection
+        staging = chunk.points > 0 and self.point_ids == "staging"
+        if self.metrics is not None:
+            self.metrics.add_stage("csv_read", chunk.readSeconds, chunk.size)
+            self.metrics.add_stage("parse", chunk.parseSeconds, chunk.points)
+        try:
+            if staging:
+                # Before the first write, TRUNCATE must not end up inside the chunk's transaction
+                with self.stage("prepare_staging"):
+                    self.prepare_staging()
+
+            # Bulk trip, origin_call and origin_stand insertion
+            with self.stage("trip_insert", chunk.size + len(chunk.origin_calls) + len(chunk.origin_stands)):
+                self.insert_rows('trip', TRIP_COLUMNS, chunk.trips, ignore=True)
+                self.insert_rows('origin_call', ('tripId', 'callerId'), chunk.origin_calls)
+                self.insert_rows('origin_stand', ('tripId', 'standId'), chunk.origin_stands)
+
+            if staging:
+                self.write_paths_staging(chunk)
+            elif chunk.points > 0:
+                self.write_paths_client(chunk)
+
+            if self.trajectories:
+                with self.stage("trajectory_insert", chunk.size):
+                    self.write_trajectories(chunk)
+
+            if self.summaries:
+                with self.stage("summary_insert", chunk.size):
+                    self.write_trip_summaries(chunk)
+
+            if self.checkpoints is not None and chunk.firstRow is not None:
+                with self.stage("checkpoint", 1):
+                    self.checkpoints.record(chunk)
+            # Invalidates the cached query results of the tables, see querycache.py
+            bump_table_versions(self.cursor, self.written_tables())
+            with self.stage("commit"):
                 connection.commit()
-                chunk_count += 1
-                print(f"Finished chunk {chunk_count} with {chunksize} trips.")
-            except:
-                connection.rollback()
-                raise
+            self.chunk_count += 1
+            if self.metrics is not None:
+                print(self.metrics.end_chunk(chunk))
+            else:
+                print(f"Finished chunk {self.chunk_count} with {chunk.size} trips.")
+        except:
+            connection.rollback()
+            if self.point_dictionary is not None:
+                # It may hold pointIds that were never committed, rebuild it from the table next time
+                self.point_dictionary = None
+            raise
+
+    def written_tables(self):
+        """
+        The tables write_chunk writes to with the current options.
+        """
+        tables = ['trip', 'origin_call', 'origin_stand', 'point', 'path']
+        if self.trajectories:
+            tables.append('trip_trajectory')
+        if self.summaries:
+            tables.append('trip_summary')
+        return tables
+
+    def prepare_staging(self):
+        """
+        The tmp_paths staging table is created once per connection and truncated for every chunk.
+        """
+        self.cursor.execute(CREATE_TMP_PATHS.format(coordType=COORDINATE_TYPES[self.coordinates]))
+        self.cursor.execute("TRUNCATE TABLE tmp_paths")
+
+    def write_paths_staging(self, chunk):
+        """
+        Stages the points in tmp_paths, inserts the new coordinates into point and joins them back to get pointIds.
+        """
+        cursor = self.cursor
+        with self.stage("tmp_paths_insert", chunk.points):
+            if chunk.tmp_paths is not None and self.backend == "executemany":
+                self.insert_rows('tmp_paths', ('tripId', 'idx', 'latitude', 'longitude'), chunk.tmp_paths, ignore=True)
+            else:
+                self.insert_frame('tmp_paths', chunk.path_frame(fixed=(self.coordinates == "fixed")), ignore=True)
+        with self.stage("point_dedup", chunk.points):
+            cursor.execute(INSERT_POINTS_FROM_TMP)
+        with self.stage("path_join", chunk.points):
+            cursor.execute(INSERT_PATHS_FROM_TMP)
+
+    def write_paths_client(self, chunk):
+        """
+        Assigns pointIds with the point dictionary, so new points and path rows are written with their ids
+        and no join against point is needed.
+        """
+        dictionary = self.get_point_dictionary()
+        with self.stage("point_dictionary", chunk.points):
+            pointIds, newIds, newLat, newLon = dictionary.assign(chunk.lat, chunk.lon)
+        with self.stage("point_insert", len(newIds)):
+            if len(newIds):
+                if self.coordinates == "fixed":
+                    newLat, newLon = to_fixed(newLat), to_fixed(newLon)
+                self.insert_frame('point', pd.DataFrame({'pointId': newIds, 'latitude': newLat, 'longitude': newLon}))
+        with self.stage("path_insert", chunk.points):
+            self.insert_frame('path', pd.DataFrame({
+                'tripId': chunk.path_trip_ids(),
+                'pointId': pointIds,
+                'idx': point_indexes(chunk.offsets),
+            }), ignore=True)
+
+
+    def write_trajectories(self, chunk):
+        """
+        Writes one trip_trajectory row per trip of the chunk, also for trips without points.
+        """
+        self.insert_frame('trip_trajectory', pd.DataFrame({
+            'tripId': np.arange(chunk.firstTripId, chunk.firstTripId + chunk.size, dtype=np.int64),
+            'pointCount': point_counts(chunk.offsets),
+            'points': encode_trajectories(chunk.lat, chunk.lon, chunk.offsets),
+        }), ignore=True, binary=('points',))
+
+    def write_trip_summaries(self, chunk):
+        """
+        Writes the trip_summary rows of the trips of the chunk that have points.
+        """
+        tripIds = np.arange(chunk.firstTripId, chunk.firstTripId + chunk.size, dtype=np.int64)
+        startTimes = [trip[3] for trip in chunk.trips]
+        self.insert_frame('trip_summary', summarize_trips(tripIds, startTimes, chunk.lat, chunk.lon, chunk.offsets),
+                          ignore=True)
+
+    def rebuild_trip_summary(self, batch=10000):
+        """
+        Recomputes trip_summary from the trip, path and point tables, for databases that were loaded
+        before the table existed or without summaries. Works through batch tripIds at a time,
+        committing after each, and marks the table complete at the end (see tripsummary.mark_summary),
+        so an interrupted rebuild is not used by default.
+        """
+        self.coordinates = detect_coordinates(self.cursor)
+        self.cursor.execute("DROP TABLE IF EXISTS trip_summary")
+        self.create_trip_summary_table("trip_summary")
+        create_version_table(self.cursor)
+        bump_table_versions(self.cursor, ['trip_summary'])
+        self.db_connection.commit()
+        self.cursor.execute("SELECT MIN(tripId), MAX(tripId) FROM trip")
+        low, high = self.cursor.fetchone()
+        if low is None:
+            mark_summary(self.cursor, True)
+            return
+        for first in range(low, high + 1, batch):
+            last = first + batch - 1
+            self.cursor.execute("SELECT tripId, startTime FROM trip WHERE tripId BETWEEN %s AND %s ORDER BY tripId",
+                                (first, last))
+            trips = self.cursor.fetchall()
+            if not trips:
+                continue
+            self.cursor.execute(
+                """
+                SELECT p.tripId, pt.latitude, pt.longitude
+                FROM path p
+                JOIN point pt ON pt.pointId = p.pointId
+                WHERE p.tripId BETWEEN %s AND %s
+                ORDER BY p.tripId, p.idx
+                """,
+                (first, last)
+            )
+            points = np.array(self.cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+            tripIds = np.array([trip[0] for trip in trips], dtype=np.int64)
+            counts = np.bincount(np.searchsorted(tripIds, points[:, 0].astype(np.int64)), minlength=len(tripIds))
+            offsets = np.zeros(len(tripIds) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            lat, lon = points[:, 1], points[:, 2]
+            if self.coordinates == "fixed":
+                lat, lon = from_fixed(lat), from_fixed(lon)
+            self.insert_frame('trip_summary', summarize_trips(tripIds, [trip[1] for trip in trips], lat, lon, offsets))
+            bump_table_versions(self.cursor, ['trip_summary'])
+            self.db_connection.commit()
+            print(f"Rebuilt trip summary up to tripId {min(last, high)}")
+        mark_summary(self.cursor, True)
+
+
+class ParsedChunk:
+    """
+    Rows for one chunk of porto.csv, ready for bulk insertion.
+
+    The trips get consecutive tripIds starting at firstTripId. lat, lon and offsets hold the
+    decoded polylines (see polyline.decode_polylines).
+    """
+
+    def __init__(self, firstTripId, trips, origin_calls, origin_stands, lat, lon, offsets, tmp_paths):
+        self.firstTripId = firstTripId
+        self.firstRow = None  # Position of the first trip in porto.csv, when known
+        self.rows = len(trips)  # csv rows the chunk covers, more than size when an append skipped trips
+        self.readSeconds = 0.0
+        self.bytesRead = None  # How far the csv reader had come in the file
+        self.size = len(trips)
+        self.trips = trips  # tripId, originalTripId, taxiId, startTime, dayType, missingData
+        self.origin_calls = origin_calls
+        self.origin_stands = origin_stands
+        self.lat = lat
+        self.lon = lon
+        self.offsets = offsets
+        self.tmp_paths = tmp_paths  # (tripId, idx, latitude, longitude) - pointId comes later through staging table
+        self.parseSeconds = 0.0
+
+    @property
+    def points(self):
+        return int(self.offsets[-1])
+
+    def path_trip_ids(self):
+        """
+        tripId of every point in the chunk.
+        """
+        tripIds = np.arange(self.firstTripId, self.firstTripId + self.size, dtype=np.int64)
+        return np.repeat(tripIds, point_counts(self.offsets))
+
+    def path_frame(self, fixed=False):
+        """
+        The staged path rows as a DataFrame with tmp_paths' columns, coordinates in micro-degrees if fixed.
+        """
+        return pd.DataFrame({
+            'tripId': self.path_trip_ids(),
+            'idx': point_indexes(self.offsets),
+            'latitude': to_fixed(self.lat) if fixed else self.lat,
+            'longitude': to_fixed(self.lon) if fixed else self.lon,
+        })
+
+
+def existing_original_trip_ids(cursor, originalTripIds, beforeTripId, batch=1000):
+    """
+    The originalTripIds among the given ones that belong to a trip with tripId < beforeTripId.
+    Every id is one lookup in the originalTripId index, independent of the size of the trip table.
+    """
+    ids = np.unique(originalTripIds).tolist()
+    found = []
+    for start in range(0, len(ids), batch):
+        part = ids[start:start + batch]
+        cursor.execute(
+            f"SELECT DISTINCT originalTripId FROM trip "
+            f"WHERE tripId < %s AND originalTripId IN ({', '.join(['%s'] * len(part))})",
+            [beforeTripId] + part
+        )
+        found.extend(row[0] for row in cursor.fetchall())
+    return np.array(found, dtype=np.int64)
+
+
+def parse_chunk(df, firstTripId, firstRow=None, path_rows=True):
+    """
+    Turns a DataFrame chunk of porto.csv into a ParsedChunk.
+    Module level so that it can run in worker processes.
+    With path_rows=False the tmp_paths tuples are not built, for writers that only use the arrays.
+    """
+    start = time.perf_counter()
+    trips = []
+    origin_calls = []
+    origin_stands = []
+
+    # Create lists used for bulk insertion
+    tripId = firstTripId
+    for row in df.itertuples(index=False):
+        originalTripId = int(getattr(row, 'TRIP_ID'))
+        taxiId = int(getattr(row, 'TAXI_ID'))
+        startTime = datetime.fromtimestamp(int(getattr(row, 'TIMESTAMP')))
+        dayType = str(getattr(row, 'DAY_TYPE'))
+        missingData = bool(getattr(row, 'MISSING_DATA'))
+
+        trips.append((tripId, originalTripId,taxiId, startTime, dayType, missingData))
+
+        callerId = getattr(row, 'ORIGIN_CALL')
+        if pd.notnull(callerId):
+            origin_calls.append((tripId, int(callerId)))
+
+        standId = getattr(row, 'ORIGIN_STAND')
+        if pd.notnull(standId):
+            origin_stands.append((tripId, int(standId)))
+        tripId += 1
+
+    # Decode all polylines of the chunk at once, or take them from the columnar cache
+    lat, lon, offsets = polylines(df)
+    chunk = ParsedChunk(firstTripId, trips, origin_calls, origin_stands, lat, lon, offsets, None)
+    chunk.firstRow = firstRow
+    chunk.rows = df.attrs.get('rows', len(df))
+    chunk.readSeconds = df.attrs.get('readSeconds', 0.0)
+    chunk.bytesRead = df.attrs.get('bytesRead')
+    if path_rows:
+        chunk.tmp_paths = list(zip(chunk.path_trip_ids().tolist(), point_indexes(offsets).tolist(), lat.tolist(), lon.tolist()))
+    chunk.parseSeconds = time.perf_counter() - start
+    return chunk
 
 
 def main():
@@ -210,13 +883,9 @@ def main():
     try:
         program = CreateTables()
         # program.clean_database()
-        program.create_trip_table("trip")
-        program.create_point_table("point")
-        program.create_path_table("path")
-        program.create_origin_call_table("origin_call")
-        program.create_origin_stand_table("origin_stand")
+        program.create_all_tables()
         program.show_tables()
-        # program.insert_data()
+        # program.insert_data()  # see insert_data for workers, backend and point_ids
 
     except Exception as e:
         print("ERROR: Failed to run example:", e)
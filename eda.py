@@ -1,36 +1,44 @@
 
 import pandas as pd
 import matplotlib.pyplot as plt
-import ast
 import seaborn as sns
 from geopy.distance import geodesic
+from portodata import polylines, read_porto
 
 
 def read_porto_csv(filepath='porto.csv'):
     """
-    Reads the porto.csv file and returns a pandas DataFrame.
+    Reads the porto.csv file and returns a pandas DataFrame, from its columnar cache when that is
+    up to date (python portodata.py build).
     """
-    df = pd.read_csv(filepath)
+    df = read_porto(filepath)
     return df
 
-def calculate_time_from_start(row):
+def trip_points(df, i):
+    """
+    (lats, lons) of the i-th trip of df.
+    """
+    lats, lons, _ = polylines(df.iloc[[i]])
+    return lats, lons
+
+def calculate_time_from_start(df, i):
     """
     Calculate the time in minutes from the start of the trip.
     """
-    start_time = pd.to_datetime(row['TIMESTAMP'], unit='s')
-    num_points = len(ast.literal_eval(row['POLYLINE']))
+    start_time = pd.to_datetime(df.iloc[i]['TIMESTAMP'], unit='s')
+    num_points = len(trip_points(df, i)[0])
     trip_time_seconds = num_points * 15
     end_time = start_time + pd.Timedelta(seconds=trip_time_seconds)
     return end_time
 
-def calculate_start_end_meters(row):
+def calculate_start_end_meters(df, i):
     """
     Calculate the difference between start and end points in meters from the POLYLINE data.
     """
-    polyline_points = ast.literal_eval(row['POLYLINE'])
-    start = polyline_points[0] if polyline_points else None
-    end = polyline_points[-1] if polyline_points else None
-    difference_meters = geodesic((start[1], start[0]), (end[1], end[0])).meters if start and end else None
+    lats, lons = trip_points(df, i)
+    if len(lats) == 0:
+        return None
+    difference_meters = geodesic((lats[0], lons[0]), (lats[-1], lons[-1])).meters
     return difference_meters
 
 
@@ -46,8 +54,8 @@ print(df.info())
 
 # Aspects of first row
 print("Start Time: ", pd.to_datetime(df.iloc[0]['TIMESTAMP'], unit='s'))
-print("End Time: ", calculate_time_from_start(df.iloc[0]))
-print("Start and End Meters: ", calculate_start_end_meters(df.iloc[0]))
+print("End Time: ", calculate_time_from_start(df, 0))
+print("Start and End Meters: ", calculate_start_end_meters(df, 0))
 
 ### Specific EDA ###
 
@@ -81,9 +89,12 @@ selected_holidays = {
 }
 
 df['start_time'] = pd.to_datetime(df['TIMESTAMP'], unit='s')
-df['start_month'], df['start_day'] = df['start_time'].dt.month, df['start_time'].dt.day
+df['start_month'] = df['start_time'].dt.month.astype('int8')
+df['start_day'] = df['start_time'].dt.day.astype('int8')
 
-df['is_holiday'] = df.apply(lambda row: (row.start_month, row.start_day) in selected_holidays, axis=1)
+# month * 100 + day, so the holiday check is one vectorized isin instead of a Python call per row
+holiday_keys = [month * 100 + day for month, day in selected_holidays]
+df['is_holiday'] = (df['start_month'].astype('int16') * 100 + df['start_day']).isin(holiday_keys)
 
 sns.countplot(x='is_holiday', data=df)
 plt.xlabel('Is fixed holiday or day before')
@@ -104,10 +115,7 @@ df_missing = df[df['MISSING_DATA'] == True]
 
 print("Missing data rows length:",len(df_missing))
 print(df_missing)
-missing_polyline_points = ast.literal_eval(df_missing.iloc[0]['POLYLINE'])
-
-lons = [point[0] for point in missing_polyline_points]
-lats = [point[1] for point in missing_polyline_points]
+lats, lons = trip_points(df_missing, 0)
 
 plt.plot(lons, lats, marker='o')
 plt.xlabel('Longitude')
@@ -138,8 +146,9 @@ Task 2-7 takes long to run, result shown in screenshot
 count = 0
 chunksize = 10000  # Adjust based on your memory
 
-for chunk in pd.read_csv('porto/porto/porto.csv', chunksize=chunksize):
-    count += chunk['POLYLINE'].apply(lambda x: len(ast.literal_eval(x)) < 3).sum()
+for chunk in read_porto('porto/porto/porto.csv', chunksize=chunksize):
+    _, _, offsets = polylines(chunk)
+    count += (point_counts(offsets) < 3).sum()
 
 print(f"Number of rows with less than 3 points in POLYLINE: {count}")
 """
@@ -151,7 +160,7 @@ plt.ylabel('Density')
 plt.show()
 
 print("Start Time: ", pd.to_datetime(df.iloc[0]['TIMESTAMP'], unit='s'))
-print("End Time: ", calculate_time_from_start(df.iloc[0]))
+print("End Time: ", calculate_time_from_start(df, 0))
 
 # Integrity
 nulls = df.isna().sum()
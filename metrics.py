@@ -0,0 +1,178 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from tabulate import tabulate
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_mb():
+    """
+    High-water mark of this process' resident memory in MB, or None where the platform does not report it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class IngestMetrics:
+    """
+    Per-stage timings for insert_data, written as JSON lines.
+
+    The log starts with a "start" record, has one "chunk" record per committed chunk with the wall
+    time and row count of every stage, and ends with a "summary" record holding the totals.
+    compare_logs diffs the summaries of two runs.
+    """
+
+    def __init__(self, log_path, source_file=None, options=None):
+        self.log_path = log_path
+        self.total_bytes = os.path.getsize(source_file) if source_file and os.path.exists(source_file) else None
+        self.start = time.perf_counter()
+        self.chunks = 0
+        self.trips = 0
+        self.points = 0
+        self.bytes_read = 0
+        self.first_progress = None  # (time, bytes) after the first chunk, the base for the ETA
+        self.totals = {}
+        self.stages = {}
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self.log = open(log_path, "w", encoding="utf-8")
+        self.write({"event": "start", "time": datetime.now().isoformat(timespec="seconds"),
+                    "source": source_file, "sourceBytes": self.total_bytes, "options": options or {}})
+
+    def write(self, record):
+        self.log.write(json.dumps(record) + "\n")
+        self.log.flush()
+
+    def add_stage(self, name, seconds, rows=0):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "rows": 0})
+        stage["seconds"] += seconds
+        stage["rows"] += rows
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start, rows)
+
+    def eta_seconds(self):
+        if not self.total_bytes or self.first_progress is None:
+            return None
+        firstTime, firstBytes = self.first_progress
+        elapsed = time.perf_counter() - firstTime
+        done = self.bytes_read - firstBytes
+        if done <= 0 or elapsed <= 0:
+            return None
+        return max(self.total_bytes - self.bytes_read, 0) * elapsed / done
+
+    def end_chunk(self, chunk):
+        """
+        Writes the chunk record and returns a one line progress message.
+        """
+        self.chunks += 1
+        self.trips += chunk.size
+        self.points += chunk.points
+        self.bytes_read = max(self.bytes_read, chunk.bytesRead or 0)
+        if self.first_progress is None:
+            self.first_progress = (time.perf_counter(), self.bytes_read)
+        for name, stage in self.stages.items():
+            total = self.totals.setdefault(name, {"seconds": 0.0, "rows": 0})
+            total["seconds"] += stage["seconds"]
+            total["rows"] += stage["rows"]
+
+        elapsed = time.perf_counter() - self.start
+        eta = self.eta_seconds()
+        memory = peak_memory_mb()
+        self.write({
+            "event": "chunk",
+            "chunk": self.chunks,
+            "firstRow": chunk.firstRow,
+            "trips": chunk.size,
+            "points": chunk.points,
+            "bytesRead": self.bytes_read,
+            "elapsedSeconds": round(elapsed, 3),
+            "etaSeconds": None if eta is None else round(eta, 1),
+            "peakMemoryMb": memory,
+            "stages": {name: {"seconds": round(stage["seconds"], 4), "rows": stage["rows"]}
+                       for name, stage in self.stages.items()},
+        })
+        self.stages = {}
+
+        message = (f"Finished chunk {self.chunks} with {chunk.size} trips ({chunk.points:,} points), "
+                   f"{self.trips / elapsed:,.0f} trips/s, {self.points / elapsed:,.0f} points/s")
+        if self.total_bytes:
+            message += f", {self.bytes_read / self.total_bytes:.1%} of the file"
+        if eta is not None:
+            message += f", ETA {timedelta(seconds=int(eta))}"
+        return message
+
+    def close(self):
+        elapsed = time.perf_counter() - self.start
+        self.write({
+            "event": "summary",
+            "chunks": self.chunks,
+            "trips": self.trips,
+            "points": self.points,
+            "wallSeconds": round(elapsed, 3),
+            "peakMemoryMb": peak_memory_mb(),
+            "stages": {name: {"seconds": round(total["seconds"], 3), "rows": total["rows"],
+                              "rowsPerSecond": round(total["rows"] / total["seconds"]) if total["seconds"] else None}
+                       for name, total in self.totals.items()},
+        })
+        self.log.close()
+        print(self.summary_table())
+
+    def summary_table(self):
+        elapsed = time.perf_counter() - self.start
+        rows = [
+            (name, f"{total['seconds']:.1f}", f"{total['seconds'] / elapsed:.0%}" if elapsed else "-",
+             f"{total['rows']:,}", f"{total['rows'] / total['seconds']:,.0f}" if total["seconds"] else "-")
+            for name, total in sorted(self.totals.items(), key=lambda item: -item[1]["seconds"])
+        ]
+        return tabulate(rows, headers=["Stage", "Seconds", "Share", "Rows", "Rows/s"], tablefmt="pretty")
+
+
+def read_summary(log_path):
+    with open(log_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    summaries = [r for r in records if r["event"] == "summary"]
+    if not summaries:
+        raise ValueError(f"{log_path} has no summary record, the run did not finish")
+    return summaries[-1]
+
+
+def compare_logs(before_path, after_path):
+    """
+    Table of the stage totals of two ingestion logs, with the speedup of the second run.
+    """
+    before, after = read_summary(before_path), read_summary(after_path)
+    rows = []
+    names = list(before["stages"]) + [name for name in after["stages"] if name not in before["stages"]]
+    for name in names + ["(wall)"]:
+        if name == "(wall)":
+            a, b = before["wallSeconds"], after["wallSeconds"]
+        else:
+            a = before["stages"].get(name, {}).get("seconds")
+            b = after["stages"].get(name, {}).get("seconds")
+        speedup = f"{a / b:.2f}x" if a and b else "-"
+        rows.append((name, "-" if a is None else f"{a:.1f}", "-" if b is None else f"{b:.1f}", speedup))
+    rows.append(("peak memory MB", before.get("peakMemoryMb"), after.get("peakMemoryMb"), ""))
+    return tabulate(rows, headers=["Stage", "Before (s)", "After (s)", "Speedup"], tablefmt="pretty")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python metrics.py BEFORE.jsonl AFTER.jsonl")
+        sys.exit(1)
+    print(compare_logs(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,310 @@
+import time
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from polyline import COORDINATE_SCALE, point_counts
+from proximity import PROXIMITY_METERS, PROXIMITY_SECONDS, close_taxi_pairs, parallel_taxi_pairs, store_extent, store_trips
+from spatialgrid import bounding_box
+from streamtable import PrettyTableWriter
+from trajectorystore import SECONDS_PER_POINT, TrajectoryStore
+from tripsummary import haversine_meters
+from utils import OUTPUT_MESSAGE, PLAIN_OUTPUT_MESSAGE, results_path, write_results
+
+
+# Scale of the DECIMAL results of MySQL: a division adds div_precision_increment (4) digits to the
+# scale of its dividend, and so does AVG to the scale of its argument
+DIV_PRECISION = 4
+POINT_BATCH = 10_000_000
+
+
+def decimal_div(numerator, denominator, scale):
+    """
+    numerator / denominator of Python ints as MySQL computes it for DECIMAL values, rounded half
+    away from zero to scale digits, in units of 10**-scale.
+    """
+    quotient, remainder = divmod(abs(numerator) * 10**scale, abs(denominator))
+    quotient += 2 * remainder >= abs(denominator)
+    return quotient if (numerator < 0) == (denominator < 0) else -quotient
+
+
+def decimal_round(units, scale, digits):
+    """
+    ROUND of a DECIMAL of units * 10**-scale to digits, as a Decimal with that many digits.
+    """
+    return Decimal(decimal_div(units, 10**(scale - digits), 0)).scaleb(-digits)
+
+
+def double_round(values, digits):
+    """
+    ROUND of DOUBLE values, which MySQL does with rint.
+    """
+    return np.rint(np.asarray(values) * 10.0**digits) / 10.0**digits
+
+
+def local_seconds(seconds):
+    """
+    The wall clock time of unix seconds in the local time zone, as seconds since 1970-01-01 local:
+    what insert_data stores in the DATETIME columns. Time zones change their offset on whole hours.
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours.tolist()], dtype=np.int64)
+    return seconds + offsets[inverse]
+
+
+def group_starts(keys):
+    """
+    Start of every run of equal keys in a sorted array.
+    """
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+
+
+class NumpyQueries:
+    """
+    task1 to task11 of Queries computed in process from a trajectorystore.TrajectoryStore, without
+    MySQL. The results files are byte for byte those of Queries on a database with the same trips
+    (task8 except around daylight saving changes, see task8):
+    the DECIMAL and DOUBLE arithmetic and rounding of MySQL are reproduced, and times are wall clock
+    times in the local time zone, like the DATETIME columns insert_data writes.
+
+    Trips are per-trip arrays in store order, which is by taxi and start time, so per-taxi groups
+    are runs and per-trip values come from the first and last point of each trip.
+    """
+
+    def __init__(self, store="trajectories", output_dir="results"):
+        self.directory = store
+        self.store = TrajectoryStore(store)
+        self.output_dir = output_dir
+        columns = self.store.columns
+        self.tripIds = np.asarray(columns['tripId'])
+        self.originalTripIds = np.asarray(columns['originalTripId'])
+        self.taxiIds = np.asarray(columns['taxiId'])
+        self.startTimes = np.asarray(columns['startTime'])
+        self.offsets = np.asarray(self.store.offsets)
+        self.counts = point_counts(self.offsets)
+        # The call type the queries derive from origin_call and origin_stand
+        self.callTypes = np.where(np.asarray(columns['originCall']) >= 0, "A",
+                                  np.where(np.asarray(columns['originStand']) >= 0, "B", "C"))
+        self._endpoints = None
+
+    def write_output(self, filename, output, message=OUTPUT_MESSAGE):
+        write_results(self.output_dir, filename, output, message)
+
+    def write_table(self, filename, headers, rows):
+        """
+        rows as tabulate(rows, headers, tablefmt="pretty") writes them, without building the string.
+        """
+        path = results_path(self.output_dir, filename)
+        with PrettyTableWriter(path, headers) as table:
+            table.write(rows)
+        print(f"{OUTPUT_MESSAGE} {path}")
+
+    def endpoints(self):
+        """
+        (store indexes, durationSeconds, distanceMeters) of the trips with points, the rows of the
+        tripEndpoints CTE.
+        """
+        if self._endpoints is None:
+            trips = np.flatnonzero(self.counts > 0)
+            first, last = self.offsets[trips], self.offsets[trips + 1] - 1
+            lat, lon = self.store.lat, self.store.lon
+            distances = haversine_meters(lat[first], lon[first], lat[last], lon[last])
+            self._endpoints = (trips, (self.counts[trips] - 1) * SECONDS_PER_POINT, distances)
+        return self._endpoints
+
+    # How many taxis, trips, and total GPS points are there?
+    def task1(self):
+        # The point table holds every distinct coordinate pair once, and porto.csv has 6 decimals
+        keys = []
+        for first in range(0, self.store.points, POINT_BATCH):
+            lat = np.rint(np.asarray(self.store.lat[first:first + POINT_BATCH]) * COORDINATE_SCALE).astype(np.int64)
+            lon = np.rint(np.asarray(self.store.lon[first:first + POINT_BATCH]) * COORDINATE_SCALE).astype(np.int64)
+            keys.append(np.unique((lat + 90 * COORDINATE_SCALE) * (360 * COORDINATE_SCALE + 1) +
+                                  lon + 180 * COORDINATE_SCALE))
+        points = len(np.unique(np.concatenate(keys))) if keys else 0
+
+        output = (
+            f"Total trips:   {len(self.tripIds):,}\n"
+            f"Distinct taxis: {len(np.unique(self.taxiIds)):,}\n"
+            f"Total points:   {points:,}\n"
+        )
+        self.write_output("task1Output.txt", output)
+
+    # What is the average number of trips per taxi?
+    def task2(self):
+        taxis = len(np.unique(self.taxiIds))
+        # COUNT(*) * 1.0 has scale 1, the division adds 4
+        average = decimal_round(decimal_div(len(self.tripIds), taxis, 1 + DIV_PRECISION), 1 + DIV_PRECISION, 2) \
+            if taxis else None
+
+        self.write_output("task2Output.txt", f"Average trips per taxi: {average}\n", message=PLAIN_OUTPUT_MESSAGE)
+
+    #List the top 20 taxis with the most trips.
+    def task3(self):
+        taxiIds, trips = np.unique(self.taxiIds, return_counts=True)
+        order = np.lexsort((taxiIds, -trips))[:20]
+        results = list(zip(taxiIds[order].tolist(), trips[order].tolist()))
+
+        output = tabulate(results, headers=["Taxi ID", "Trips"], tablefmt="pretty")
+        self.write_output("task3Output.txt", output, message=PLAIN_OUTPUT_MESSAGE)
+
+    # What is the most used call type per taxi?
+    def task4a(self):
+        pairs = pd.DataFrame({"taxiId": self.taxiIds, "callType": self.callTypes})
+        counts = pairs.groupby(["taxiId", "callType"]).size().reset_index(name="callCount")
+        counts = counts.sort_values(["taxiId", "callCount", "callType"], ascending=[True, False, True])
+        best = counts.drop_duplicates("taxiId")
+        results = list(zip(best["taxiId"].tolist(), best["callType"].tolist(), best["callCount"].tolist()))
+
+        output = tabulate(results, headers=["taxiId", "callType", "callCount"], tablefmt="pretty")
+        self.write_output("task4aOutput.txt", output, message=PLAIN_OUTPUT_MESSAGE)
+
+    # For each call type, compute the average trip duration and distance, and also
+    # #report the share of trips starting in four time bands: 00–06, 06–12, 12–18, and
+    # 18–24.
+    def task4b(self):
+        trips, durations, distances = self.endpoints()
+        names = {"A": "Call", "B": "Stand", "C": "Street"}
+        hours = local_seconds(self.startTimes[trips]) // 3600 % 24
+        callTypes = self.callTypes[trips]
+        scale = DIV_PRECISION  # DurationSeconds / 60
+        results = []
+        for callType in sorted(names, key=names.get):
+            chosen = callTypes == callType
+            count = int(chosen.sum())
+            if not count:
+                continue
+            # Every duration is a multiple of 15 s, so DurationSeconds / 60 is exact at scale 4
+            minutes = int((durations[chosen] * 10**scale // 60).sum())
+            averageMinutes = decimal_round(decimal_div(minutes, count, DIV_PRECISION), scale + DIV_PRECISION, 2)
+            averageKilometers = float(double_round((distances[chosen] / 1000).sum() / count, 2))
+            bands = np.bincount(hours[chosen] // 6, minlength=4).tolist()
+            # SUM(...) / COUNT(*) has scale 4 and * 100 keeps it
+            shares = [decimal_round(decimal_div(band, count, DIV_PRECISION) * 100, DIV_PRECISION, 2) for band in bands]
+            results.append([names[callType], averageMinutes, averageKilometers] + shares)
+
+        headers = ["callType", "AverageDurationMinutes", "AverageDistanceKilometers", "00_06", "00_12", "00_18", "00_24"]
+        output = tabulate(results, headers=headers, tablefmt="pretty")
+        self.write_output("task4bOutput.txt", output, message=PLAIN_OUTPUT_MESSAGE)
+
+    #Find the taxis with the most total hours driven as well as total distance driven.
+    #List them in order of total hours.
+    def task5(self):
+        trips, durations, distances = self.endpoints()
+        taxiIds = self.taxiIds[trips]
+        starts = group_starts(taxiIds)
+        seconds = np.add.reduceat(durations, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+        meters = np.add.reduceat(distances, starts) if len(starts) else np.zeros(0)
+        # SUM / 3600.0 has scale 0 + 4; SUM(DOUBLE) / 1000.0 stays a DOUBLE
+        hours = [decimal_round(decimal_div(total, 3600, DIV_PRECISION), DIV_PRECISION, 2) for total in seconds.tolist()]
+        kilometers = double_round(meters / 1000.0, 2).tolist()
+        taxis = taxiIds[starts].tolist()
+        results = sorted(zip(taxis, hours, kilometers), key=lambda row: (-row[1], row[0]))
+
+        headers = ["Taxi ID", "Total Hours", "Total Kilometers"]
+        self.write_table("task5Output.txt", headers, results)
+
+    # Find the trips that passed within 100 m of Porto City Hall.
+    #(longitude, latitude) = (-8.62911, 41.15794)
+    def task6(self):
+        results = [(tripId,) for tripId in self.trips_within(41.15794, -8.62911, 100, limit=20)]
+
+        output = tabulate(results, headers=["tripId"], tablefmt="pretty")
+        self.write_output("task6Output.txt", output)
+
+    def trips_within(self, lat, lon, radius_m, limit=None):
+        """
+        Sorted originalTripIds of the trips with a point within radius_m meters of lat, lon, as
+        Queries.trips_within: the same haversine on every point in a bounding box.
+        """
+        minLat, maxLat, minLon, maxLon = bounding_box(lat, lon, radius_m)
+        found = []
+        for first in range(0, self.store.points, POINT_BATCH):
+            pointLat = np.asarray(self.store.lat[first:first + POINT_BATCH])
+            pointLon = np.asarray(self.store.lon[first:first + POINT_BATCH])
+            near = np.flatnonzero((pointLat >= minLat) & (pointLat <= maxLat) &
+                                  (pointLon >= minLon) & (pointLon <= maxLon))
+            near = near[haversine_meters(lat, lon, pointLat[near], pointLon[near]) <= radius_m]
+            found.append(np.asarray(self.store.tripIndex[first:first + POINT_BATCH])[near])
+        trips = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+        return np.unique(self.originalTripIds[trips]).tolist()[:limit]
+
+    #Identify the number of invalid trips. An invalid trip is defined as a trip with fewer
+    #than 3 GPS points
+    def task7(self):
+        result = [(int((self.counts < 3).sum()),)]
+
+        output = tabulate(result, headers=["InvalidTrips"], tablefmt="pretty")
+        self.write_output("task7Output.txt", output)
+
+    #Find pairs of different taxis that were within 5m and within 5 seconds of each
+    #other at least once.
+    def task8(self, workers=None):
+        """
+        Queries.task8 on the store: the same proximity join, over the same points. The store keeps
+        unix seconds, while Queries.task8 on MySQL times the points by their local wall clock
+        DATETIMEs, so around a daylight saving change the two can differ in the pairs whose points
+        are close in one time scale only. This is the one result that is not guaranteed to be the
+        same as on MySQL.
+        """
+        start, end, lookback = store_extent(self.directory)
+        if end <= start:
+            pairs = []
+        elif workers == 1:
+            pairs = close_taxi_pairs(store_trips(self.store, start, end), PROXIMITY_METERS, PROXIMITY_SECONDS)
+        else:
+            pairs = parallel_taxi_pairs(self.directory, start, end, lookback, workers=workers)
+
+        result = pd.DataFrame(pairs, columns=["TaxiA", "TaxiB"])
+        output = result.to_string(index=False)
+        self.write_output("task8Output.txt", output)
+
+    #Find the trips that started on one calendar day and ended on the next (midnightcrossers).
+    def task9(self):
+        trips, durations, _ = self.endpoints()
+        starts = local_seconds(self.startTimes[trips])
+        crossing = starts // 86400 != (starts + durations) // 86400
+        results = [(tripId,) for tripId in np.sort(self.originalTripIds[trips[crossing]]).tolist()]
+
+        self.write_table("task9Output.txt", ["Trip ID"], results)
+
+    #Find the trips whose start and end points are within 50 m of each other (circular
+    #trips).
+    def task10(self):
+        trips, _, distances = self.endpoints()
+        results = [(tripId,) for tripId in np.sort(self.originalTripIds[trips[distances < 50]]).tolist()]
+
+        self.write_table("task10Output.txt", ["Trip ID"], results)
+
+    #For each taxi, compute the average idle time between consecutive trips. List the
+    #top 20 taxis with the highest average idle time.
+    def task11(self):
+        # The store orders the trips by taxi, start time and tripId, the order of LEAD
+        starts = local_seconds(self.startTimes)
+        taxiStarts = group_starts(self.taxiIds)
+        hasNext = np.ones(len(starts), dtype=bool)
+        hasNext[np.r_[taxiStarts[1:] - 1, len(starts) - 1] if len(starts) else []] = False
+        idle = np.r_[starts[1:], 0] - starts - (self.counts - 1) * SECONDS_PER_POINT
+        # Trips without points have no endTime, so no idle time, but count as idle periods
+        timed = hasNext & (self.counts > 0)
+
+        results = []
+        for first, last in zip(taxiStarts.tolist(), np.r_[taxiStarts[1:], len(starts)].tolist()):
+            periods = int(hasNext[first:last].sum())
+            if not periods:
+                continue
+            seconds = idle[first:last][timed[first:last]]
+            average = None
+            if len(seconds):
+                # AVG(BIGINT) has scale 4, / 60 adds another 4
+                mean = decimal_div(int(seconds.sum()), len(seconds), DIV_PRECISION)
+                average = decimal_round(decimal_div(mean, 60, DIV_PRECISION), 2 * DIV_PRECISION, 2)
+            results.append((int(self.taxiIds[first]), average, periods))
+        # NULL averages come last, as in MySQL's descending order
+        results.sort(key=lambda row: (row[1] is None, -(row[1] or 0), row[0]))
+
+        output = tabulate(results[:20], headers=["taxiId", "avgIdleMinutes", "idlePeriods"], tablefmt="pretty")
+        self.write_output("task11Output.txt", output)
@@ -1,17 +1,20 @@
 import pandas as pd
-import ast
+from polyline import point_counts
+from portodata import polylines, read_porto, with_polyline_text
 
 
 def read_porto_csv(filepath='porto/porto/porto.csv'):
     """
-    Reads the porto.csv file and returns a pandas DataFrame.
+    Reads the porto.csv file and returns a pandas DataFrame, from its columnar cache when that is
+    up to date (python portodata.py build).
     """
-    df = pd.read_csv(filepath)
+    df = read_porto(filepath)
     return df
 
 df = read_porto_csv()
 
 # Drop invalid trips if wanted
-df_clean = df[df['POLYLINE'].apply(lambda x: len(ast.literal_eval(x)) >= 3)].copy()
+_, _, offsets = polylines(df)
+df_clean = df[point_counts(offsets) >= 3].copy()
 df_clean.reset_index(drop=True, inplace=True)
-df_clean.to_csv('porto/porto/porto_clean.csv', index=False)
\ No newline at end of file
+with_polyline_text(df_clean).to_csv('porto/porto/porto_clean.csv', index=False)
\ No newline at end of file
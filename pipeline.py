@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class PipelineStats:
+    """
+    Timings collected by run_pipeline.
+    """
+
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.chunks = 0
+        self.trips = 0
+        self.parseSeconds = 0.0  # Summed over all workers
+        self.waitSeconds = 0.0   # Writer blocked waiting for a parsed chunk
+        self.writeSeconds = 0.0
+        self.wallSeconds = 0.0
+
+    @property
+    def hiddenParseSeconds(self):
+        """
+        Parse time that overlapped with writes instead of stalling the writer.
+        """
+        return max(self.parseSeconds - self.waitSeconds, 0.0)
+
+    def summary(self):
+        share = self.hiddenParseSeconds / self.parseSeconds * 100 if self.parseSeconds else 0.0
+        return (
+            f"Pipelined load: {self.chunks} chunks, {self.trips:,} trips in {self.wallSeconds:.1f}s "
+            f"({self.workers} workers, queue depth {self.queue_depth})\n"
+            f"  parse {self.parseSeconds:.1f}s, write {self.writeSeconds:.1f}s, writer waited {self.waitSeconds:.1f}s\n"
+            f"  {self.hiddenParseSeconds:.1f}s ({share:.0f}%) of parse time hidden behind writes"
+        )
+
+
+def _submit_chunks(pool, chunks, parse, jobs, stop):
+    """
+    Reader thread: submits every chunk to the pool and queues the futures in file order.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                jobs.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for args in chunks:
+            if not put(pool.submit(parse, *args)):
+                return
+    except BaseException as e:
+        put(e)
+    finally:
+        put(None)
+
+
+def run_pipeline(chunks, parse, write, workers=4, queue_depth=4):
+    """
+    Parses chunks in a pool of worker processes while the calling thread writes them.
+
+    chunks yields argument tuples for parse, e.g. (df, firstTripId, firstRow). The tripIds come
+    from the chunk's position in the file, so the result matches a serial load. parse must be a
+    picklable module level function returning an object with size and parseSeconds attributes.
+    write(parsed) is called in file order on the calling thread, so it can safely use the caller's
+    database connection. At most queue_depth chunks are parsed ahead of the writer.
+    """
+    stats = PipelineStats(workers, queue_depth)
+    jobs = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        reader = threading.Thread(
+            target=_submit_chunks, args=(pool, chunks, parse, jobs, stop), daemon=True
+        )
+        reader.start()
+        try:
+            while True:
+                waitStart = time.perf_counter()
+                job = jobs.get()
+                if job is None:
+                    break
+                if isinstance(job, BaseException):
+                    raise job
+                parsed = job.result()
+                writeStart = time.perf_counter()
+                stats.waitSeconds += writeStart - waitStart
+
+                write(parsed)
+                stats.writeSeconds += time.perf_counter() - writeStart
+                stats.parseSeconds += parsed.parseSeconds
+                stats.chunks += 1
+                stats.trips += parsed.size
+        finally:
+            stop.set()
+            # Unblock the reader and drop queued work if the writer failed
+            while not jobs.empty():
+                job = jobs.get_nowait()
+                if job is not None and not isinstance(job, BaseException):
+                    job.cancel()
+            reader.join()
+
+    stats.wallSeconds = time.perf_counter() - start
+    return stats
@@ -0,0 +1,161 @@
+import numpy as np
+
+from polyline import from_fixed, pack_coordinates, unpack_coordinates
+
+
+_EMPTY = np.iinfo(np.int64).min  # Not a valid packed key, latitude would be -2147 degrees
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)  # Fibonacci hashing
+_MAX_LOAD = 0.7
+_BYTES_PER_SLOT = 8 + 4  # int64 key + int32 pointId
+
+
+class PointDictionary:
+    """
+    In-process map from coordinate to pointId, used to assign pointIds before the rows reach MySQL.
+
+    Coordinates are packed into int64 keys (see polyline.pack_coordinates) and stored in an
+    open addressing hash table made of two numpy arrays, keys and pointIds, with linear probing.
+    Lookups and inserts are vectorized over a whole chunk of points. The table never grows
+    beyond max_bytes; assign raises MemoryError instead.
+    """
+
+    def __init__(self, capacity=1 << 20, max_bytes=1 << 30):
+        capacity = 1 << max(int(capacity - 1).bit_length(), 4)
+        if capacity * _BYTES_PER_SLOT > max_bytes:
+            raise MemoryError(f"A point dictionary of {capacity:,} slots does not fit in {max_bytes:,} bytes")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.next_id = 1
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.keys = np.full(capacity, _EMPTY, dtype=np.int64)
+        self.pointIds = np.zeros(capacity, dtype=np.int32)
+        self.bits = capacity.bit_length() - 1
+        self.mask = capacity - 1
+
+    @property
+    def capacity(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.pointIds.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def _hash(self, keys):
+        hashed = keys.view(np.uint64) * _HASH_MULTIPLIER
+        return (hashed >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def _find_slots(self, keys):
+        """
+        For every key, the slot holding it or the first empty slot on its probe sequence.
+        """
+        slots = self._hash(keys)
+        pending = np.arange(len(keys))
+        while pending.size:
+            found = self.keys[slots[pending]]
+            done = (found == keys[pending]) | (found == _EMPTY)
+            pending = pending[~done]
+            slots[pending] = (slots[pending] + 1) & self.mask
+        return slots
+
+    def _insert(self, keys, pointIds):
+        """
+        Inserts keys that are distinct and not yet in the table.
+        """
+        while keys.size:
+            slots = self._find_slots(keys)
+            # Several new keys may probe to the same empty slot, only one of them can take it per round
+            _, first = np.unique(slots, return_index=True)
+            self.keys[slots[first]] = keys[first]
+            self.pointIds[slots[first]] = pointIds[first]
+            self.size += len(first)
+            remaining = np.ones(len(keys), dtype=bool)
+            remaining[first] = False
+            keys = keys[remaining]
+            pointIds = pointIds[remaining]
+
+    def _reserve(self, extra):
+        capacity = self.capacity
+        while (self.size + extra) > capacity * _MAX_LOAD:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        if capacity * _BYTES_PER_SLOT > self.max_bytes:
+            raise MemoryError(
+                f"Point dictionary needs {capacity * _BYTES_PER_SLOT:,} bytes for {self.size + extra:,} points, "
+                f"the ceiling is {self.max_bytes:,} bytes"
+            )
+        used = self.keys != _EMPTY
+        keys, pointIds = self.keys[used], self.pointIds[used]
+        self._allocate(capacity)
+        self.size = 0
+        self._insert(keys, pointIds)
+
+    def lookup(self, lat, lon):
+        """
+        pointId of every (lat, lon) pair, or 0 where the coordinate is unknown.
+        """
+        keys = pack_coordinates(lat, lon)
+        slots = self._find_slots(keys)
+        return np.where(self.keys[slots] == keys, self.pointIds[slots], 0).astype(np.int32)
+
+    def add(self, pointIds, lat, lon):
+        """
+        Adds coordinates that already have a pointId, e.g. rows read from the point table.
+        """
+        keys, first = np.unique(pack_coordinates(lat, lon), return_index=True)
+        pointIds = np.asarray(pointIds, dtype=np.int32)[first]
+        slots = self._find_slots(keys)
+        new = self.keys[slots] != keys
+        self._reserve(int(new.sum()))
+        self._insert(keys[new], pointIds[new])
+        if len(pointIds):
+            self.next_id = max(self.next_id, int(pointIds.max()) + 1)
+
+    def assign(self, lat, lon):
+        """
+        Returns (pointIds, newPointIds, newLat, newLon).
+
+        pointIds holds the pointId of every input point. Coordinates not seen before get the next
+        free pointIds and are returned in newPointIds/newLat/newLon, which are the rows that still
+        have to be inserted into the point table.
+        """
+        keys, inverse = np.unique(pack_coordinates(lat, lon), return_inverse=True)
+        slots = self._find_slots(keys)
+        known = self.keys[slots] == keys
+        ids = np.where(known, self.pointIds[slots], 0).astype(np.int32)
+
+        newKeys = keys[~known]
+        # Grow first: a MemoryError must not leave pointIds handed out that the dictionary lacks
+        self._reserve(len(newKeys))
+        newIds = np.arange(self.next_id, self.next_id + len(newKeys), dtype=np.int32)
+        ids[~known] = newIds
+        self._insert(newKeys, newIds)
+        self.next_id += len(newKeys)
+
+        newLat, newLon = unpack_coordinates(newKeys)
+        return ids[inverse], newIds, newLat, newLon
+
+    @classmethod
+    def from_cursor(cls, cursor, table="point", batch=1_000_000, max_bytes=1 << 30, fixed=False):
+        """
+        Builds a dictionary holding every row of an existing point table.
+        fixed tells that the table stores integer micro-degrees instead of DOUBLE degrees.
+        """
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        rows = cursor.fetchone()[0]
+        dictionary = cls(capacity=int(rows / _MAX_LOAD) + 1, max_bytes=max_bytes)
+
+        cursor.execute(f"SELECT pointId, latitude, longitude FROM {table}")
+        while True:
+            fetched = cursor.fetchmany(batch)
+            if not fetched:
+                break
+            values = np.array(fetched, dtype=np.float64)
+            lat, lon = (from_fixed(values[:, 1]), from_fixed(values[:, 2])) if fixed else (values[:, 1], values[:, 2])
+            dictionary.add(values[:, 0].astype(np.int32), lat, lon)
+        return dictionary
@@ -0,0 +1,171 @@
+import json
+import math
+import os
+import pickle
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from polyline import from_fixed
+from tripsummary import EARTH_RADIUS_METERS, haversine_meters
+from utils import detect_coordinates
+
+
+TREE_VERSION = 1
+# Relative slack on the chord radius, so that rounding in the tree never drops a point that the
+# exact haversine check afterwards keeps
+RADIUS_SLACK = 1e-9
+
+
+def to_cartesian(lat, lon):
+    """
+    Points on a sphere of EARTH_RADIUS_METERS as (n, 3) coordinates in meters. The straight line
+    between two of them is a monotonic function of their great circle distance, see chord_meters.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return EARTH_RADIUS_METERS * np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def chord_meters(distance_m):
+    """
+    Straight line length of a great circle distance on the sphere of to_cartesian.
+    """
+    return 2 * EARTH_RADIUS_METERS * np.sin(np.minimum(distance_m, math.pi * EARTH_RADIUS_METERS) /
+                                            (2 * EARTH_RADIUS_METERS))
+
+
+class PointTree:
+    """
+    KD-tree over all rows of the point table, persisted in a directory and loaded in a fraction of
+    a second: pointIds, lat and lon are memory-mapped .npy files and the tree is a pickled cKDTree
+    over the points' 3D coordinates on the sphere, so no projection distorts distances anywhere.
+    Radius results are checked with the same haversine formula as the queries, so they match SQL.
+    """
+
+    def __init__(self, directory="pointtree"):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != TREE_VERSION:
+            raise ValueError(f"{directory} holds a point tree of version {self.manifest.get('version')}, "
+                             f"expected {TREE_VERSION}; rebuild it")
+        self.directory = directory
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.pointIds, self.lat, self.lon = load("pointIds"), load("lat"), load("lon")
+        with open(os.path.join(directory, "tree.pickle"), "rb") as f:
+            self.tree = pickle.load(f)
+
+    def __len__(self):
+        return len(self.pointIds)
+
+    def is_current(self, cursor):
+        """
+        True if the point table still has the points the tree was built from. Points are only
+        ever added, so the count and the largest pointId tell.
+        """
+        cursor.execute("SELECT COUNT(*), COALESCE(MAX(pointId), 0) FROM point")
+        count, maxPointId = cursor.fetchone()
+        return count == self.manifest["points"] and maxPointId == self.manifest["maxPointId"]
+
+    def _within_rows(self, lat, lon, radius_m, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return rows
+        rows.sort()
+        distances = haversine_meters(lat, lon, self.lat[rows], self.lon[rows])
+        return rows[distances <= radius_m]
+
+    def within(self, lat, lon, radius_m):
+        """
+        Sorted pointIds of the points within radius_m meters of lat, lon.
+        """
+        centre = to_cartesian([lat], [lon])[0]
+        rows = self.tree.query_ball_point(centre, chord_meters(radius_m) * (1 + RADIUS_SLACK))
+        return np.sort(np.asarray(self.pointIds[self._within_rows(lat, lon, radius_m, rows)]))
+
+    def within_many(self, lats, lons, radius_m):
+        """
+        within for many centres at once, as a list with one array of pointIds per centre. radius_m
+        is one radius for all centres or one per centre.
+        """
+        radii = np.broadcast_to(np.asarray(radius_m, dtype=np.float64), np.shape(lats))
+        centres = to_cartesian(lats, lons)
+        found = self.tree.query_ball_point(centres, chord_meters(radii) * (1 + RADIUS_SLACK))
+        return [np.sort(np.asarray(self.pointIds[self._within_rows(lat, lon, radius, rows)]))
+                for lat, lon, radius, rows in zip(np.ravel(lats).tolist(), np.ravel(lons).tolist(),
+                                                  radii.ravel().tolist(), found)]
+
+    def nearest(self, lats, lons, k=1):
+        """
+        (pointIds, meters) of the k nearest points of every centre, as arrays of shape (centres, k),
+        nearest first. meters is the great circle distance.
+        """
+        lats, lons = np.atleast_1d(lats), np.atleast_1d(lons)
+        _, rows = self.tree.query(to_cartesian(lats, lons), k=min(k, len(self)))
+        rows = np.asarray(rows).reshape(len(lats), -1)
+        meters = haversine_meters(lats[:, None], lons[:, None], self.lat[rows], self.lon[rows])
+        return np.asarray(self.pointIds[rows]), meters
+
+
+def build_point_tree(cursor, directory="pointtree", batch=1_000_000):
+    """
+    Builds the PointTree of the point table of the database. The points are read batch rows at a time.
+    """
+    start = time.perf_counter()
+    fixed = detect_coordinates(cursor) == "fixed"
+    cursor.execute("SELECT pointId, latitude, longitude FROM point ORDER BY pointId")
+    pointIds, lat, lon = [], [], []
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            break
+        ids, latitudes, longitudes = zip(*rows)
+        pointIds.append(np.array(ids, dtype=np.int64))
+        lat.append(np.array(latitudes, dtype=np.float64))
+        lon.append(np.array(longitudes, dtype=np.float64))
+    pointIds = np.concatenate(pointIds) if pointIds else np.empty(0, np.int64)
+    lat = np.concatenate(lat) if lat else np.empty(0)
+    lon = np.concatenate(lon) if lon else np.empty(0)
+    if fixed:
+        lat, lon = from_fixed(lat), from_fixed(lon)
+    return write_point_tree(directory, pointIds, lat, lon, started=start)
+
+
+def write_point_tree(directory, pointIds, lat, lon, started=None):
+    """
+    Writes a PointTree of the given points (coordinates in degrees) to directory and opens it.
+    """
+    started = time.perf_counter() if started is None else started
+    building = directory.rstrip("/\\") + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    for name, values in (("pointIds", pointIds), ("lat", lat), ("lon", lon)):
+        np.save(os.path.join(building, f"{name}.npy"), values)
+    tree = cKDTree(to_cartesian(lat, lon))
+    with open(os.path.join(building, "tree.pickle"), "wb") as f:
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(building, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": TREE_VERSION, "points": len(pointIds),
+                   "maxPointId": int(pointIds.max()) if len(pointIds) else 0,
+                   "built": datetime.now().isoformat(timespec="seconds")}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(building, directory)
+    print(f"Point tree with {len(pointIds):,} points written to {directory} in {time.perf_counter() - started:.1f}s")
+    return PointTree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["build"] or len(sys.argv) > 3:
+        print("Usage: python pointtree.py build [directory]")
+        sys.exit(1)
+    from DbConnector import DbConnector
+
+    connection = DbConnector()
+    try:
+        build_point_tree(connection.cursor, *sys.argv[2:])
+    finally:
+        connection.close_connection()
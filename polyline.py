@@ -0,0 +1,102 @@
+import numpy as np
+
+
+# Characters removed from a POLYLINE string before the coordinates are handed to numpy
+_STRIP_BRACKETS = str.maketrans("", "", "[] ")
+
+
+def decode_polylines(polylines):
+    """
+    Decodes a sequence of POLYLINE strings (e.g. a DataFrame column) into flat numpy arrays.
+
+    Returns (lat, lon, offsets), where the points of trip i are lat[offsets[i]:offsets[i+1]]
+    and lon[offsets[i]:offsets[i+1]]. No Python objects are created per point: every string is
+    stripped of its brackets, the non-empty ones are joined and the whole chunk is parsed by
+    numpy in a single call.
+    """
+    counts = np.zeros(len(polylines), dtype=np.int64)
+    parts = []
+    for i, poly in enumerate(polylines):
+        # Missing values come through pandas as NaN, and "[]" is a trip without points
+        if not isinstance(poly, str) or len(poly) <= 2:
+            continue
+        # Every point adds one "[", on top of the outer bracket of the list
+        counts[i] = poly.count("[") - 1
+        parts.append(poly)
+
+    offsets = np.zeros(len(polylines) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    if not parts:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty.copy(), offsets
+
+    flat = np.fromstring(",".join(parts).translate(_STRIP_BRACKETS), dtype=np.float64, sep=",")
+    if flat.size != 2 * offsets[-1]:
+        raise ValueError(f"Malformed POLYLINE chunk: expected {2 * offsets[-1]} values, parsed {flat.size}")
+
+    # POLYLINE stores [longitude, latitude] pairs
+    lon = np.ascontiguousarray(flat[0::2])
+    lat = np.ascontiguousarray(flat[1::2])
+    return lat, lon, offsets
+
+
+def decode_polyline(polyline):
+    """
+    Decodes a single POLYLINE string into (lat, lon) numpy arrays.
+    """
+    lat, lon, _ = decode_polylines([polyline])
+    return lat, lon
+
+
+def point_counts(offsets):
+    """
+    Returns the number of points of every trip described by an offsets array.
+    """
+    return np.diff(offsets)
+
+
+def point_indexes(offsets):
+    """
+    Returns the position (idx) of every point within its own trip, as a flat array.
+    """
+    counts = np.diff(offsets)
+    return np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], counts)
+
+
+# Porto coordinates have 6 decimals, so micro-degrees represent them exactly as integers
+COORDINATE_SCALE = 1_000_000
+
+
+def to_fixed(degrees):
+    """
+    Converts degrees to integer micro-degrees (int32 is enough for any latitude/longitude).
+    """
+    return np.rint(np.asarray(degrees, dtype=np.float64) * COORDINATE_SCALE).astype(np.int32)
+
+
+def from_fixed(micro_degrees):
+    """
+    Converts integer micro-degrees back to degrees. Dividing two exact numbers gives the same
+    double as parsing the original 6-decimal text, so the round trip is lossless. The division
+    writes the doubles directly, without an intermediate float copy of the input.
+    """
+    return np.divide(micro_degrees, COORDINATE_SCALE, dtype=np.float64)
+
+
+def pack_coordinates(lat, lon):
+    """
+    Packs (lat, lon) pairs into one int64 key per point: latitude in the high 32 bits,
+    longitude in the low 32 bits, both as micro-degrees.
+    """
+    return (to_fixed(lat).astype(np.int64) << 32) | (to_fixed(lon).astype(np.int64) & 0xFFFFFFFF)
+
+
+def unpack_coordinates(keys):
+    """
+    Inverse of pack_coordinates, returns (lat, lon) in degrees.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    lat = (keys >> 32).astype(np.int32)
+    lon = (keys & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+    return from_fixed(lat), from_fixed(lon)
@@ -0,0 +1,256 @@
+import json
+import os
+import shutil
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from polyline import decode_polylines, point_counts
+
+
+CACHE_VERSION = 1
+
+# Scalar columns of porto.csv and how the cache stores them. ORIGIN_CALL and ORIGIN_STAND are
+# float64 with NaN for missing values, which is what pd.read_csv makes of the whole file.
+CACHE_COLUMNS = {
+    'TRIP_ID': np.int64,
+    'CALL_TYPE': 'S1',
+    'ORIGIN_CALL': np.float64,
+    'ORIGIN_STAND': np.float64,
+    'TAXI_ID': np.int64,
+    'TIMESTAMP': np.int64,
+    'DAY_TYPE': 'S1',
+    'MISSING_DATA': np.bool_,
+}
+POINT_ARRAYS = {'lat': np.float64, 'lon': np.float64}
+
+# Compact dtypes of the columns of porto.csv, used by read_porto unless typed=False. Unix timestamps
+# of 2013-2014 and taxi ids (2000xxxx) fit in int32, stands (1-63) and callers in nullable ints.
+# The categories are fixed so that every chunk of a chunked read gets the same dtype.
+PORTO_DTYPES = {
+    'TRIP_ID': 'int64',
+    'CALL_TYPE': pd.CategoricalDtype(['A', 'B', 'C']),
+    'ORIGIN_CALL': 'Int32',
+    'ORIGIN_STAND': 'Int8',
+    'TAXI_ID': 'int32',
+    'TIMESTAMP': 'int32',
+    'DAY_TYPE': pd.CategoricalDtype(['A', 'B', 'C']),
+    'MISSING_DATA': 'bool',
+    'POLYLINE': 'object',
+}
+
+
+def cache_path(filepath):
+    """
+    Directory of the columnar cache of a csv: porto.csv is cached in porto_cache/.
+    """
+    return os.path.splitext(os.path.abspath(filepath))[0] + "_cache"
+
+
+def read_manifest(filepath):
+    try:
+        with open(os.path.join(cache_path(filepath), "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == CACHE_VERSION else None
+
+
+def cache_is_fresh(filepath):
+    """
+    True if the cache of filepath exists and is newer than the csv. Without the csv, any cache will do.
+    """
+    manifest = read_manifest(filepath)
+    if manifest is None:
+        return False
+    if not os.path.exists(filepath):
+        return True
+    built = os.path.getmtime(os.path.join(cache_path(filepath), "manifest.json"))
+    return built >= os.path.getmtime(filepath) and manifest["sourceBytes"] == os.path.getsize(filepath)
+
+
+def build_cache(filepath='porto.csv', chunksize=100000):
+    """
+    Converts a csv in porto.csv format into the columnar cache: one .npy file per scalar column,
+    the decoded coordinates of all trips in lat.npy/lon.npy and the per-trip offsets in offsets.npy.
+
+    The csv is streamed chunksize rows at a time into raw files, which are only turned into .npy
+    files at the end, so memory use does not depend on the size of the csv.
+    """
+    start = time.perf_counter()
+    directory = cache_path(filepath)
+    building = directory + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    dtypes = {**CACHE_COLUMNS, **POINT_ARRAYS, 'counts': np.int64}
+    raw = {name: open(os.path.join(building, f"{name}.raw"), "wb") for name in dtypes}
+    rows = points = 0
+    try:
+        for df in read_porto(filepath, chunksize=chunksize, use_cache=False):
+            lat, lon, offsets = decode_polylines(df['POLYLINE'].tolist())
+            for column, dtype in CACHE_COLUMNS.items():
+                if dtype is np.float64:
+                    values = df[column].to_numpy(dtype=dtype, na_value=np.nan)
+                else:
+                    values = df[column].to_numpy().astype(dtype)
+                raw[column].write(values.tobytes())
+            raw['lat'].write(lat.tobytes())
+            raw['lon'].write(lon.tobytes())
+            raw['counts'].write(point_counts(offsets).astype(np.int64).tobytes())
+            rows += len(df)
+            points += int(offsets[-1])
+            print(f"Cached {rows:,} trips ({points:,} points)")
+    finally:
+        for handle in raw.values():
+            handle.close()
+
+    for name, dtype in dtypes.items():
+        rawPath = os.path.join(building, f"{name}.raw")
+        values = np.memmap(rawPath, dtype=dtype, mode="r") if os.path.getsize(rawPath) else np.empty(0, dtype)
+        if name == 'counts':
+            offsets = np.lib.format.open_memmap(os.path.join(building, "offsets.npy"), mode="w+",
+                                                dtype=np.int64, shape=(rows + 1,))
+            offsets[0] = 0
+            np.cumsum(values, out=offsets[1:])
+            offsets.flush()
+        else:
+            target = np.lib.format.open_memmap(os.path.join(building, f"{name}.npy"), mode="w+",
+                                               dtype=values.dtype, shape=values.shape)
+            for first in range(0, len(values), 1 << 24):
+                target[first:first + (1 << 24)] = values[first:first + (1 << 24)]
+            target.flush()
+        del values
+        os.remove(rawPath)
+
+    with open(os.path.join(building, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "source": os.path.basename(filepath), "rows": rows,
+                   "points": points, "sourceBytes": os.path.getsize(filepath)}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(building, directory)
+    _point_arrays.cache_clear()
+    print(f"Cache of {filepath} written to {directory} in {time.perf_counter() - start:.1f}s")
+    return directory
+
+
+@lru_cache(maxsize=4)
+def _point_arrays(directory):
+    return tuple(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ("lat", "lon"))
+
+
+def _cached_frame(directory, first, last, sourceBytes, totalRows, columns=None, typed=True):
+    frame = {}
+    for column in CACHE_COLUMNS:
+        if columns is not None and column not in columns:
+            continue
+        values = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")[first:last]
+        if typed:
+            values = values.astype(str) if values.dtype.kind == "S" else values
+            frame[column] = pd.Series(values, copy=True).astype(PORTO_DTYPES[column])
+        else:
+            # Strings come back as Python str objects, like pd.read_csv gives them
+            frame[column] = values.astype(str).astype(object) if values.dtype.kind == "S" else np.array(values)
+    # The positions of the points take the place of the POLYLINE column
+    if columns is None or 'POLYLINE' in columns:
+        offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")[first:last + 1]
+        frame['POINT_OFFSET'] = np.array(offsets[:-1])
+        frame['POINT_COUNT'] = np.diff(offsets).astype(np.int32)
+    df = pd.DataFrame(frame)
+    df.index = pd.RangeIndex(first, last)
+    df.attrs = {'portoCache': directory,
+                'sourceBytes': sourceBytes * last // totalRows if totalRows else 0}
+    return df
+
+
+def read_cache(filepath, chunksize=None, start_row=0, end_row=None, columns=None, typed=True):
+    """
+    Rows [start_row, end_row) of the cache as one DataFrame, or as an iterator of chunksize-row
+    DataFrames. The POLYLINE column is replaced by POINT_OFFSET and POINT_COUNT, the position of
+    every trip's points in the cached coordinate arrays; use polylines(df) to get them.
+    columns and typed work as in read_porto.
+    """
+    manifest = read_manifest(filepath)
+    if manifest is None:
+        raise FileNotFoundError(f"{filepath} has no columnar cache, build it with: python portodata.py build {filepath}")
+    directory = cache_path(filepath)
+    totalRows = manifest["rows"]
+    end_row = totalRows if end_row is None else min(end_row, totalRows)
+    start_row = min(start_row, end_row)
+    read = lambda first, last: _cached_frame(directory, first, last, manifest["sourceBytes"], totalRows,
+                                             columns, typed)
+    if chunksize is None:
+        return read(start_row, end_row)
+    return (read(first, min(first + chunksize, end_row)) for first in range(start_row, end_row, chunksize))
+
+
+def read_porto(source='porto.csv', chunksize=None, start_row=0, end_row=None, use_cache=True, columns=None,
+               typed=True):
+    """
+    Reads porto.csv as a DataFrame, or as an iterator of DataFrames of chunksize rows.
+
+    source is a path or an open csv file. For a path with a cache that is newer than the csv,
+    the rows come from the cache (see read_cache) instead of the csv text. polylines(df) gives
+    the decoded coordinates either way.
+
+    columns limits the columns that are read. The columns get the compact PORTO_DTYPES; with
+    typed=False they get pandas' defaults (int64, float64, object strings) instead.
+    """
+    if use_cache and isinstance(source, (str, os.PathLike)) and cache_is_fresh(source):
+        return read_cache(source, chunksize, start_row, end_row, columns, typed)
+    kwargs = {}
+    if start_row > 0:
+        kwargs['skiprows'] = range(1, start_row + 1)  # keep the header line
+    if end_row is not None:
+        kwargs['nrows'] = max(end_row - start_row, 0)
+    if typed:
+        kwargs['dtype'] = PORTO_DTYPES
+    return pd.read_csv(source, chunksize=chunksize, usecols=columns, **kwargs)
+
+
+def polylines(df):
+    """
+    (lat, lon, offsets) of the trips in df, see polyline.decode_polylines. Frames read from the
+    cache are served from its memory-mapped coordinate arrays, without parsing any text; for
+    consecutive rows the coordinates are views on the cache files.
+    """
+    if 'POLYLINE' in df.columns:
+        return decode_polylines(df['POLYLINE'].tolist())
+    lat, lon = _point_arrays(df.attrs['portoCache'])
+    starts = df['POINT_OFFSET'].to_numpy(dtype=np.int64)
+    counts = df['POINT_COUNT'].to_numpy(dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if len(starts) and np.array_equal(starts[1:], starts[:-1] + counts[:-1]):
+        first = starts[0]
+        return np.asarray(lat[first:first + offsets[-1]]), np.asarray(lon[first:first + offsets[-1]]), offsets
+    index = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+    return lat[index], lon[index], offsets
+
+
+def with_polyline_text(df):
+    """
+    df in the column layout of porto.csv, e.g. to write it back with to_csv. Frames read from the
+    cache get their POLYLINE strings back, with the 6 decimals of the original file.
+    """
+    if 'POLYLINE' in df.columns:
+        return df
+    return df.drop(columns=['POINT_OFFSET', 'POINT_COUNT']).assign(POLYLINE=polyline_text(*polylines(df)))
+
+
+def polyline_text(lat, lon, offsets):
+    """
+    POLYLINE strings of porto.csv, [[lon,lat],...] with 6 decimals, of the trips in (lat, lon, offsets).
+    """
+    lat, lon = lat.tolist(), lon.tolist()
+    return ["[" + ",".join(f"[{lon[j]:.6f},{lat[j]:.6f}]" for j in range(first, last)) + "]"
+            for first, last in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != "build":
+        print("Usage: python portodata.py build [porto.csv]")
+        sys.exit(1)
+    build_cache(sys.argv[2] if len(sys.argv) == 3 else 'porto.csv')
@@ -0,0 +1,360 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from DbConnector import DbConnector
+from polyline import from_fixed, point_counts, point_indexes
+from trajectory import BYTES_PER_POINT, decode_trajectories
+from trajectorystore import TrajectoryStore
+from tripsummary import EARTH_RADIUS_METERS, SECONDS_PER_POINT, haversine_meters
+
+
+PROXIMITY_METERS = 5
+PROXIMITY_SECONDS = 5
+METERS_PER_DEGREE = EARTH_RADIUS_METERS * np.pi / 180
+
+# Bits of the packed grid cell key: x and y cells of PROXIMITY_METERS around the world, then the
+# time bucket of PROXIMITY_SECONDS relative to the oldest point in the window
+X_BITS, Y_BITS, T_BITS = 23, 22, 18
+MAX_BATCH = 1 << 20  # points joined at once, bounds the memory of the candidate pairs
+PARTITION_DAYS = 6
+# Cells are this much wider than meters, so that the scale of the grid, which is exact only at the
+# centre of a cell row, can never push two points within meters more than one cell apart
+CELL_MARGIN = 1.001
+
+
+class ProximityJoin:
+    """
+    Streaming spatiotemporal self-join: finds the pairs of different taxis that had points within
+    meters of each other at most seconds apart.
+
+    Points are fed with add() in nondecreasing time order. The join keeps a sliding window of the
+    points of the last seconds, so its memory depends on the size of a batch and on how many points
+    fall into one window, not on the time span that is streamed. Every batch is joined with itself
+    and with the window through a grid of cells of meters x meters x seconds: the points are sorted
+    by their packed cell key and every point looks up the 3 x 3 spatial neighbour cells in its own
+    and the previous time bucket with searchsorted. A pair is found from its later point only.
+
+    Cell rows are bands of latitude, and the columns of a row are scaled by the cosine of the
+    latitude of its centre, so two points are keyed with the same scale when they are compared:
+    a point looks up the columns of a neighbour row at that row's scale. The candidates are then
+    tested with tripsummary.haversine_meters.
+
+    With since, only pairs whose later point is at or after since are found; the points of the
+    seconds before since are still needed as the window of the first ones.
+    """
+
+    def __init__(self, meters=PROXIMITY_METERS, seconds=PROXIMITY_SECONDS, since=None):
+        self.meters = meters
+        self.seconds = seconds
+        self.since = since
+        self.cell = meters * CELL_MARGIN
+        self.window = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), np.empty(0))
+        self.codes = set()
+        self.points = 0
+
+    def add(self, seconds, taxiIds, lat, lon):
+        """
+        Joins a batch of points (unix seconds, taxiId, lat, lon) with the window. The batch may be in
+        any order, but none of its points may be older than a point of an earlier batch.
+        """
+        seconds = np.asarray(seconds, dtype=np.int64)
+        if not len(seconds):
+            return
+        order = np.argsort(seconds, kind="stable")
+        seconds, taxiIds = seconds[order], np.asarray(taxiIds, dtype=np.int64)[order]
+        lat = np.asarray(lat, dtype=np.float64)[order]
+        lon = np.asarray(lon, dtype=np.float64)[order]
+        if len(self.window[0]) and seconds[0] < self.window[0][-1]:
+            raise ValueError("points must be added in time order")
+        # Slices of at most MAX_BATCH points and a time span that fits the bucket bits of the key
+        span = ((1 << (T_BITS - 1)) - 2) * self.seconds
+        first = 0
+        while first < len(seconds):
+            last = min(first + MAX_BATCH, int(np.searchsorted(seconds, seconds[first] + span, side="left")))
+            self._add_sorted(seconds[first:last], taxiIds[first:last], lat[first:last], lon[first:last])
+            first = last
+
+    def _add_sorted(self, *batch):
+        times, taxis, lat, lon = (np.concatenate(pair) for pair in zip(self.window, batch))
+        first = len(self.window[0])
+        self._join(times, taxis, lat, lon, first)
+        self.points += len(times) - first
+
+        keep = times >= times[-1] - self.seconds
+        self.window = (times[keep], taxis[keep], lat[keep], lon[keep])
+
+    def _columns(self, lon, rows):
+        """
+        Cell columns of points at lon in the given cell rows, at the scale of each row's centre.
+        """
+        scale = np.cos(np.radians((rows + 0.5) * self.cell / METERS_PER_DEGREE)) * METERS_PER_DEGREE
+        return np.floor(lon * scale / self.cell).astype(np.int64)
+
+    @staticmethod
+    def _keys(columns, rows, bucket):
+        return ((columns + (1 << (X_BITS - 1))) << (Y_BITS + T_BITS)) | ((rows + (1 << (Y_BITS - 1))) << T_BITS) | bucket
+
+    def _join(self, times, taxis, lat, lon, first):
+        rows = np.floor(lat * METERS_PER_DEGREE / self.cell).astype(np.int64)
+        bucket = (times - times[0]) // self.seconds + 1
+        keys = self._keys(self._columns(lon, rows), rows, bucket)
+        order = np.argsort(keys, kind="stable")
+        sortedKeys = keys[order]
+
+        later = np.arange(first, len(times))
+        if self.since is not None:
+            later = later[times[later] >= self.since]
+        for dy in (-1, 0, 1):
+            neighbourRows = rows[later] + dy
+            columns = self._columns(lon[later], neighbourRows)
+            for dx in (-1, 0, 1):
+                for dt in (-1, 0):
+                    target = self._keys(columns + dx, neighbourRows, bucket[later] + dt)
+                    lo = np.searchsorted(sortedKeys, target, side="left")
+                    hi = np.searchsorted(sortedKeys, target, side="right")
+                    counts = hi - lo
+                    total = int(counts.sum())
+                    if not total:
+                        continue
+                    a = np.repeat(later, counts)
+                    b = order[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)]
+                    # The points are in time order, so b < a visits every pair once, from its later point
+                    close = (b < a) & (taxis[a] != taxis[b]) & (times[a] - times[b] <= self.seconds)
+                    a, b = a[close], b[close]
+                    close = haversine_meters(lat[a], lon[a], lat[b], lon[b]) <= self.meters
+                    if close.any():
+                        low = np.minimum(taxis[a[close]], taxis[b[close]])
+                        high = np.maximum(taxis[a[close]], taxis[b[close]])
+                        self.codes.update(np.unique((low << 32) | high).tolist())
+
+    def pairs(self):
+        """
+        The taxi pairs found so far as a sorted list of (smaller taxiId, larger taxiId).
+        """
+        return [(code >> 32, code & 0xFFFFFFFF) for code in sorted(self.codes)]
+
+
+def points_in_time_order(trips):
+    """
+    Turns batches of trips into batches of points in time order.
+
+    trips yields (taxiIds, startSeconds, lat, lon, offsets) batches of trips in nondecreasing start
+    time; point i of a trip is at startSeconds + i * SECONDS_PER_POINT. Once a batch is read, no
+    later trip can have a point before its last start time, so the points before it are yielded
+    as (seconds, taxiIds, lat, lon) and the rest waits for the next batch. Memory is bounded by the
+    trips that are still running at a time, not by the time span that is read.
+    """
+    pending = []
+    for taxiIds, startSeconds, lat, lon, offsets in trips:
+        counts = point_counts(offsets)
+        seconds = np.repeat(np.asarray(startSeconds, dtype=np.int64), counts) + point_indexes(offsets) * SECONDS_PER_POINT
+        pending.append((seconds, np.repeat(np.asarray(taxiIds, dtype=np.int64), counts),
+                        np.asarray(lat), np.asarray(lon)))
+        if len(startSeconds):
+            horizon = int(np.max(startSeconds))
+            ready, pending = _split_pending(pending, horizon)
+            if ready is not None:
+                yield ready
+    ready, _ = _split_pending(pending, None)
+    if ready is not None:
+        yield ready
+
+
+def _split_pending(pending, horizon):
+    seconds, taxiIds, lat, lon = (np.concatenate(column) for column in zip(*pending)) if pending else [np.empty(0)] * 4
+    if not len(seconds):
+        return None, []
+    done = np.ones(len(seconds), dtype=bool) if horizon is None else seconds < horizon
+    rest = [(seconds[~done], taxiIds[~done], lat[~done], lon[~done])] if not done.all() else []
+    if not done.any():
+        return None, rest
+    order = np.argsort(seconds[done], kind="stable")
+    return (seconds[done][order], taxiIds[done][order], lat[done][order], lon[done][order]), rest
+
+
+def database_trips(cursor, start, end, layout="path", coordinates="double", hours=24):
+    """
+    Yields (taxiIds, startSeconds, lat, lon, offsets) batches of the trips starting in [start, end),
+    ordered by start time, one query per hours of start times. layout "trajectory" reads the points
+    from trip_trajectory, any other from path and point.
+
+    The seconds count from 1970-01-01 in the local wall clock time that trip.startTime holds, which
+    is not unix time: around daylight saving changes they differ from the seconds of a
+    TrajectoryStore (see NumpyQueries.task8). Every window is a range on the startTime index of trip.
+    """
+    epoch = "TIMESTAMPDIFF(SECOND, '1970-01-01', t.startTime)"
+    for periodStart in range(int(start), int(end), hours * 3600):
+        periodEnd = min(periodStart + hours * 3600, int(end))
+        params = (periodStart, periodEnd)
+        if layout == "trajectory":
+            cursor.execute(f"""
+                SELECT t.taxiId, {epoch}, tt.points
+                FROM trip t
+                JOIN trip_trajectory tt ON tt.tripId = t.tripId
+                WHERE t.startTime >= TIMESTAMP('1970-01-01') + INTERVAL %s SECOND
+                  AND t.startTime < TIMESTAMP('1970-01-01') + INTERVAL %s SECOND
+                ORDER BY t.startTime, t.tripId
+            """, params)
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            lat, lon, offsets = decode_trajectories([row[2] for row in rows])
+            yield (np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows], dtype=np.int64),
+                   from_fixed(lat), from_fixed(lon), offsets)
+        else:
+            cursor.execute(f"""
+                SELECT t.tripId, t.taxiId, {epoch}, pt.latitude, pt.longitude
+                FROM trip t
+                JOIN path p ON p.tripId = t.tripId
+                JOIN point pt ON pt.pointId = p.pointId
+                WHERE t.startTime >= TIMESTAMP('1970-01-01') + INTERVAL %s SECOND
+                  AND t.startTime < TIMESTAMP('1970-01-01') + INTERVAL %s SECOND
+                ORDER BY t.startTime, t.tripId, p.idx
+            """, params)
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            tripIds, taxiIds, startSeconds, lat, lon = (np.array(column) for column in zip(*rows))
+            first = np.flatnonzero(np.r_[True, tripIds[1:] != tripIds[:-1]])
+            offsets = np.append(first, len(rows)).astype(np.int64)
+            if coordinates == "fixed":
+                lat, lon = from_fixed(lat), from_fixed(lon)
+            yield (taxiIds[first].astype(np.int64), startSeconds[first].astype(np.int64),
+                   lat.astype(np.float64), lon.astype(np.float64), offsets)
+
+
+def store_trips(store, start=None, end=None, batch=10000):
+    """
+    Yields (taxiIds, startSeconds, lat, lon, offsets) batches of the trips of a TrajectoryStore
+    starting in [start, end) (unix seconds), ordered by start time.
+    """
+    byStart = np.argsort(store.startTimes, kind="stable")
+    startTimes = store.startTimes[byStart]
+    first = 0 if start is None else int(np.searchsorted(startTimes, start, side="left"))
+    last = len(byStart) if end is None else int(np.searchsorted(startTimes, end, side="left"))
+    taxiIds = np.asarray(store.columns['taxiId'])
+    allOffsets = np.asarray(store.offsets)
+    for position in range(first, last, batch):
+        trips = byStart[position:min(position + batch, last)]
+        counts = allOffsets[trips + 1] - allOffsets[trips]
+        offsets = np.zeros(len(trips) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index = np.repeat(allOffsets[trips] - offsets[:-1], counts) + np.arange(offsets[-1])
+        yield taxiIds[trips], store.startTimes[trips], store.lat[index], store.lon[index], offsets
+
+
+def close_taxi_pairs(trips, meters=PROXIMITY_METERS, seconds=PROXIMITY_SECONDS, since=None, until=None):
+    """
+    Sorted (taxiA, taxiB) pairs of different taxis with points within meters and seconds of each
+    other, for trips in the format of database_trips and store_trips.
+
+    since and until (unix seconds) limit the result to the pairs whose later point is in
+    [since, until), the share of one time partition; trips must then include those that started
+    up to the longest trip duration before since.
+    """
+    join = ProximityJoin(meters, seconds, since)
+    for times, taxiIds, lat, lon in points_in_time_order(trips):
+        if until is not None and times[0] >= until:
+            break
+        keep = np.ones(len(times), dtype=bool)
+        if since is not None:
+            keep &= times >= since - seconds
+        if until is not None:
+            keep &= times < until
+        join.add(times[keep], taxiIds[keep], lat[keep], lon[keep])
+    return join.pairs()
+
+
+def longest_trip_seconds(cursor, layout="path"):
+    """
+    Duration of the longest trip in the database, read from trip_summary with layout "summary",
+    from the blob lengths of trip_trajectory with "trajectory" and from the path indexes otherwise.
+    """
+    if layout == "summary":
+        cursor.execute("SELECT MAX(durationSeconds) FROM trip_summary")
+        return int(cursor.fetchone()[0] or 0)
+    if layout == "trajectory":
+        cursor.execute("SELECT MAX(LENGTH(points)) FROM trip_trajectory")
+        points = int(cursor.fetchone()[0] or 0) // BYTES_PER_POINT
+        return max(points - 1, 0) * SECONDS_PER_POINT
+    cursor.execute("SELECT MAX(idx) FROM path")
+    return int(cursor.fetchone()[0] or 0) * SECONDS_PER_POINT
+
+
+def store_extent(directory):
+    """
+    (first start, last start + 1, longest trip duration) of a TrajectoryStore, in seconds.
+    """
+    store = TrajectoryStore(directory)
+    if not len(store):
+        return 0, 0, 0
+    counts = point_counts(np.asarray(store.offsets))
+    return (int(store.startTimes.min()), int(store.startTimes.max()) + 1,
+            max(int(counts.max()) - 1, 0) * SECONDS_PER_POINT)
+
+
+def time_partitions(start, end, days=PARTITION_DAYS):
+    """
+    [since, until) ranges of days covering [start, end).
+    """
+    step = days * 86400
+    return [(since, min(since + step, end)) for since in range(int(start), int(end), step)]
+
+
+def partition_pairs(source, since, until, lookback, layout="path", coordinates="double",
+                    meters=PROXIMITY_METERS, seconds=PROXIMITY_SECONDS):
+    """
+    The pairs of one time partition (see close_taxi_pairs), read from a TrajectoryStore when source
+    is its directory and over a connection of its own when source is "database". The partition
+    reads the trips that started up to lookback + seconds before since, so that the points of the
+    seconds before since, which overlap with the previous partition, are part of its window.
+    Runs in a worker process of parallel_taxi_pairs.
+    """
+    first = since - lookback - seconds
+    if source != "database":
+        store = TrajectoryStore(source)
+        return close_taxi_pairs(store_trips(store, first, until), meters, seconds, since, until)
+    connection = DbConnector(banner=False)
+    try:
+        trips = database_trips(connection.cursor, first, until, layout, coordinates)
+        return close_taxi_pairs(trips, meters, seconds, since, until)
+    finally:
+        connection.close_connection()
+
+
+def parallel_taxi_pairs(source, start, end, lookback, layout="path", coordinates="double", workers=None,
+                        days=PARTITION_DAYS, meters=PROXIMITY_METERS, seconds=PROXIMITY_SECONDS, progress=False):
+    """
+    close_taxi_pairs for the trips starting in [start, end), split into partitions of days that
+    run in a pool of workers processes (all cores by default). Every pair is found by the
+    partition of its later point, so the union of the partitions is the result of a single run.
+    progress prints a line as every partition finishes.
+    """
+    partitions = time_partitions(start, end + lookback, days)
+    workers = workers or os.cpu_count()
+    arguments = [(source, since, until, lookback, layout, coordinates, meters, seconds) for since, until in partitions]
+    pairs = set()
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(partitions), 1))) as pool:
+        for i, part in enumerate(pool.map(partition_pairs, *zip(*arguments)) if arguments else ()):
+            pairs.update(part)
+            if progress:
+                print(f"Partition {i + 1}/{len(partitions)} done")
+    return sorted(pairs)
+
+
+def brute_force_pairs(seconds, taxiIds, lat, lon, meters=PROXIMITY_METERS, maxSeconds=PROXIMITY_SECONDS):
+    """
+    The pairs of close_taxi_pairs by comparing all pairs of points, for checking the join on small data.
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    taxiIds = np.asarray(taxiIds, dtype=np.int64)
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    pairs = set()
+    for i in range(len(seconds)):
+        close = ((np.abs(seconds[i + 1:] - seconds[i]) <= maxSeconds) & (taxiIds[i + 1:] != taxiIds[i]) &
+                 (haversine_meters(lat[i], lon[i], lat[i + 1:], lon[i + 1:]) <= meters))
+        for other in taxiIds[i + 1:][close].tolist():
+            pairs.add((min(int(taxiIds[i]), other), max(int(taxiIds[i]), other)))
+    return sorted(pairs)
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import pickle
+import random
+import re
+import tempfile
+import zlib
+
+from utils import table_exists
+
+
+VERSION_TABLE = "table_version"
+# Row of table_version with a random number drawn when the table is created, so that the versions
+# of a database that was dropped and created again, and count from 1 again, never match old entries
+EPOCH_ROW = "@epoch"
+# Tables whose versions CreateTables bumps; only queries that read nothing else are cached
+CACHED_TABLES = ('trip', 'point', 'path', 'origin_call', 'origin_stand', 'trip_trajectory', 'trip_summary')
+ENTRY_SUFFIX = ".cache"
+
+# Names after FROM or JOIN, leaving out column references such as EXTRACT(YEAR FROM t.startTime)
+TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?\b(?!\s*\.)", re.IGNORECASE)
+# Names defined by WITH name AS ( ... ), name AS ( ... )
+CTE_DEFINITION = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*(\w+)\s*(?:\([^()]*\))?\s+AS\s*\(", re.IGNORECASE)
+
+
+def create_version_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            tableName VARCHAR(64) PRIMARY KEY,
+            version BIGINT NOT NULL
+        )
+    """)
+    cursor.execute(f"INSERT IGNORE INTO {VERSION_TABLE} (tableName, version) VALUES (%s, %s)",
+                   (EPOCH_ROW, random.getrandbits(62)))
+
+
+def bump_table_versions(cursor, tables):
+    """
+    Counts a change of tables, inside the caller's transaction so that the new version becomes
+    visible together with the rows.
+    """
+    cursor.executemany(
+        f"INSERT INTO {VERSION_TABLE} (tableName, version) VALUES (%s, 1) "
+        f"ON DUPLICATE KEY UPDATE version = version + 1",
+        [(table,) for table in sorted(tables)]
+    )
+
+
+def table_versions(cursor, tables):
+    """
+    {table: version} of tables, 0 for a table that was never changed, and the epoch of the
+    version table under EPOCH_ROW.
+    """
+    tables = sorted(set(tables) | {EPOCH_ROW})
+    cursor.execute(
+        f"SELECT tableName, version FROM {VERSION_TABLE} WHERE tableName IN ({', '.join(['%s'] * len(tables))})",
+        tables
+    )
+    versions = dict.fromkeys(tables, 0)
+    versions.update((name.decode() if isinstance(name, bytes) else name, version) for name, version in cursor.fetchall())
+    return versions
+
+
+def normalize_sql(sql):
+    """
+    The statement with runs of whitespace collapsed and without a trailing semicolon, so that
+    differently indented copies of one query share a cache entry.
+    """
+    return " ".join(sql.split()).rstrip("; ")
+
+
+def referenced_tables(sql):
+    """
+    Names of the tables a query reads: everything after FROM or JOIN that is not one of its CTEs.
+    """
+    return {name for name in TABLE_REFERENCE.findall(sql)} - set(CTE_DEFINITION.findall(sql))
+
+
+class QueryCache:
+    """
+    Results of SELECT statements on disk, keyed by the server and database, normalized SQL and
+    parameters.
+
+    Every entry remembers the versions of the tables its query read (see bump_table_versions) and
+    is dropped when it is read after one of them changed. Entries are pickled and compressed, one
+    file per query, so several processes can share a directory. The directory is kept below
+    max_bytes by evicting the least recently used entries, by file modification time.
+    """
+
+    def __init__(self, directory="query_cache", max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = self.misses = self.stale = self.evictions = 0
+
+    @staticmethod
+    def key(sql, params=None, database=None):
+        """
+        database tells the databases apart that share the directory, e.g. (server uuid, name).
+        """
+        text = repr(database) + "\0" + normalize_sql(sql) + "\0" + repr(tuple(params or ()))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key, versions):
+        """
+        The cached entry of key if it was computed from the given table versions, else None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+        if entry["versions"] != versions:
+            self.stale += 1
+            self.misses += 1
+            self._remove(path)
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)  # marks the entry as recently used
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, sql, params, versions, description, rows):
+        entry = {"sql": normalize_sql(sql), "params": tuple(params or ()), "versions": versions,
+                 "description": description, "rows": rows}
+        data = zlib.compress(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > self.max_bytes:
+            return
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self._path(key))
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0, "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries)}
+
+
+class CachedCursor:
+    """
+    A cursor that answers SELECT statements on the CACHED_TABLES from a QueryCache and passes
+    everything else to the wrapped cursor. Without the table_version table nothing is cached,
+    since changes could not be detected.
+    """
+
+    def __init__(self, cursor, cache):
+        self.cursor = cursor
+        self.cache = cache
+        self.versioned = table_exists(cursor, VERSION_TABLE)
+        cursor.execute("SELECT @@server_uuid, DATABASE()")
+        self.database = tuple(cursor.fetchall()[0])
+        self._rows = None
+        self._description = None
+        self._position = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, sql, params=None):
+        self._rows = None
+        tables = referenced_tables(sql)
+        cacheable = (self.versioned and tables and tables <= set(CACHED_TABLES) and
+                     normalize_sql(sql).split(" ", 1)[0].upper() in ("SELECT", "WITH"))
+        if not cacheable:
+            return self.cursor.execute(sql, params)
+
+        versions = table_versions(self.cursor, tables)
+        key = self.cache.key(sql, params, self.database)
+        entry = self.cache.get(key, versions)
+        if entry is None:
+            self.cursor.execute(sql, params)
+            rows = self.cursor.fetchall()
+            entry = {"description": self.cursor.description, "rows": rows}
+            self.cache.put(key, sql, params, versions, entry["description"], rows)
+        self._rows, self._description, self._position = entry["rows"], entry["description"], 0
+
+    def fetchall(self):
+        if self._rows is None:
+            return self.cursor.fetchall()
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def fetchmany(self, size=1):
+        if self._rows is None:
+            return self.cursor.fetchmany(size)
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchone(self):
+        if self._rows is None:
+            return self.cursor.fetchone()
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    @property
+    def description(self):
+        return self._description if self._rows is not None else self.cursor.description
+
+    @property
+    def column_names(self):
+        if self._rows is None:
+            return self.cursor.column_names
+        return tuple(column[0] for column in self._description or ())
+
+    @property
+    def rowcount(self):
+        return len(self._rows) if self._rows is not None else self.cursor.rowcount
@@ -0,0 +1,262 @@
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+from tabulate import tabulate
+
+from querycache import normalize_sql
+from streamtable import fetch_batches
+
+
+PROFILE_SUFFIX = "Profile.json"
+# Tables for which a full table or index scan is flagged, since no task should need one
+FULL_SCAN_TABLES = ("path",)
+# Access types of EXPLAIN that read a whole table (ALL) or a whole index (index)
+FULL_SCAN_ACCESS = ("ALL", "index")
+# Session counters of the handler calls, temporary tables, sorts and join types of a statement
+STATUS_QUERY = ("SHOW SESSION STATUS WHERE Variable_name LIKE 'Handler%' OR Variable_name LIKE 'Created_tmp%' "
+                "OR Variable_name LIKE 'Sort%' OR Variable_name LIKE 'Select%'")
+# The latest statement of this session that finished, other than the SHOW statements of the profiler
+HISTORY_QUERY = """
+    SELECT TIMER_WAIT, LOCK_TIME, ROWS_EXAMINED, ROWS_SENT
+    FROM performance_schema.events_statements_history
+    WHERE THREAD_ID = PS_CURRENT_THREAD_ID() AND EVENT_NAME NOT LIKE 'statement/sql/show%'
+    ORDER BY EVENT_ID DESC
+    LIMIT 1
+"""
+PICOSECONDS = 1e12
+
+# table [AS] alias after FROM or JOIN, to map the aliases EXPLAIN reports back to tables
+TABLE_ALIAS = re.compile(
+    r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|LEFT|RIGHT|INNER|CROSS|STRAIGHT_JOIN|"
+    r"GROUP|ORDER|LIMIT|HAVING|WINDOW|UNION)\b)`?(\w+)`?)?",
+    re.IGNORECASE
+)
+
+
+def table_aliases(sql):
+    """
+    {name or alias: table} for the tables after FROM or JOIN in sql.
+    """
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def plan_tables(plan):
+    """
+    (table_name, access_type) of every table access in an EXPLAIN FORMAT=JSON plan, including
+    those of materialized CTEs and subqueries.
+    """
+    if isinstance(plan, dict):
+        table = plan.get("table")
+        if isinstance(table, dict) and "table_name" in table:
+            yield table["table_name"], table.get("access_type")
+        for value in plan.values():
+            yield from plan_tables(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_tables(value)
+
+
+def full_scans(sql, plan, tables=FULL_SCAN_TABLES):
+    """
+    Sorted names of the given tables that the plan reads with a full table or index scan.
+    """
+    aliases = table_aliases(sql)
+    return sorted({aliases.get(name, name) for name, access in plan_tables(plan)
+                   if access in FULL_SCAN_ACCESS and aliases.get(name, name) in tables})
+
+
+def session_status(cursor):
+    cursor.execute(STATUS_QUERY)
+    return {name: int(value) for name, value in cursor.fetchall() if str(value).lstrip("-").isdigit()}
+
+
+class QueryProfiler:
+    """
+    Collects a profile of every SELECT statement run through its ProfilingCursors: the wall time
+    until the last row was read, the server time, lock time and rows examined from
+    performance_schema (None where the server does not record them), the rows returned, the
+    change of the session's handler, temporary table, sort and join counters, the EXPLAIN
+    FORMAT=JSON plan and, with analyze, the EXPLAIN ANALYZE tree, which runs the statement a
+    second time. Full scans of FULL_SCAN_TABLES are flagged.
+
+    write saves the statements profiled since the last write as one JSON file.
+    """
+
+    def __init__(self, analyze=False):
+        self.analyze = analyze
+        self.statements = []
+        self.baseline = None
+        self.history = True  # False once performance_schema turned out not to be readable
+
+    def wrap(self, cursor):
+        return ProfilingCursor(cursor, self)
+
+    def calibrate(self, cursor):
+        """
+        The counters that a SHOW SESSION STATUS itself adds, subtracted from every delta.
+        """
+        if self.baseline is None:
+            first = session_status(cursor)
+            second = session_status(cursor)
+            self.baseline = {name: second[name] - value for name, value in first.items() if name in second}
+        return self.baseline
+
+    def write(self, path, name):
+        """
+        Writes the statements profiled since the last write to path and returns the tables they
+        scan fully.
+        """
+        statements, self.statements = self.statements, []
+        scans = sorted({table for statement in statements for table in statement["fullScans"]})
+        profile = {
+            "task": name,
+            "statements": statements,
+            "wallSeconds": round(sum(statement["wallSeconds"] for statement in statements), 4),
+            "serverSeconds": (round(sum(statement["serverSeconds"] for statement in statements), 4)
+                              if all(statement["serverSeconds"] is not None for statement in statements) else None),
+            "fullScans": scans,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=1, default=str)
+        return scans
+
+
+class ProfilingCursor:
+    """
+    A cursor that profiles the SELECT statements it runs for a QueryProfiler and passes the rest
+    on. A statement is profiled when the next one is executed or on finish, after reading any
+    rows that were left.
+    """
+
+    def __init__(self, cursor, profiler):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.pending = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, sql, params=None):
+        self.finish()
+        if normalize_sql(sql).split(" ", 1)[0].upper() not in ("SELECT", "WITH"):
+            return self.cursor.execute(sql, params)
+        baseline = self.profiler.calibrate(self.cursor)
+        before = session_status(self.cursor)
+        start = time.perf_counter()
+        result = self.cursor.execute(sql, params)
+        self.pending = {"sql": sql, "params": params, "before": before, "baseline": baseline,
+                        "start": start, "end": time.perf_counter(), "rows": 0}
+        return result
+
+    def _read(self, rows):
+        if self.pending is not None:
+            self.pending["rows"] += len(rows)
+            self.pending["end"] = time.perf_counter()
+        return rows
+
+    def fetchall(self):
+        return self._read(self.cursor.fetchall())
+
+    def fetchmany(self, size=1):
+        return self._read(self.cursor.fetchmany(size))
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self._read([row] if row is not None else [])
+        return row
+
+    def finish(self):
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return
+        cursor = self.cursor
+        unread = sum(len(rows) for rows in fetch_batches(cursor)) if cursor.with_rows else 0
+        after = session_status(cursor)
+        baseline = pending["baseline"]
+        status = {name: value - pending["before"].get(name, 0) - baseline.get(name, 0) for name, value in after.items()}
+
+        serverSeconds = lockSeconds = rowsExamined = None
+        if self.profiler.history:
+            try:
+                cursor.execute(HISTORY_QUERY)
+                for timerWait, lockTime, examined, _ in cursor.fetchall():
+                    serverSeconds = timerWait / PICOSECONDS
+                    lockSeconds = lockTime / PICOSECONDS
+                    rowsExamined = examined
+            except Exception as e:
+                self.profiler.history = False
+                print("Query profiles without server time, performance_schema is not readable:", e)
+
+        sql, params = pending["sql"], pending["params"]
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+        plan = json.loads(cursor.fetchall()[0][0])
+        analyze = None
+        if self.profiler.analyze:
+            cursor.execute("EXPLAIN ANALYZE " + sql, params)
+            analyze = cursor.fetchall()[0][0]
+
+        scans = full_scans(sql, plan)
+        for table in scans:
+            print(f"Warning: full scan of {table} in: {normalize_sql(sql)[:120]}")
+        self.profiler.statements.append({
+            "sql": normalize_sql(sql),
+            "params": list(params or ()),
+            "wallSeconds": round(pending["end"] - pending["start"], 4),
+            "serverSeconds": serverSeconds,
+            "lockSeconds": lockSeconds,
+            "rowsExamined": rowsExamined,
+            "rowsReturned": pending["rows"],
+            "rowsUnread": unread,
+            "status": {name: delta for name, delta in sorted(status.items()) if delta},
+            "fullScans": scans,
+            "plan": plan,
+            "explainAnalyze": analyze,
+        })
+
+    def close(self):
+        self.finish()
+        return self.cursor.close()
+
+
+def read_profiles(directory):
+    profiles = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*" + PROFILE_SUFFIX))):
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        profiles[profile["task"]] = profile
+    return profiles
+
+
+def compare_profiles(before_dir, after_dir):
+    """
+    Table of the tasks profiled in two results folders, with their server time and full scans,
+    so that a plan that starts scanning path stands out.
+    """
+    before, after = read_profiles(before_dir), read_profiles(after_dir)
+    rows = []
+    for task in list(before) + [task for task in after if task not in before]:
+        a, b = before.get(task, {}), after.get(task, {})
+        seconds = [profile.get("serverSeconds", profile.get("wallSeconds")) for profile in (a, b)]
+        scansA, scansB = a.get("fullScans", []), b.get("fullScans", [])
+        rows.append((task, "-" if seconds[0] is None else f"{seconds[0]:.2f}",
+                     "-" if seconds[1] is None else f"{seconds[1]:.2f}",
+                     ", ".join(scansA) or "-", ", ".join(scansB) or "-",
+                     "NEW FULL SCAN" if set(scansB) - set(scansA) else ""))
+    return tabulate(rows, headers=["Task", "Before (s)", "After (s)", "Full scans before", "Full scans after", ""],
+                    tablefmt="pretty")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python queryprofile.py BEFORE_RESULTS_DIR AFTER_RESULTS_DIR")
+        sys.exit(1)
+    print(compare_profiles(sys.argv[1], sys.argv[2]))
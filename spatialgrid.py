@@ -0,0 +1,51 @@
+import math
+
+from polyline import COORDINATE_SCALE
+from tripsummary import EARTH_RADIUS_METERS
+
+
+# The grid splits the globe into cells of 1/CELLS_PER_DEGREE degrees, about 111 m x 84 m in Porto.
+# A cell is numbered latitude cell * ROW_STRIDE + longitude cell, both counted from -90/-180 degrees.
+CELLS_PER_DEGREE = 1000
+ROW_STRIDE = 1_000_000
+GRID_COLUMN = "gridCell"
+# Degrees added around the searched box, so that a point on a cell edge that MySQL's DOUBLE
+# arithmetic puts into the neighbouring cell is still covered
+EDGE_MARGIN = 1e-7
+
+
+def grid_cell_sql(coordinates="double"):
+    """
+    SQL expression of the grid cell of a point row, for the generated gridCell column. With fixed
+    coordinates the cell is computed in exact integer arithmetic.
+    """
+    if coordinates == "fixed":
+        size = COORDINATE_SCALE // CELLS_PER_DEGREE
+        return (f"((latitude + {90 * COORDINATE_SCALE}) DIV {size}) * {ROW_STRIDE} + "
+                f"((longitude + {180 * COORDINATE_SCALE}) DIV {size})")
+    return (f"FLOOR((latitude + 90) * {CELLS_PER_DEGREE}) * {ROW_STRIDE} + "
+            f"FLOOR((longitude + 180) * {CELLS_PER_DEGREE})")
+
+
+def bounding_box(lat, lon, radius_m):
+    """
+    (minLat, maxLat, minLon, maxLon) in degrees of every point within radius_m meters of lat, lon.
+    """
+    angle = radius_m / EARTH_RADIUS_METERS
+    dLat = math.degrees(angle)
+    # The circle is widest in longitude where its meridians touch it, at asin(sin(angle) / cos(lat))
+    ratio = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+    dLon = math.degrees(math.asin(ratio)) if ratio < 1 and abs(lat) + dLat < 90 else 180
+    return lat - dLat, lat + dLat, lon - dLon, lon + dLon
+
+
+def covering_ranges(lat, lon, radius_m):
+    """
+    The grid cells that cover the circle of radius_m meters around lat, lon, as one (first, last)
+    range of cell numbers per latitude row, so a query needs one index range scan per row.
+    """
+    minLat, maxLat, minLon, maxLon = bounding_box(lat, lon, radius_m)
+    cell = lambda degrees, origin: math.floor((degrees + origin) * CELLS_PER_DEGREE)
+    first, last = cell(minLon - EDGE_MARGIN, 180), cell(maxLon + EDGE_MARGIN, 180)
+    rows = range(cell(minLat - EDGE_MARGIN, 90), cell(maxLat + EDGE_MARGIN, 90) + 1)
+    return [(row * ROW_STRIDE + first, row * ROW_STRIDE + last) for row in rows]
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+
+# Rows per fetchmany: enough to keep the round trips cheap, few enough to keep memory flat
+FETCH_ROWS = 10000
+PART_SUFFIX = ".part"
+
+
+def fetch_batches(cursor, size=FETCH_ROWS):
+    """
+    The rows of the statement executed on cursor, size at a time. On an unbuffered cursor
+    (connection.cursor(buffered=False)) each batch is read off the socket only when it is asked
+    for. Read all batches before the connection runs another statement.
+    """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def format_cell(value):
+    """
+    A cell as tabulate(..., tablefmt="pretty") prints it in a column of text: that format does not
+    parse numbers, so every value, floats included, is printed with str() and None is left empty.
+    """
+    if value is None or (isinstance(value, (bytes, str)) and not value):
+        return ""
+    return f"{value}"
+
+
+def format_bytes_cell(value):
+    """
+    A cell as tabulate prints it in a column of bytes, which it decodes as ASCII where it can.
+    """
+    if isinstance(value, bytes) and value:
+        try:
+            return str(value, "ascii")
+        except UnicodeDecodeError:
+            return str(value)
+    return format_cell(value)
+
+
+class PrettyTableWriter:
+    """
+    Writes a table in the layout of tabulate(..., tablefmt="pretty") to path without holding its
+    rows. The columns are as wide as their widest cell, which is only known after the last row, so
+    write appends the formatted rows to path + ".part" as they arrive and close frames them into
+    path in a second pass over that file.
+
+    tabulate prints the bytes of a column as text when the column holds nothing but bytes, bools
+    and empty cells and with str() otherwise, so bytes cells are spooled in both forms until the
+    kind of their column is known.
+
+    Example:
+    with PrettyTableWriter("results/task9Output.txt", ["Trip ID"]) as table:
+        for rows in fetch_batches(cursor):
+            table.write(rows)
+    """
+
+    def __init__(self, path, headers):
+        self.path = path
+        self.headers = [f"{header}" for header in headers]
+        self.widths = [len(header) for header in self.headers]
+        self.bytesWidths = list(self.widths)
+        # Per column: holds bytes, holds other values that make it a column of text
+        self.hasBytes = [False] * len(self.headers)
+        self.hasText = [False] * len(self.headers)
+        self.rows = 0
+        self.part = path + PART_SUFFIX
+        self.spool = open(self.part, "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, *exc):
+        if kind is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, rows):
+        for row in rows:
+            cells = []
+            for column, value in enumerate(row):
+                cell = format_cell(value)
+                if isinstance(value, bytes) and value:
+                    self.hasBytes[column] = True
+                    decoded = format_bytes_cell(value)
+                    self.bytesWidths[column] = max(self.bytesWidths[column], len(decoded))
+                    cell = [cell, decoded]
+                else:
+                    if cell and not isinstance(value, bool):
+                        self.hasText[column] = True
+                    self.bytesWidths[column] = max(self.bytesWidths[column], len(cell))
+                self.widths[column] = max(self.widths[column], len(cell[0] if isinstance(cell, list) else cell))
+                cells.append(cell)
+            self.spool.write(json.dumps(cells, ensure_ascii=False))
+            self.spool.write("\n")
+        self.rows += len(rows)
+
+    def _line(self, cells, widths):
+        return "| " + " | ".join(f"{cell:^{width}}" for cell, width in zip(cells, widths)) + " |"
+
+    def close(self):
+        self.spool.close()
+        asBytes = [hasBytes and not hasText for hasBytes, hasText in zip(self.hasBytes, self.hasText)]
+        widths = [bytesWidth if bytesColumn else width
+                  for width, bytesWidth, bytesColumn in zip(self.widths, self.bytesWidths, asBytes)]
+        border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+        with open(self.part, encoding="utf-8") as spool, open(self.path, "w", encoding="utf-8") as f:
+            f.write(f"{border}\n{self._line(self.headers, widths)}\n{border}\n")
+            for line in spool:
+                cells = [cell[bytesColumn] if isinstance(cell, list) else cell
+                         for cell, bytesColumn in zip(json.loads(line), asBytes)]
+                f.write(self._line(cells, widths))
+                f.write("\n")
+            f.write(border)
+        os.remove(self.part)
+
+    def discard(self):
+        self.spool.close()
+        try:
+            os.remove(self.part)
+        except OSError:
+            pass
+
+
+def stream_table(cursor, path, headers, size=FETCH_ROWS, start=None):
+    """
+    Writes the result of the statement executed on cursor to path as a pretty table, size rows
+    at a time. Returns (rows, seconds to the first row, seconds in total), counted from start, a
+    time.perf_counter() taken before the statement was executed, or else from the call.
+    """
+    start = time.perf_counter() if start is None else start
+    firstRow = None
+    with PrettyTableWriter(path, headers) as table:
+        for rows in fetch_batches(cursor, size):
+            if firstRow is None:
+                firstRow = time.perf_counter() - start
+            table.write(rows)
+    return table.rows, firstRow, time.perf_counter() - start
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from tabulate import tabulate
+
+from DbConnector import ConnectionPool
+from numpyqueries import NumpyQueries
+from Queries import Queries
+from querycache import QueryCache
+from queryprofile import QueryProfiler
+
+
+# after: tasks that must have finished first. isolated: run in a process of its own, outside the
+# concurrency limit, so that its memory is returned when it ends and cannot starve the other tasks.
+Task = namedtuple("Task", ["after", "isolated"])
+
+TASKS = {
+    "task1": Task((), False),
+    "task2": Task((), False),
+    "task3": Task((), False),
+    "task4a": Task((), False),
+    "task4b": Task((), False),
+    "task5": Task((), False),
+    "task6": Task((), False),
+    "task7": Task((), False),
+    "task8": Task((), True),
+    "task9": Task((), False),
+    "task10": Task((), False),
+    "task11": Task((), False),
+}
+
+TIMINGS_FILE = "taskTimings.json"
+
+
+def open_queries(options, pool=None):
+    profiler = QueryProfiler(analyze=options["analyze"]) if options["profile"] else None
+    cache = QueryCache(options["cache_dir"]) if options["cache"] and profiler is None else None
+    return Queries(output_dir=options["output_dir"], layout=options["layout"], cache=cache, pool=pool,
+                   profiler=profiler)
+
+
+def run_numpy(task, options):
+    """
+    Runs one task with NumpyQueries on the trajectory store, without a connection.
+    """
+    queries = NumpyQueries(options["store"], options["output_dir"])
+    start = time.perf_counter()
+    getattr(queries, task)()
+    return time.perf_counter() - start
+
+
+def run_isolated(task, options):
+    """
+    Runs one task on its own connection, in the worker process of an isolated task.
+    """
+    if task in options["numpy"]:
+        return run_numpy(task, options)
+    queries = open_queries(options)
+    try:
+        start = time.perf_counter()
+        getattr(queries, task)()
+        return time.perf_counter() - start
+    finally:
+        queries.connection.close_connection()
+
+
+class TaskRunner:
+    """
+    Runs a selection of Queries tasks concurrently, at most concurrency at a time, each on a
+    connection of its own out of a ConnectionPool of concurrency connections. A task starts once
+    the tasks it comes after have finished; among the ready ones, the task that took longest last
+    time goes first, so the slowest task does not start last. Isolated tasks run in processes of
+    their own. The tasks in numpy run with NumpyQueries on the TrajectoryStore in store instead of
+    on MySQL, and write the same results files. With cache, the MySQL tasks read through a
+    QueryCache in cache_dir.
+    """
+
+    def __init__(self, tasks, concurrency=4, output_dir="results", layout=None, cache=False,
+                 cache_dir="query_cache", profile=False, analyze=False, numpy=(), store="trajectories"):
+        unknown = [task for task in list(tasks) + list(numpy) if task not in TASKS]
+        if unknown:
+            raise ValueError(f"Unknown tasks {', '.join(unknown)}, expected some of {', '.join(TASKS)}")
+        self.tasks = list(dict.fromkeys(tasks))
+        self.concurrency = max(concurrency, 1)
+        self.options = {"output_dir": output_dir, "layout": layout, "cache": cache, "cache_dir": cache_dir,
+                        "profile": profile or analyze, "analyze": analyze, "numpy": set(numpy), "store": store}
+        self.pool = ConnectionPool(size=self.concurrency)
+        self.timings_path = os.path.join(output_dir, TIMINGS_FILE)
+
+    def previous_timings(self):
+        try:
+            with open(self.timings_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def run_in_thread(self, task):
+        if task in self.options["numpy"]:
+            return run_numpy(task, self.options)
+        queries = open_queries(self.options, self.pool)
+        try:
+            start = time.perf_counter()
+            getattr(queries, task)()
+            return time.perf_counter() - start
+        finally:
+            queries.connection.close_connection()
+
+    def run(self):
+        """
+        Runs the tasks and returns {task: (status, seconds)}.
+        """
+        previous = self.previous_timings()
+        # Dependencies outside the selection count as done
+        waiting = {task: {dep for dep in TASKS[task].after if dep in self.tasks} for task in self.tasks}
+        results = {}
+        running = {}
+        began = time.perf_counter()
+        threads = ThreadPoolExecutor(max_workers=self.concurrency)
+        processes = ProcessPoolExecutor(max_workers=sum(TASKS[task].isolated for task in self.tasks) or 1)
+        try:
+            while waiting or running:
+                ready = sorted((task for task, deps in waiting.items() if not deps),
+                               key=lambda task: -previous.get(task, 0))
+                threaded = sum(not TASKS[task].isolated for task in running.values())
+                for task in ready:
+                    if TASKS[task].isolated:
+                        future = processes.submit(run_isolated, task, self.options)
+                    elif threaded < self.concurrency:
+                        future = threads.submit(self.run_in_thread, task)
+                        threaded += 1
+                    else:
+                        continue
+                    del waiting[task]
+                    running[future] = task
+                if not running:
+                    # Only tasks that wait for failed tasks are left
+                    for task in waiting:
+                        results[task] = ("skipped", 0.0)
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        results[task] = ("ok", future.result())
+                        for deps in waiting.values():
+                            deps.discard(task)
+                    except Exception as e:
+                        results[task] = (f"failed: {e}", 0.0)
+                    status, seconds = results[task]
+                    print(f"[{time.perf_counter() - began:7.1f}s] {task} {status} in {seconds:.1f}s")
+        finally:
+            threads.shutdown()
+            processes.shutdown()
+            self.pool.close()
+
+        self.save_timings(previous, results)
+        return results
+
+    def save_timings(self, previous, results):
+        timings = dict(previous)
+        timings.update((task, seconds) for task, (status, seconds) in results.items() if status == "ok")
+        os.makedirs(os.path.dirname(self.timings_path) or ".", exist_ok=True)
+        with open(self.timings_path, "w", encoding="utf-8") as f:
+            json.dump(timings, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Queries tasks concurrently, each on its own connection")
+    parser.add_argument("tasks", nargs="*", default=["all"], help="Tasks to run, e.g. task1 task5, or all")
+    parser.add_argument("--concurrency", type=int, default=4, help="Tasks that run at the same time, not counting task8")
+    parser.add_argument("--output-dir", default="results")
+    parser.add_argument("--layout", choices=["path", "trajectory", "summary"])
+    parser.add_argument("--cache", action="store_true",
+                        help="Answer repeated queries from the query cache; only safe while createtables.py is the "
+                             "only writer")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write the plan, timings and session counters of every query to results/taskNProfile.json, "
+                             "ignoring --cache")
+    parser.add_argument("--explain-analyze", action="store_true",
+                        help="Like --profile, and also run every query again under EXPLAIN ANALYZE")
+    parser.add_argument("--numpy", nargs="+", default=[], metavar="TASK",
+                        help="Tasks to compute in process with NumpyQueries from the trajectory store instead of "
+                             "on MySQL, or all")
+    parser.add_argument("--store", default="trajectories", help="Trajectory store directory for --numpy")
+    args = parser.parse_args()
+
+    tasks = list(TASKS) if args.tasks == ["all"] else args.tasks
+    numpy = tasks if args.numpy == ["all"] else args.numpy
+    runner = TaskRunner(tasks, args.concurrency, args.output_dir, args.layout, args.cache,
+                        profile=args.profile, analyze=args.explain_analyze, numpy=numpy, store=args.store)
+    start = time.perf_counter()
+    results = runner.run()
+    wall = time.perf_counter() - start
+
+    rows = [(task, status, f"{seconds:.1f}") for task, (status, seconds) in results.items()]
+    print(tabulate(rows, headers=["Task", "Status", "Seconds"], tablefmt="pretty"))
+    print(f"Wall time {wall:.1f}s for {sum(seconds for _, seconds in results.values()):.1f}s of tasks")
+    if any(status != "ok" for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
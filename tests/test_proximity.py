@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.check_proximity import batches, synthetic_trips
+from polyline import point_counts, point_indexes
+from proximity import (PROXIMITY_METERS, PROXIMITY_SECONDS, brute_force_pairs, close_taxi_pairs, parallel_taxi_pairs,
+                       store_extent, store_trips, time_partitions)
+from trajectorystore import TrajectoryStore, _write_store
+from tripsummary import SECONDS_PER_POINT
+
+
+def expected_pairs(trips):
+    taxiIds, startSeconds, lat, lon, offsets = trips
+    counts = point_counts(offsets)
+    seconds = np.repeat(startSeconds, counts) + point_indexes(offsets) * SECONDS_PER_POINT
+    return brute_force_pairs(seconds, np.repeat(taxiIds, counts), lat, lon)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("size", [1, 37, 400])
+def test_join_matches_brute_force(seed, size):
+    # Different batch sizes move the batch edges through the windows of the join
+    trips = synthetic_trips(400, 60, 1, seed=seed)
+    expected = expected_pairs(trips)
+    assert expected
+    assert close_taxi_pairs(batches(trips, size), PROXIMITY_METERS, PROXIMITY_SECONDS) == expected
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    # Two crowded hours, the second across the end of the first day partition, so that pairs
+    # are found on both sides of a partition boundary
+    first = synthetic_trips(300, 1000, 1, mean_points=30, seed=2)
+    second = synthetic_trips(300, 1000, 1, mean_points=30, seed=3)
+    taxiIds = np.concatenate([first[0], second[0]])
+    startSeconds = np.concatenate([first[1], second[1] + 86400 - 1800])
+    lat, lon = np.concatenate([first[2], second[2]]), np.concatenate([first[3], second[3]])
+    offsets = np.concatenate([first[4], second[4][1:] + first[4][-1]])
+    trips = pd.DataFrame({
+        'tripId': np.arange(1, len(taxiIds) + 1), 'originalTripId': np.arange(1, len(taxiIds) + 1),
+        'taxiId': taxiIds, 'startTime': startSeconds, 'callType': "C", 'originCall': -1, 'originStand': -1,
+    })
+    directory = str(tmp_path_factory.mktemp("proximity") / "trajectories")
+    _write_store(directory, trips, lat, lon, offsets)
+    return directory, (taxiIds, startSeconds, lat, lon, offsets)
+
+
+def test_store_trips_match_arrays(store):
+    directory, trips = store
+    expected = close_taxi_pairs(batches(trips, 50))
+    assert close_taxi_pairs(store_trips(TrajectoryStore(directory), batch=37)) == expected
+
+
+def test_partitions_union_is_single_run(store):
+    directory, _ = store
+    start, end, lookback = store_extent(directory)
+    assert len(time_partitions(start, end + lookback, days=1)) > 1
+    single = close_taxi_pairs(store_trips(TrajectoryStore(directory)))
+    # Some pairs are only found through the trips that started before their partition
+    assert parallel_taxi_pairs(directory, start, end, 0, workers=2, days=1) != single
+    assert parallel_taxi_pairs(directory, start, end, lookback, workers=2, days=1) == single
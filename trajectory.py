@@ -0,0 +1,60 @@
+import numpy as np
+
+from polyline import from_fixed, to_fixed
+
+
+# Every point is stored as two little-endian int32 micro-degrees: latitude, then longitude
+POINT_DTYPE = np.dtype("<i4")
+BYTES_PER_POINT = 2 * POINT_DTYPE.itemsize
+
+
+def encode_trajectories(lat, lon, offsets):
+    """
+    Packs the polylines of a chunk (see polyline.decode_polylines) into one blob per trip.
+    """
+    packed = np.empty(2 * len(lat), dtype=POINT_DTYPE)
+    packed[0::2] = to_fixed(lat)
+    packed[1::2] = to_fixed(lon)
+    raw = packed.tobytes()
+    bounds = offsets * BYTES_PER_POINT
+    return [raw[start:end] for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+
+def decode_trajectory(blob):
+    """
+    (lat, lon) of a single blob as int32 micro-degree views on the blob's own memory.
+    """
+    packed = np.frombuffer(blob, dtype=POINT_DTYPE)
+    return packed[0::2], packed[1::2]
+
+
+def decode_trajectories(blobs):
+    """
+    Decodes a fetched batch of blobs into (lat, lon, offsets) like polyline.decode_polylines,
+    but with int32 micro-degrees. The blobs are joined into one buffer and lat/lon are strided
+    views on it, so no per-point work is done in Python. The join is the one copy of the batch;
+    benchmarks/bench_layouts.py times it against per-blob decode_trajectory views.
+    """
+    counts = np.fromiter((len(blob) // BYTES_PER_POINT for blob in blobs), dtype=np.int64, count=len(blobs))
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    packed = np.frombuffer(b"".join(blobs), dtype=POINT_DTYPE)
+    return packed[0::2], packed[1::2], offsets
+
+
+def fetch_trajectories(cursor, where="", params=(), batch=10000):
+    """
+    Yields (tripIds, lat, lon, offsets) batches from trip_trajectory, coordinates in degrees.
+    where is an optional SQL condition on trip_trajectory, e.g. "tripId BETWEEN %s AND %s".
+    """
+    cursor.execute(
+        f"SELECT tripId, points FROM trip_trajectory {'WHERE ' + where if where else ''} ORDER BY tripId",
+        params
+    )
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            break
+        tripIds = np.array([row[0] for row in rows], dtype=np.int64)
+        lat, lon, offsets = decode_trajectories([row[1] for row in rows])
+        yield tripIds, from_fixed(lat), from_fixed(lon), offsets
@@ -0,0 +1,292 @@
+import json
+import os
+import shutil
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from polyline import from_fixed, point_counts, point_indexes
+from portodata import build_cache, cache_is_fresh, cache_path, read_cache
+from streamtable import fetch_batches
+from utils import detect_coordinates
+
+
+STORE_VERSION = 1
+SECONDS_PER_POINT = 15
+
+# Per-trip metadata columns and their dtypes. Missing originCall/originStand are stored as -1.
+TRIP_COLUMNS = {
+    'tripId': np.int64,
+    'originalTripId': np.int64,
+    'taxiId': np.int64,
+    'startTime': np.int64,  # unix seconds
+    'callType': 'S1',
+    'originCall': np.int32,
+    'originStand': np.int32,
+}
+
+# Points of one trip, one taxi or one time range, as views on the store's files
+Points = namedtuple("Points", ["lat", "lon", "seconds", "trip"])
+
+
+class TrajectoryStore:
+    """
+    Read-only, memory-mapped trajectories in CSR layout.
+
+    The points of all trips are stored back to back in lat, lon, seconds (time since the start of
+    the trip) and tripIndex (store index of the trip the point belongs to); the points of trip i are the rows
+    offsets[i]:offsets[i+1]. Trips are ordered by taxi and then by start time, so the points of a
+    taxi, also within a time range, are one contiguous slice and come back as views on the files.
+    Only the pages that are touched are read, so the store works with less RAM than the data.
+    """
+
+    def __init__(self, directory="trajectories"):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"{directory} holds a trajectory store of version {self.manifest.get('version')}, "
+                             f"expected {STORE_VERSION}; rebuild it")
+        self.directory = directory
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.lat, self.lon, self.seconds, self.tripIndex = (load(name) for name in ("lat", "lon", "seconds", "trip"))
+        self.offsets = load("offsets")
+        self.columns = {column: load(column) for column in TRIP_COLUMNS}
+        # Small enough to keep in memory: a few bytes per trip and per taxi
+        self.taxiIds, self.taxiStarts = np.unique(np.asarray(self.columns['taxiId']), return_index=True)
+        self.taxiStarts = np.append(self.taxiStarts, len(self))
+        self.startTimes = np.asarray(self.columns['startTime'])
+        self._byTripId = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def points(self):
+        return int(self.offsets[-1])
+
+    def metadata(self):
+        """
+        The per-trip metadata as a DataFrame, in store order.
+        """
+        frame = {column: np.asarray(values) for column, values in self.columns.items()}
+        frame['callType'] = frame['callType'].astype(str)
+        frame['startTime'] = pd.to_datetime(frame['startTime'], unit='s')
+        frame['pointCount'] = point_counts(np.asarray(self.offsets))
+        return pd.DataFrame(frame)
+
+    def _slice(self, first, last):
+        """
+        Points of the trips first..last-1 (store order).
+        """
+        start, end = int(self.offsets[first]), int(self.offsets[last])
+        return Points(self.lat[start:end], self.lon[start:end], self.seconds[start:end], self.tripIndex[start:end])
+
+    def index_of(self, tripId):
+        """
+        Store index of a tripId.
+        """
+        if self._byTripId is None:
+            self._byTripId = np.argsort(np.asarray(self.columns['tripId']), kind="stable")
+        tripIds = self.columns['tripId']
+        position = np.searchsorted(tripIds, tripId, sorter=self._byTripId)
+        if position == len(self) or tripIds[self._byTripId[position]] != tripId:
+            raise KeyError(f"tripId {tripId} is not in the store")
+        return int(self._byTripId[position])
+
+    def trip(self, tripId):
+        index = self.index_of(tripId)
+        return self._slice(index, index + 1)
+
+    def taxi_range(self, taxiId, start=None, end=None):
+        """
+        (first, last) store indexes of the trips of a taxi, optionally only those starting in [start, end).
+        start and end are datetimes or unix seconds.
+        """
+        position = np.searchsorted(self.taxiIds, taxiId)
+        if position == len(self.taxiIds) or self.taxiIds[position] != taxiId:
+            return 0, 0
+        first, last = int(self.taxiStarts[position]), int(self.taxiStarts[position + 1])
+        times = self.startTimes[first:last]
+        if start is not None:
+            first += int(np.searchsorted(times, _seconds(start), side="left"))
+        if end is not None:
+            last = self.taxiStarts[position] + int(np.searchsorted(times, _seconds(end), side="left"))
+        return first, max(first, int(last))
+
+    def taxi(self, taxiId, start=None, end=None):
+        """
+        Points of all trips of a taxi, optionally only the trips starting in [start, end), as views.
+        """
+        return self._slice(*self.taxi_range(taxiId, start, end))
+
+    def between(self, start, end):
+        """
+        Points of the trips starting in [start, end) as {taxiId: Points}, one view per taxi.
+        """
+        result = {}
+        for taxiId in self.taxiIds.tolist():
+            first, last = self.taxi_range(taxiId, start, end)
+            if last > first:
+                result[taxiId] = self._slice(first, last)
+        return result
+
+
+def _seconds(moment):
+    """
+    Unix seconds of a datetime, pd.Timestamp or date string, read in local time unless it has a
+    time zone, like the startTime column of the database, or of unix seconds.
+    """
+    if isinstance(moment, (str, pd.Timestamp)):
+        moment = pd.Timestamp(moment).to_pydatetime()
+    if isinstance(moment, datetime):
+        return int(moment.timestamp())
+    return int(moment)
+
+
+def _write_store(directory, trips, lat, lon, offsets, batch=50000):
+    """
+    Writes the store from trips (a DataFrame with TRIP_COLUMNS in source order) and their points
+    in CSR layout, reordering both by taxi and start time. The points are copied batch trips at a time.
+    """
+    start = time.perf_counter()
+    building = directory.rstrip("/\\") + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    order = np.lexsort((trips['startTime'].to_numpy(), trips['taxiId'].to_numpy()))
+    for column, dtype in TRIP_COLUMNS.items():
+        np.save(os.path.join(building, f"{column}.npy"), trips[column].to_numpy().astype(dtype)[order])
+
+    counts = point_counts(np.asarray(offsets))[order]
+    newOffsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(counts, out=newOffsets[1:])
+    np.save(os.path.join(building, "offsets.npy"), newOffsets)
+
+    total = int(newOffsets[-1])
+    create = lambda name, dtype: np.lib.format.open_memmap(os.path.join(building, f"{name}.npy"), mode="w+",
+                                                           dtype=dtype, shape=(total,))
+    outLat, outLon = create("lat", np.float64), create("lon", np.float64)
+    outSeconds, outTrip = create("seconds", np.int32), create("trip", np.int32)
+    sourceStarts = np.asarray(offsets)[:-1][order]
+    for first in range(0, len(order), batch):
+        last = min(first + batch, len(order))
+        local = newOffsets[first:last + 1] - newOffsets[first]
+        index = np.repeat(sourceStarts[first:last] - local[:-1], counts[first:last]) + np.arange(local[-1])
+        rows = slice(int(newOffsets[first]), int(newOffsets[last]))
+        outLat[rows] = lat[index]
+        outLon[rows] = lon[index]
+        outSeconds[rows] = point_indexes(local) * SECONDS_PER_POINT
+        outTrip[rows] = np.repeat(np.arange(first, last, dtype=np.int32), counts[first:last])
+    for array in (outLat, outLon, outSeconds, outTrip):
+        array.flush()
+    del outLat, outLon, outSeconds, outTrip
+
+    with open(os.path.join(building, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "trips": len(order), "points": total,
+                   "built": datetime.now().isoformat(timespec="seconds")}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(building, directory)
+    print(f"Trajectory store with {len(order):,} trips and {total:,} points written to {directory} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return TrajectoryStore(directory)
+
+
+def build_from_csv(filepath='porto.csv', directory="trajectories"):
+    """
+    Builds the store from porto.csv, through its columnar cache (see portodata), which is built first
+    if needed. tripId is row + 1, the tripId insert_data gives the same trip.
+    """
+    if not cache_is_fresh(filepath):
+        build_cache(filepath)
+    df = read_cache(filepath)
+    cache = cache_path(filepath)
+    load = lambda name: np.load(os.path.join(cache, f"{name}.npy"), mmap_mode="r")
+    trips = pd.DataFrame({
+        'tripId': np.arange(1, len(df) + 1),
+        'originalTripId': df['TRIP_ID'].to_numpy(),
+        'taxiId': df['TAXI_ID'].to_numpy(),
+        'startTime': df['TIMESTAMP'].to_numpy(),
+        'callType': df['CALL_TYPE'].to_numpy().astype('S1'),
+        'originCall': df['ORIGIN_CALL'].fillna(-1).to_numpy(),
+        'originStand': df['ORIGIN_STAND'].fillna(-1).to_numpy(),
+    })
+    return _write_store(directory, trips, load("lat"), load("lon"), load("offsets"))
+
+
+def build_from_database(cursor, directory="trajectories", batch=1_000_000):
+    """
+    Builds the store from the trip, origin_call, origin_stand, path and point tables. The trips
+    are read batch rows at a time into compact columns, and the points are streamed in tripId order
+    into temporary files next to the store before they are reordered.
+    """
+    cursor.execute("""
+        SELECT t.tripId, t.originalTripId, t.taxiId, t.startTime,
+               CASE WHEN oc.tripId IS NOT NULL THEN 'A' WHEN os.tripId IS NOT NULL THEN 'B' ELSE 'C' END,
+               COALESCE(oc.callerId, -1), COALESCE(os.standId, -1)
+        FROM trip t
+        LEFT JOIN origin_call oc ON oc.tripId = t.tripId
+        LEFT JOIN origin_stand os ON os.tripId = t.tripId
+        ORDER BY t.tripId
+    """)
+    frames = []
+    for rows in fetch_batches(cursor, batch):
+        frame = pd.DataFrame(rows, columns=list(TRIP_COLUMNS))
+        # startTime was written from the local time of the unix timestamp, see parse_chunk
+        frame['startTime'] = [int(moment.timestamp()) for moment in frame['startTime']]
+        frame['callType'] = frame['callType'].astype(str).str.encode("ascii")
+        frames.append(frame.astype(TRIP_COLUMNS))
+    trips = (pd.concat(frames, ignore_index=True) if frames else
+             pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in TRIP_COLUMNS.items()}))
+    fixed = detect_coordinates(cursor) == "fixed"
+
+    staging = directory.rstrip("/\\") + ".staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    tripIds = trips['tripId'].to_numpy()
+    counts = np.zeros(len(tripIds), dtype=np.int64)
+    try:
+        with open(os.path.join(staging, "lat.raw"), "wb") as latFile, open(os.path.join(staging, "lon.raw"), "wb") as lonFile:
+            cursor.execute("""
+                SELECT p.tripId, pt.latitude, pt.longitude
+                FROM path p
+                JOIN point pt ON pt.pointId = p.pointId
+                ORDER BY p.tripId, p.idx
+            """)
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                values = np.array(rows, dtype=np.float64)
+                lat, lon = values[:, 1], values[:, 2]
+                if fixed:
+                    lat, lon = from_fixed(lat), from_fixed(lon)
+                latFile.write(lat.tobytes())
+                lonFile.write(lon.tobytes())
+                counts += np.bincount(np.searchsorted(tripIds, values[:, 0].astype(np.int64)), minlength=len(tripIds))
+        offsets = np.zeros(len(tripIds) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        load = lambda name: (np.memmap(os.path.join(staging, f"{name}.raw"), dtype=np.float64, mode="r")
+                             if offsets[-1] else np.empty(0))
+        return _write_store(directory, trips, load("lat"), load("lon"), offsets)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("csv", "db"):
+        print("Usage: python trajectorystore.py csv [porto.csv] [directory]\n"
+              "       python trajectorystore.py db [directory]")
+        sys.exit(1)
+    if sys.argv[1] == "csv":
+        build_from_csv(*sys.argv[2:4])
+    else:
+        from DbConnector import DbConnector
+        connection = DbConnector()
+        try:
+            build_from_database(connection.cursor, *sys.argv[2:3])
+        finally:
+            connection.close_connection()
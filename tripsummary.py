@@ -0,0 +1,108 @@
+import sys
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from polyline import point_counts
+
+
+EARTH_RADIUS_METERS = 6371000
+SECONDS_PER_POINT = 15  # Porto samples one GPS point every 15 seconds
+# Comment of a trip_summary table that has the row of every trip with points
+COMPLETE_COMMENT = "complete"
+
+SUMMARY_COLUMNS = ('tripId', 'pointCount', 'startLat', 'startLon', 'endLat', 'endLon', 'durationSeconds', 'endTime',
+                   'distanceMeters', 'pathMeters', 'minLat', 'maxLat', 'minLon', 'maxLon')
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in meters, the same formula the queries evaluate in SQL.
+    """
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(
+        np.sin(np.radians((lat2 - lat1) / 2)) ** 2 +
+        np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) *
+        np.sin(np.radians((lon2 - lon1) / 2)) ** 2
+    ))
+
+
+def summarize_trips(tripIds, startTimes, lat, lon, offsets):
+    """
+    trip_summary rows for decoded polylines (see polyline.decode_polylines), as a DataFrame with
+    SUMMARY_COLUMNS. Trips without points get no row. Coordinates are in degrees.
+
+    distanceMeters is the straight line from the first to the last point, pathMeters the sum over
+    consecutive points.
+    """
+    counts = point_counts(offsets)
+    hasPoints = counts > 0
+    if not hasPoints.any():
+        return pd.DataFrame({column: [] for column in SUMMARY_COLUMNS})
+
+    first = offsets[:-1][hasPoints]
+    last = offsets[1:][hasPoints] - 1
+    tripOfPoint = np.repeat(np.arange(len(counts)), counts)
+    segments = haversine_meters(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    # Segments from the last point of one trip to the first point of the next are not part of any path
+    inside = tripOfPoint[:-1] == tripOfPoint[1:]
+    pathMeters = np.bincount(tripOfPoint[:-1][inside], weights=segments[inside], minlength=len(counts))
+
+    durations = (counts[hasPoints] - 1) * SECONDS_PER_POINT
+    starts = [start for start, keep in zip(startTimes, hasPoints.tolist()) if keep]
+    # Python datetimes rather than datetime64, which the connector cannot convert
+    endTimes = pd.Series([start + timedelta(seconds=duration) for start, duration in zip(starts, durations.tolist())],
+                         dtype=object)
+
+    return pd.DataFrame({
+        'tripId': np.asarray(tripIds, dtype=np.int64)[hasPoints],
+        'pointCount': counts[hasPoints],
+        'startLat': lat[first],
+        'startLon': lon[first],
+        'endLat': lat[last],
+        'endLon': lon[last],
+        'durationSeconds': durations,
+        'endTime': endTimes,
+        'distanceMeters': haversine_meters(lat[first], lon[first], lat[last], lon[last]),
+        'pathMeters': pathMeters[hasPoints],
+        'minLat': np.minimum.reduceat(lat, first),
+        'maxLat': np.maximum.reduceat(lat, first),
+        'minLon': np.minimum.reduceat(lon, first),
+        'maxLon': np.maximum.reduceat(lon, first),
+    })
+
+
+def summary_is_complete(cursor):
+    """
+    Whether trip_summary exists and is marked as holding every trip, see mark_summary.
+    """
+    cursor.execute(
+        "SELECT TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        ("trip_summary",)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    comment = row[0].decode() if isinstance(row[0], bytes) else row[0]
+    return comment == COMPLETE_COMMENT
+
+
+def mark_summary(cursor, complete):
+    """
+    Marks trip_summary as complete or not in its table comment. A table that is filled in batches or
+    left behind by a load without summaries is unmarked, so Queries does not pick it by default.
+    """
+    cursor.execute(f"ALTER TABLE trip_summary COMMENT = '{COMPLETE_COMMENT if complete else ''}'")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python tripsummary.py rebuild")
+        sys.exit(1)
+    from createtables import CreateTables
+
+    program = CreateTables()
+    try:
+        program.rebuild_trip_summary()
+    finally:
+        program.connection.close_connection()
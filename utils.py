@@ -0,0 +1,62 @@
+import os
+
+
+# What the tasks print after writing their results file; tasks 2 to 4b have always used the plain form
+OUTPUT_MESSAGE = "Full output written to file in"
+PLAIN_OUTPUT_MESSAGE = "Full output written to"
+
+
+def results_path(directory, filename):
+    """
+    Path of filename in directory, creating the directory if needed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def write_results(directory, filename, output, message=OUTPUT_MESSAGE):
+    """
+    Writes output to filename in directory and prints message followed by its path.
+    """
+    path = results_path(directory, filename)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(output)
+    print(f"{message} {path}")
+
+
+def detect_coordinates(cursor, table="point"):
+    """
+    How the point table stores coordinates: "fixed" for integer micro-degrees, "double" otherwise.
+    A database without a point table counts as "double".
+    """
+    cursor.execute(
+        """
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'latitude'
+        """,
+        (table,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return "double"
+    dataType = row[0].decode() if isinstance(row[0], bytes) else row[0]
+    return "fixed" if dataType.lower() in ("int", "integer") else "double"
+
+
+def table_exists(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, table, column):
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0